@@ -0,0 +1,162 @@
+from __future__ import annotations
+
+import os
+import sqlite3
+from dataclasses import dataclass, field
+from typing import Callable
+
+import numpy as np
+
+from .vector_store import Matrix, cosine_topk, matrix_epoch, sidecar_dir, sidecar_name
+
+# Below this many rows brute force is already fast; don't bother with an index.
+MIN_ROWS = 1024
+_BLOCK = 65536
+
+@dataclass
+class IVFIndex:
+    """IVF-flat over the sidecar matrix (any format): k-means centroids + the list each row belongs to."""
+    centroids: np.ndarray  # (nlist, dim), unit rows
+    assign: np.ndarray  # (n_rows,) list number per matrix row
+    ids: np.ndarray  # (n_rows,) chunk_id bytes per row, to carry assignments across rebuilds
+    epoch: int
+    trained_rows: int
+    _lists: tuple[np.ndarray, np.ndarray] | None = field(default=None, repr=False)
+
+    def lists(self) -> tuple[np.ndarray, np.ndarray]:
+        """(row order grouped by list, offsets) so a probe is a slice, not a scan."""
+        if self._lists is None:
+            order = np.argsort(self.assign, kind="stable")
+            counts = np.bincount(self.assign, minlength=self.centroids.shape[0])
+            self._lists = (order, np.concatenate(([0], np.cumsum(counts))))
+        return self._lists
+
+def _unit_rows(x: np.ndarray) -> np.ndarray:
+    n = np.linalg.norm(x, axis=1, keepdims=True)
+    n[n == 0] = 1.0
+    return (x / n).astype(np.float32)
+
+def _assign(mat: Matrix, centroids: np.ndarray) -> np.ndarray:
+    out = np.empty(mat.shape[0], dtype=np.int32)
+    for s in range(0, mat.shape[0], _BLOCK):
+        out[s:s + _BLOCK] = np.argmax(np.asarray(mat[s:s + _BLOCK]) @ centroids.T, axis=1)
+    return out
+
+def _kmeans(x: np.ndarray, nlist: int, iters: int, rng: np.random.Generator) -> np.ndarray:
+    """Spherical k-means (cosine) on the sample x."""
+    cent = _unit_rows(x[rng.choice(x.shape[0], nlist, replace=False)])
+    for _ in range(iters):
+        a = np.argmax(x @ cent.T, axis=1)
+        order = np.argsort(a, kind="stable")
+        counts = np.bincount(a, minlength=nlist)
+        sums = np.zeros_like(cent)
+        nonempty = np.flatnonzero(counts)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[nonempty]
+        sums[nonempty] = np.add.reduceat(x[order], starts, axis=0)
+        empty = np.flatnonzero(counts == 0)
+        if empty.size:
+            sums[empty] = x[rng.choice(x.shape[0], empty.size, replace=False)]
+        cent = _unit_rows(sums)
+    return cent
+
+def build_ivf(ids: list[str], mat: Matrix, epoch: int, nlist: int = 0, iters: int = 10, seed: int = 0) -> IVFIndex:
+    n = mat.shape[0]
+    nlist = nlist or max(1, int(np.sqrt(n)))
+    nlist = min(nlist, n)
+    rng = np.random.default_rng(seed)
+    sample_n = min(n, nlist * 64)
+    sample = np.asarray(mat[np.sort(rng.choice(n, sample_n, replace=False))], dtype=np.float32)
+    cent = _kmeans(sample, nlist, iters, rng)
+    return IVFIndex(cent, _assign(mat, cent), np.array(ids, dtype=np.bytes_), epoch, n)
+
+def _refresh(index: IVFIndex, ids: list[str], mat: Matrix, epoch: int) -> IVFIndex:
+    """Assign rows the index hasn't seen. Same epoch: only the appended tail. New epoch: match rows by chunk_id."""
+    n = mat.shape[0]
+    if index.epoch == epoch and index.assign.shape[0] <= n:
+        start = index.assign.shape[0]
+        if start == n:
+            return index
+        tail = _assign(mat[start:], index.centroids)
+        new_ids = np.array(ids[start:], dtype=np.bytes_)
+        return IVFIndex(index.centroids, np.concatenate([index.assign, tail]), np.concatenate([index.ids, new_ids]), epoch, index.trained_rows)
+    cur_ids = np.array(ids, dtype=np.bytes_)
+    assign = np.full(n, -1, dtype=np.int32)
+    if index.ids.size:
+        order = np.argsort(index.ids)
+        sorted_ids = index.ids[order]
+        pos = np.minimum(np.searchsorted(sorted_ids, cur_ids), sorted_ids.size - 1)
+        hit = sorted_ids[pos] == cur_ids
+        assign[hit] = index.assign[order[pos[hit]]]
+    missing = np.flatnonzero(assign < 0)
+    if missing.size:
+        assign[missing] = _assign(np.asarray(mat[missing]), index.centroids)
+    return IVFIndex(index.centroids, assign, cur_ids, epoch, index.trained_rows)
+
+def _ivf_path(conn: sqlite3.Connection, model: str):
+    d = sidecar_dir(conn)
+    return None if d is None else d / sidecar_name(model, ".ivf.npz")
+
+def _save(path, index: IVFIndex) -> None:
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as f:
+        np.savez(f, centroids=index.centroids, assign=index.assign, ids=index.ids,
+                 epoch=np.int64(index.epoch), trained_rows=np.int64(index.trained_rows))
+    os.replace(tmp, path)
+
+def _load(path) -> IVFIndex | None:
+    if not path.exists():
+        return None
+    with np.load(path, allow_pickle=False) as z:
+        return IVFIndex(z["centroids"], z["assign"], z["ids"], int(z["epoch"]), int(z["trained_rows"]))
+
+def load_ivf(conn: sqlite3.Connection, model: str, ids: list[str], mat: Matrix, nlist: int = 0) -> IVFIndex | None:
+    """Load <db>.vec/<model>.ivf.npz and bring it up to date with the sidecar matrix.
+
+    Centroids are retrained when the corpus has grown 4x since training, the
+    dim changed, or a different nlist is asked for; otherwise only unseen rows
+    are assigned. Returns None (caller should search exactly) for small corpora.
+    """
+    path = _ivf_path(conn, model)
+    n = mat.shape[0]
+    if path is None or n < MIN_ROWS:
+        return None
+    epoch = matrix_epoch(conn, model)
+    index = _load(path)
+    stale = (
+        index is None
+        or index.centroids.shape[1] != mat.shape[1]
+        or n > 4 * index.trained_rows
+        or (nlist and nlist != index.centroids.shape[0])
+    )
+    if stale:
+        index = build_ivf(ids, mat, epoch, nlist=nlist)
+    else:
+        fresh = _refresh(index, ids, mat, epoch)
+        if fresh is index:
+            return index
+        index = fresh
+    _save(path, index)
+    return index
+
+def ivf_topk(
+    query: np.ndarray,
+    ids: list[str],
+    mat: Matrix,
+    index: IVFIndex,
+    k: int = 10,
+    nprobe: int = 8,
+    rescore: int = 0,
+    exact: Callable[[list[str]], np.ndarray] | None = None,
+) -> list[tuple[str, float]]:
+    """Approximate cosine_topk: only score rows in the `nprobe` lists nearest the query."""
+    q = np.asarray(query, dtype=np.float32)
+    n = float(np.linalg.norm(q))
+    if n > 0:
+        q = q / n
+    nprobe = min(nprobe, index.centroids.shape[0])
+    probe = np.argpartition(-(index.centroids @ q), nprobe - 1)[:nprobe]
+    order, offsets = index.lists()
+    cand = np.sort(np.concatenate([order[offsets[i]:offsets[i + 1]] for i in probe]))
+    if cand.size == 0:
+        return []
+    return cosine_topk(q, [ids[i] for i in cand], mat[cand], k=k, rescore=rescore, exact=exact)
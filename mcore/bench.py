@@ -0,0 +1,203 @@
+from __future__ import annotations
+
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import time
+from pathlib import Path
+from typing import Callable
+
+import numpy as np
+
+from .db import connect, init_db
+from .indexer import IndexOptions, index_pages, index_pdfs
+from .ingest_pdf import PageText
+from .search import bootstrap_embeddings, related, search
+from .util import now_iso
+
+BENCH_SCHEMA = 1
+SOURCES = ("pages", "pdf")
+
+_SYLLABLES = ["ka", "lo", "mi", "ne", "su", "ta", "ri", "po", "ve", "do", "gu", "ha", "zi", "be", "fo", "ny"]
+
+def vocabulary(size: int = 5000, seed: int = 0) -> list[str]:
+    """`size` distinct pseudo-words; index 0 is the most frequent in synthetic text."""
+    rng = random.Random(seed)
+    words: dict[str, None] = {}
+    while len(words) < size:
+        words["".join(rng.choice(_SYLLABLES) for _ in range(rng.randint(2, 4)))] = None
+    return list(words)
+
+def synthetic_corpus(
+    docs: int, pages: int, words: int, seed: int = 0, vocab: list[str] | None = None
+) -> list[tuple[str, list[PageText]]]:
+    """(file name, pages) per doc; Zipf-distributed words, ~12 per line. Same seed, same corpus."""
+    vocab = vocab or vocabulary(seed=seed)
+    rng = random.Random(seed + 1)
+    weights = [1.0 / (r + 1) for r in range(len(vocab))]
+    out = []
+    for d in range(docs):
+        doc_pages = []
+        for p in range(pages):
+            ws = rng.choices(vocab, weights=weights, k=words)
+            lines = [" ".join(ws[i:i + 12]) for i in range(0, len(ws), 12)]
+            doc_pages.append(PageText(page_no=p + 1, text="\n".join(lines)))
+        out.append((f"doc{d:05d}.pdf", doc_pages))
+    return out
+
+def write_pdf(path: str | Path, pages: list[PageText]) -> None:
+    """Minimal text-only PDF (one Helvetica content stream per page), enough for the extractors."""
+    objs = [b"", b"", b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for p in pages:
+        lines = (p.text or "").replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)").split("\n")
+        stream = ("BT /F1 10 Tf 40 760 Td 12 TL\n" + "\n".join(f"({ln}) '" for ln in lines) + "\nET").encode("latin-1", "replace")
+        kids.append(len(objs) + 1)
+        objs.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Resources << /Font << /F1 3 0 R >> >> /Contents {len(objs) + 2} 0 R >>".encode())
+        objs.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+    objs[0] = b"<< /Type /Catalog /Pages 2 0 R >>"
+    objs[1] = f"<< /Type /Pages /Kids [{' '.join(f'{k} 0 R' for k in kids)}] /Count {len(kids)} >>".encode()
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for i, o in enumerate(objs, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % i + o + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objs) + 1)
+    out += b"".join(b"%010d 00000 n \n" % o for o in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objs) + 1, xref)
+    Path(path).write_bytes(bytes(out))
+
+def latency(samples: list[float]) -> dict:
+    """Summary of per-call latencies given in seconds."""
+    ms = np.array(samples) * 1000.0
+    if ms.size == 0:
+        return {"n": 0}
+    return {
+        "n": int(ms.size),
+        "mean_ms": round(float(ms.mean()), 3),
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+        "max_ms": round(float(ms.max()), 3),
+    }
+
+def _timed(fn: Callable[[object], object], args: list) -> list[float]:
+    out = []
+    for a in args:
+        t = time.perf_counter()
+        fn(a)
+        out.append(time.perf_counter() - t)
+    return out
+
+def _git_commit() -> dict:
+    root = Path(__file__).resolve().parents[1]
+    try:
+        head = subprocess.run(["git", "rev-parse", "HEAD"], cwd=root, capture_output=True, text=True, timeout=10)
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=root, capture_output=True, text=True, timeout=10)
+    except (OSError, subprocess.SubprocessError):
+        return {"commit": None, "dirty": None}
+    return {"commit": head.stdout.strip() or None, "dirty": bool(dirty.stdout.strip()) if dirty.returncode == 0 else None}
+
+def run_bench(
+    workdir: str | Path,
+    docs: int = 50,
+    pages: int = 20,
+    words: int = 250,
+    source: str = "pages",
+    queries: int = 200,
+    related_queries: int = 100,
+    embed_model: str = "hashed-bow",
+    dim: int = 768,
+    workers: int = 1,
+    min_chars: int = 200,
+    seed: int = 0,
+) -> dict:
+    """Build a synthetic corpus in workdir (fresh db), time ingest, FTS search, bootstrap embedding and related.
+
+    source="pages" feeds PageText straight to index_pages (chunking + writes
+    only); "pdf" writes text-only PDFs first and times index_pdfs, extraction
+    included. Corpus and query generation are not timed.
+    """
+    if source not in SOURCES:
+        raise ValueError(f"Unknown bench source: {source} (known: {', '.join(SOURCES)})")
+    workdir = Path(workdir)
+    workdir.mkdir(parents=True, exist_ok=True)
+    db_path = workdir / "bench.sqlite"
+    for p in (db_path, Path(f"{db_path}-wal"), Path(f"{db_path}-shm")):
+        p.unlink(missing_ok=True)
+    vocab = vocabulary(seed=seed)
+    corpus = synthetic_corpus(docs, pages, words, seed=seed, vocab=vocab)
+    rng = random.Random(seed + 2)
+
+    conn = connect(str(db_path))
+    try:
+        init_db(conn)
+        if source == "pdf":
+            paths = [str(workdir / name) for name, _ in corpus]
+            for path, (_, doc_pages) in zip(paths, corpus):
+                write_pdf(path, doc_pages)
+            t = time.perf_counter()
+            for path, _info, err in index_pdfs(conn, paths, IndexOptions(min_chars=min_chars), workers=workers):
+                if err is not None:
+                    raise RuntimeError(f"{path}: {err}") from err
+        else:
+            t = time.perf_counter()
+            for name, doc_pages in corpus:
+                index_pages(conn, str(workdir / name), doc_pages, IndexOptions(min_chars=min_chars))
+        ingest_s = time.perf_counter() - t
+        n_pages = docs * pages
+        n_chunks = int(conn.execute("SELECT COUNT(*) FROM chunk").fetchone()[0])
+
+        # Mid-frequency terms: common enough to match, rare enough to rank.
+        pool = vocab[20:500]
+        qs = [" ".join(rng.sample(pool, rng.choice((1, 2)))) for _ in range(queries)]
+        _timed(lambda q: search(conn, q, topk=10), qs[:5])
+        fts = latency(_timed(lambda q: search(conn, q, topk=10), qs))
+
+        t = time.perf_counter()
+        bootstrap_embeddings(conn, embed_model, dim)
+        embed_s = time.perf_counter() - t
+
+        rowids = [r[0] for r in conn.execute(
+            "SELECT c.rowid FROM chunk c JOIN doc d ON d.doc_id = c.doc_id ORDER BY d.source_path, c.chunk_index"
+        )]
+        picked = [rowids[i] for i in rng.sample(range(len(rowids)), min(related_queries, len(rowids)))]
+        seeds = [conn.execute("SELECT mb_text(text) FROM chunk WHERE rowid=?", (rid,)).fetchone()[0] for rid in picked]
+        cold = _timed(lambda s: related(conn, s, topk=10, embed_model=embed_model), seeds[:1])
+        rel = latency(_timed(lambda s: related(conn, s, topk=10, embed_model=embed_model), seeds))
+    finally:
+        conn.close()
+
+    return {
+        "bench_schema": BENCH_SCHEMA,
+        "created_at": now_iso(),
+        "git": _git_commit(),
+        "env": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "params": {
+            "docs": docs, "pages": pages, "words": words, "source": source, "queries": queries,
+            "related_queries": related_queries, "embed_model": embed_model, "dim": dim,
+            "workers": workers, "min_chars": min_chars, "seed": seed,
+        },
+        "ingest": {
+            "seconds": round(ingest_s, 4),
+            "pages": n_pages,
+            "chunks": n_chunks,
+            "pages_per_s": round(n_pages / ingest_s, 1) if ingest_s else None,
+            "db_bytes": db_path.stat().st_size,
+        },
+        "fts": fts,
+        "embed": {
+            "seconds": round(embed_s, 4),
+            "chunks": n_chunks,
+            "chunks_per_s": round(n_chunks / embed_s, 1) if embed_s else None,
+        },
+        "related": {**rel, "cold_ms": round(cold[0] * 1000.0, 3) if cold else None},
+    }
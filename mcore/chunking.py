@@ -1,11 +1,40 @@
 from __future__ import annotations
 
-from typing import List
+import hashlib
+from typing import Dict, Iterable, Iterator, List
 from .ingest_pdf import PageText
 
-def chunk_pages(pages: List[PageText], min_chars: int = 200) -> List[tuple[int,int,str]]:
-    """Return list of (page_start, page_end, text). Merge short pages."""
-    chunks: List[tuple[int,int,str]] = []
+def page_hash(text: str | None) -> str | None:
+    """Hash of a page's stripped text; None for an empty page."""
+    t = (text or "").strip()
+    return hashlib.blake2b(t.encode("utf-8"), digest_size=16).hexdigest() if t else None
+
+def page_hashes(pages: Iterable[PageText]) -> Dict[int, str]:
+    """page_no -> hash of the page's text, for pages with text (empty pages never reach a chunk)."""
+    out: Dict[int, str] = {}
+    for p in pages:
+        h = page_hash(p.text)
+        if h:
+            out[p.page_no] = h
+    return out
+
+def chunk_keys(chunks: List[tuple[int,int,str]], hashes: Dict[int, str]) -> List[str]:
+    """Identity of each chunk: the hashes of the pages it was built from.
+
+    Equal keys mean equal text, wherever the pages moved to in the document.
+    """
+    keys = []
+    for ps, pe, _ in chunks:
+        span = "".join(hashes[n] for n in range(ps, pe + 1) if n in hashes)
+        keys.append(hashlib.blake2b(span.encode("ascii"), digest_size=16).hexdigest())
+    return keys
+
+def iter_chunks(pages: Iterable[PageText], min_chars: int = 200) -> Iterator[tuple[int,int,str]]:
+    """Yield (page_start, page_end, text) as pages arrive, merging short pages.
+
+    Holds one chunk's worth of text at a time, so `pages` can be a generator
+    over a document of any size.
+    """
     buf_text = ""
     buf_start = None
     buf_end = None
@@ -23,12 +52,14 @@ def chunk_pages(pages: List[PageText], min_chars: int = 200) -> List[tuple[int,i
                 buf_end = p.page_no
                 buf_text += "\n\n" + t
             else:
-                chunks.append((buf_start, buf_end or buf_start, buf_text))
+                yield (buf_start, buf_end or buf_start, buf_text)
                 buf_start = p.page_no
                 buf_end = p.page_no
                 buf_text = t
 
     if buf_start is not None and buf_text.strip():
-        chunks.append((buf_start, buf_end or buf_start, buf_text))
+        yield (buf_start, buf_end or buf_start, buf_text)
 
-    return chunks
+def chunk_pages(pages: Iterable[PageText], min_chars: int = 200) -> List[tuple[int,int,str]]:
+    """Return list of (page_start, page_end, text). Merge short pages."""
+    return list(iter_chunks(pages, min_chars=min_chars))
@@ -1,20 +1,290 @@
 from __future__ import annotations
 
 import sqlite3
+import time
+from contextlib import contextmanager
 from pathlib import Path
+from typing import Iterator
+
+from . import textcodec
+from .simhash import simhash
+from .metrics import metrics
 
 SCHEMA_PATH = Path(__file__).with_name("schema.sql")
+SCHEMA_VERSION = 11
+
+# Connection-level pragmas callers may tune (see service/deps.py for the env mapping).
+TUNABLE_PRAGMAS = ("cache_size", "mmap_size", "temp_store", "synchronous", "busy_timeout")
 
-def connect(db_path: str) -> sqlite3.Connection:
+def connect(
+    db_path: str,
+    pragmas: dict[str, str | int] | None = None,
+    check_same_thread: bool = True,
+    cached_statements: int = 128,
+) -> sqlite3.Connection:
     p = Path(db_path)
     p.parent.mkdir(parents=True, exist_ok=True)
-    conn = sqlite3.connect(str(p))
+    conn = sqlite3.connect(str(p), check_same_thread=check_same_thread, cached_statements=cached_statements)
     conn.row_factory = sqlite3.Row
+    textcodec.register(conn)
     conn.execute("PRAGMA foreign_keys=ON;")
     conn.execute("PRAGMA journal_mode=WAL;")
+    for name, value in (pragmas or {}).items():
+        if name not in TUNABLE_PRAGMAS:
+            raise ValueError(f"Unsupported pragma: {name}")
+        if not str(value).lstrip("-").isalnum():
+            raise ValueError(f"Bad value for pragma {name}: {value!r}")
+        conn.execute(f"PRAGMA {name}={value};")
     return conn
 
+def _migrate(conn: sqlite3.Connection, version: int) -> None:
+    """Bring an existing db up to SCHEMA_VERSION. schema.sql runs afterwards and recreates dropped objects."""
+    if version < 1:
+        # The FTS 'delete' command only works on external-content tables; these used it on a plain one.
+        conn.execute("DROP TRIGGER IF EXISTS trg_chunk_ad")
+        conn.execute("DROP TRIGGER IF EXISTS trg_chunk_au")
+    if version < 2:
+        for col in ("file_size", "mtime_ns", "inode"):
+            conn.execute(f"ALTER TABLE doc ADD COLUMN {col} INTEGER")
+    if version < 3:
+        conn.execute("ALTER TABLE doc ADD COLUMN folder_id INTEGER REFERENCES folder(folder_id)")
+    if version < 5:
+        # chunk_fts kept its own copy of every chunk's text (v4), then read chunk.text directly,
+        # which may now be compressed (v5); recreate it over the decompressing chunk_plain view.
+        _replace_fts(conn, fts_tokenizer(conn))
+    if version < 6:
+        _add_column(conn, "embedding", "vec_format TEXT NOT NULL DEFAULT 'f32'")
+        _add_column(conn, "embedding_matrix", "quant TEXT NOT NULL DEFAULT 'f32'")
+    if version < 7:
+        conn.execute("DROP TRIGGER IF EXISTS trg_chunk_au")  # now fires on text updates only
+    if version < 8:
+        _add_column(conn, "doc", "canonical_doc_id TEXT REFERENCES doc(doc_id)")
+    if version < 9:
+        _add_column(conn, "chunk", "simhash INTEGER")
+        _add_column(conn, "chunk", "near_dup_of TEXT REFERENCES chunk(chunk_id) ON DELETE SET NULL")
+    if version < 10:
+        # Indexed text gained a two-space tail; a trigram index must be rebuilt to match it.
+        conn.execute("DROP VIEW IF EXISTS chunk_plain")
+        for trg in ("trg_chunk_ai", "trg_chunk_ad", "trg_chunk_au"):
+            conn.execute(f"DROP TRIGGER IF EXISTS {trg}")
+        if fts_tokenizer(conn) == "trigram":
+            _replace_fts(conn, "trigram")
+    if version < 11:
+        # Their 'delete' now skips rows a bulk load has not indexed yet.
+        conn.execute("DROP TRIGGER IF EXISTS trg_chunk_ad")
+        conn.execute("DROP TRIGGER IF EXISTS trg_chunk_au")
+
+def _add_column(conn: sqlite3.Connection, table: str, decl: str) -> None:
+    """ALTER TABLE ADD COLUMN, skipped when the table is missing (schema.sql creates it whole)."""
+    cols = {r[1] for r in conn.execute(f"PRAGMA table_info({table})")}
+    if cols and decl.split()[0] not in cols:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {decl}")
+
+def _backfill(conn: sqlite3.Connection, version: int) -> None:
+    """Data steps of a migration that need the tables schema.sql just created."""
+    if version < 3:
+        for r in conn.execute("SELECT doc_id, source_path FROM doc WHERE folder_id IS NULL").fetchall():
+            conn.execute("UPDATE doc SET folder_id=? WHERE doc_id=?", (ensure_folder(conn, r["source_path"]), r["doc_id"]))
+    if version < 9:
+        backfill_simhash(conn)
+
+def backfill_simhash(conn: sqlite3.Connection, batch: int = 1000) -> None:
+    """Compute chunk.simhash where it is missing, paging by rowid. Does not commit."""
+    last = 0
+    while True:
+        rows = conn.execute(
+            "SELECT rowid, mb_text(text) FROM chunk WHERE rowid > ? AND simhash IS NULL ORDER BY rowid LIMIT ?", (last, batch)
+        ).fetchall()
+        if not rows:
+            return
+        conn.executemany("UPDATE chunk SET simhash=? WHERE rowid=?", [(simhash(t), rid) for rid, t in rows])
+        last = rows[-1][0]
+
+def _fts_unmerged(conn: sqlite3.Connection) -> bool:
+    """True if chunks may be missing from chunk_fts: its insert trigger is gone or a bulk load never merged."""
+    names = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE name IN ('trg_chunk_ai', 'meta')")}
+    if "trg_chunk_ai" not in names:
+        return True
+    return "meta" in names and conn.execute("SELECT 1 FROM meta WHERE key='fts_bulk_load'").fetchone() is not None
+
+def require_mb_text(conn: sqlite3.Connection) -> None:
+    """Raise unless conn has mb_text(), which chunk_fts, its triggers and the chunk_plain view call."""
+    try:
+        conn.execute("SELECT mb_text(NULL)")
+    except sqlite3.OperationalError as e:
+        raise RuntimeError(
+            "This connection lacks the mb_text() SQL function the membox schema needs (chunk_fts reads "
+            "chunk text through it): open the db with mcore.db.connect() or call mcore.textcodec.register(conn)"
+        ) from e
+
 def init_db(conn: sqlite3.Connection) -> None:
+    require_mb_text(conn)
     schema = SCHEMA_PATH.read_text(encoding="utf-8")
+    fresh = conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='doc'").fetchone() is None
+    version = int(conn.execute("PRAGMA user_version").fetchone()[0])
+    unmerged = not fresh and _fts_unmerged(conn)
+    if not fresh and version < SCHEMA_VERSION:
+        _migrate(conn, version)
     conn.executescript(schema)
+    if not fresh and version < SCHEMA_VERSION:
+        _backfill(conn, version)
+    if unmerged:
+        merge_fts(conn)
+    if version < SCHEMA_VERSION:
+        conn.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
     conn.commit()
+
+def ensure_folder(conn: sqlite3.Connection, source_path: str) -> int:
+    """folder_id of the directory containing source_path, created on first use."""
+    path = str(Path(source_path).parent)
+    conn.execute("INSERT OR IGNORE INTO folder(path) VALUES(?)", (path,))
+    return int(conn.execute("SELECT folder_id FROM folder WHERE path=?", (path,)).fetchone()[0])
+
+def path_range(prefix: str) -> tuple[str, str]:
+    """[lo, hi) bounds of every string starting with prefix, for BINARY-collated index range scans."""
+    return prefix, prefix + "\U0010ffff"
+
+FTS_TOKENIZERS = ("unicode61", "trigram")
+
+def fts_tokenizer(conn: sqlite3.Connection) -> str:
+    """Tokenizer chunk_fts was created with: 'trigram' (substring/CJK mode) or 'unicode61'."""
+    row = conn.execute("SELECT sql FROM sqlite_master WHERE name='chunk_fts'").fetchone()
+    return "trigram" if row and "trigram" in row[0] else "unicode61"
+
+def create_fts(conn: sqlite3.Connection, tokenizer: str = "unicode61") -> None:
+    """Create chunk_fts as an external-content index over chunk_plain (same definition as schema.sql)."""
+    if tokenizer not in FTS_TOKENIZERS:
+        raise ValueError(f"Unknown FTS tokenizer: {tokenizer} (known: {', '.join(FTS_TOKENIZERS)})")
+    conn.execute("""
+      CREATE VIEW IF NOT EXISTS chunk_plain AS
+        SELECT rowid AS chunk_rowid, mb_text(text) || '  ' AS text, doc_id, chunk_id, page_start FROM chunk
+    """)
+    conn.execute(f"""
+      CREATE VIRTUAL TABLE chunk_fts USING fts5(
+        text,
+        doc_id UNINDEXED,
+        chunk_id UNINDEXED,
+        page_start UNINDEXED,
+        content = 'chunk_plain',
+        content_rowid = 'chunk_rowid',
+        tokenize = '{tokenizer}'
+      )
+    """)
+
+def _replace_fts(conn: sqlite3.Connection, tokenizer: str) -> None:
+    """Drop chunk_fts and its triggers, then recreate and fill it. init_db() restores the triggers."""
+    for trg in ("trg_chunk_ai", "trg_chunk_ad", "trg_chunk_au"):
+        conn.execute(f"DROP TRIGGER IF EXISTS {trg}")
+    conn.execute("DROP TABLE IF EXISTS chunk_fts")
+    create_fts(conn, tokenizer)
+    conn.execute("INSERT INTO chunk_fts(chunk_fts) VALUES('rebuild')")
+    conn.execute("INSERT INTO chunk_fts(chunk_fts) VALUES('optimize')")
+
+def rebuild_fts(conn: sqlite3.Connection, tokenizer: str = "unicode61") -> None:
+    """Rebuild chunk_fts from chunk with the given tokenizer (migration step).
+
+    unicode61 indexes whole words, so a run of Han characters is one token and
+    sub-phrases never match; trigram indexes every 3-character window instead.
+    Also the fix for an index that no longer matches chunk (e.g. after VACUUM
+    renumbered rowids).
+    """
+    _replace_fts(conn, tokenizer)
+    bump_data_generation(conn)
+    conn.commit()
+    init_db(conn)
+
+def vacuum(conn: sqlite3.Connection) -> None:
+    """VACUUM with chunk_fts dropped first, then rebuilt.
+
+    VACUUM may renumber chunk rowids, which the external-content index points
+    at, and dropping it first also means its old pages are not carried over.
+    """
+    tokenizer = fts_tokenizer(conn)
+    for trg in ("trg_chunk_ai", "trg_chunk_ad", "trg_chunk_au"):
+        conn.execute(f"DROP TRIGGER IF EXISTS {trg}")
+    conn.execute("DROP TABLE IF EXISTS chunk_fts")
+    conn.commit()
+    conn.execute("VACUUM")
+    rebuild_fts(conn, tokenizer)
+
+def data_generation(conn: sqlite3.Connection) -> int:
+    """Counter that moves whenever indexed content changes; caches key on it."""
+    row = conn.execute("SELECT value FROM meta WHERE key='data_generation'").fetchone()
+    return int(row[0]) if row else 0
+
+def bump_data_generation(conn: sqlite3.Connection) -> None:
+    conn.execute(
+        "INSERT INTO meta(key, value) VALUES('data_generation', 1) "
+        "ON CONFLICT(key) DO UPDATE SET value = value + 1"
+    )
+
+@contextmanager
+def fts_bulk_load(conn: sqlite3.Connection) -> Iterator[sqlite3.Connection]:
+    """Suspend the chunk -> chunk_fts insert trigger; merge the missing rows once on exit.
+
+    The delete and update triggers keep running but skip rows not indexed yet,
+    so chunks inserted and then replaced or deleted meanwhile are simply never indexed.
+    """
+    conn.execute("DROP TRIGGER IF EXISTS trg_chunk_ai")
+    conn.execute("INSERT OR REPLACE INTO meta(key, value) VALUES('fts_bulk_load', 1)")  # init_db merges if we die
+    conn.commit()
+    try:
+        yield conn
+    finally:
+        conn.commit()
+        t = time.perf_counter()
+        merge_fts(conn)
+        conn.commit()
+        metrics.observe("ingest_stage_seconds", time.perf_counter() - t, stage="fts_merge")
+        init_db(conn)
+
+def merge_fts(conn: sqlite3.Connection) -> None:
+    """Index the chunks chunk_fts is missing and clear the bulk-load flag. Does not commit."""
+    # chunk_fts reads rows through from chunk, so ask its docsize shadow table what is indexed.
+    conn.execute("""
+      INSERT INTO chunk_fts(rowid, text, doc_id, chunk_id, page_start)
+      SELECT c.rowid, mb_text(c.text) || '  ', c.doc_id, c.chunk_id, c.page_start
+      FROM chunk c
+      WHERE c.rowid NOT IN (SELECT id FROM chunk_fts_docsize)
+    """)
+    if fts_problems(conn):
+        conn.execute("INSERT INTO chunk_fts(chunk_fts) VALUES('rebuild')")
+        metrics.inc("ingest_fts_rebuilds_total")
+    conn.execute("INSERT INTO chunk_fts(chunk_fts) VALUES('optimize')")
+    conn.execute("DELETE FROM meta WHERE key='fts_bulk_load'")
+
+def _fts_total_rows(conn: sqlite3.Connection) -> int:
+    """The row count chunk_fts keeps for bm25: the first varint of its averages record (id 1)."""
+    row = conn.execute("SELECT block FROM chunk_fts_data WHERE id=1").fetchone()
+    n = 0
+    for i, b in enumerate(row[0] if row else b""):
+        if i == 8:
+            return (n << 8) | b
+        n = (n << 7) | (b & 0x7F)
+        if b < 0x80:
+            break
+    return n
+
+def fts_problems(conn: sqlite3.Connection, deep: bool = False) -> list[str]:
+    """What is out of line between chunk and chunk_fts, if anything.
+
+    Counts chunks it lacks, rows it has for gone chunks, and a row total off
+    from its rows (what a 'delete' of a row it never indexed leaves); `deep`
+    also runs FTS5's integrity-check, which reads every chunk.
+    """
+    problems = []
+    missing = conn.execute("SELECT COUNT(*) FROM chunk WHERE rowid NOT IN (SELECT id FROM chunk_fts_docsize)").fetchone()[0]
+    stale = conn.execute("SELECT COUNT(*) FROM chunk_fts_docsize WHERE id NOT IN (SELECT rowid FROM chunk)").fetchone()[0]
+    indexed = conn.execute("SELECT COUNT(*) FROM chunk_fts_docsize").fetchone()[0]
+    if missing:
+        problems.append(f"{missing} chunks are not indexed")
+    if stale:
+        problems.append(f"{stale} indexed rows have no chunk")
+    if _fts_total_rows(conn) != indexed:
+        problems.append(f"row total {_fts_total_rows(conn)} != {indexed} indexed rows")
+    if deep:
+        try:
+            conn.execute("INSERT INTO chunk_fts(chunk_fts) VALUES('integrity-check')")
+        except sqlite3.DatabaseError as e:
+            problems.append(f"integrity-check: {e}")
+    return problems
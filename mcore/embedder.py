@@ -3,20 +3,77 @@ from __future__ import annotations
 import re
 import numpy as np
 import hashlib
+from functools import lru_cache
+from typing import Callable, Sequence
 
 _TOKEN_RE = re.compile(r"[A-Za-z0-9_]+|[\u4e00-\u9fff]+")
+# Han (incl. ext. A / compatibility), kana and Hangul runs are split into overlapping bigrams.
+_CJK_TOKEN_RE = re.compile(r"[A-Za-z0-9_]+|[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\u3040-\u30ff\uac00-\ud7af]+")
 
 def _tokenize(text: str) -> list[str]:
     return _TOKEN_RE.findall(text.lower())
 
+def _tokenize_cjk(text: str) -> list[str]:
+    out: list[str] = []
+    for tok in _CJK_TOKEN_RE.findall(text.lower()):
+        if tok.isascii() or len(tok) < 3:
+            out.append(tok)
+        else:
+            out.extend(tok[i:i + 2] for i in range(len(tok) - 1))
+    return out
+
+@lru_cache(maxsize=1 << 18)
+def _token_slot(tok: str, dim: int) -> tuple[int, float]:
+    h = hashlib.blake2b(tok.encode("utf-8"), digest_size=8).digest()
+    idx = int.from_bytes(h[:4], "little") % dim
+    sign = 1.0 if (h[4] & 1) == 0 else -1.0
+    return idx, sign
+
+def embed_batch(texts: Sequence[str], dim: int = 768) -> np.ndarray:
+    """Hashed bag-of-words vectors for many texts at once, shape (len(texts), dim).
+
+    Token -> (index, sign) is memoized; counts are scattered with one bincount.
+    Rows are bit-identical to hashed_bow_embedding() on the same text.
+    """
+    return _embed(texts, dim, _tokenize)
+
+def embed_batch_cjk(texts: Sequence[str], dim: int = 768) -> np.ndarray:
+    """Like embed_batch, but CJK runs count as overlapping character bigrams instead of one token."""
+    return _embed(texts, dim, _tokenize_cjk)
+
+def _embed(texts: Sequence[str], dim: int, tokenize: Callable[[str], list[str]]) -> np.ndarray:
+    n = len(texts)
+    vocab: dict[str, int] = {}
+    tok_ids: list[int] = []
+    lengths = np.zeros(n, dtype=np.int64)
+    for row, text in enumerate(texts):
+        toks = tokenize(text)
+        lengths[row] = len(toks)
+        tok_ids.extend([vocab.setdefault(t, len(vocab)) for t in toks])
+    slots = np.array([_token_slot(t, dim) for t in vocab], dtype=np.float64).reshape(-1, 2)
+    ids = np.asarray(tok_ids, dtype=np.int64)
+    flat = np.repeat(np.arange(n, dtype=np.int64) * dim, lengths) + slots[ids, 0].astype(np.int64)
+    # Per-cell sums are small integers, exact in float64 and after the float32 cast.
+    counts = np.bincount(flat, weights=slots[ids, 1], minlength=n * dim)
+    mat = counts.astype(np.float32).reshape(n, dim)
+    for i in range(n):
+        v = mat[i]
+        # Same per-vector norm call as the single-text path, to keep results bit-identical.
+        norm = float(np.linalg.norm(v))
+        if norm > 0:
+            v /= norm
+    return mat
+
 def hashed_bow_embedding(text: str, dim: int = 768) -> np.ndarray:
-    v = np.zeros(dim, dtype=np.float32)
-    for tok in _tokenize(text):
-        h = hashlib.blake2b(tok.encode("utf-8"), digest_size=8).digest()
-        idx = int.from_bytes(h[:4], "little") % dim
-        sign = 1.0 if (h[4] & 1) == 0 else -1.0
-        v[idx] += sign
-    n = float(np.linalg.norm(v))
-    if n > 0:
-        v /= n
-    return v
+    return embed_batch([text], dim=dim)[0]
+
+EMBED_MODELS: dict[str, Callable[[Sequence[str], int], np.ndarray]] = {
+    "hashed-bow": embed_batch,
+    "hashed-bow-cjk": embed_batch_cjk,
+}
+
+def get_embedder(model: str) -> Callable[[Sequence[str], int], np.ndarray]:
+    try:
+        return EMBED_MODELS[model]
+    except KeyError:
+        raise ValueError(f"Unknown embedding model: {model} (known: {', '.join(EMBED_MODELS)})") from None
@@ -1,59 +1,866 @@
 from __future__ import annotations
 
+import hashlib
+import multiprocessing
 import sqlite3
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from contextlib import ExitStack
+from dataclasses import dataclass
 from pathlib import Path
+from itertools import chain, islice
+from typing import Callable, Iterable, Iterator
 
-from .util import now_iso, uuid4, sha256_file, norm_path
-from .ingest_pdf import extract_pdf_pages
-from .chunking import chunk_pages
+import numpy as np
 
-def upsert_doc(conn: sqlite3.Connection, source_path: str, sha256: str, title: str | None = None, mime: str | None = None) -> tuple[str, bool]:
+from .db import bump_data_generation, ensure_folder, fts_bulk_load
+from .embedder import get_embedder
+from .vector_store import ensure_matrix, matrix_current, upsert_embeddings, write_embeddings
+from .util import now_iso, uuid4, sha256_file, file_signature, norm_path
+from .ingest_pdf import PageText, iter_pdf_pages, page_ranges, pdf_page_count
+from .metrics import metrics
+from .textcodec import encode_texts
+from .simhash import DISTANCE, band_sql, bands, distance, simhashes
+from .chunking import chunk_keys, chunk_pages, iter_chunks, page_hash, page_hashes
+
+WRITE_BATCH = 256  # chunks per insert while a doc streams in
+POOL_RANGE_PAGES = 100  # pages a pool job extracts at most; longer docs come back range by range
+
+Chunk = tuple[int, int, str]  # (page_start, page_end, text)
+
+def upsert_doc(
+    conn: sqlite3.Connection,
+    source_path: str,
+    sha256: str,
+    title: str | None = None,
+    mime: str | None = None,
+    commit: bool = True,
+    file_sig: tuple[int, int, int] | None = None,
+) -> tuple[str, bool]:
     source_path = norm_path(source_path)
+    size, mtime_ns, inode = file_sig or (None, None, None)
     row = conn.execute("SELECT doc_id, sha256 FROM doc WHERE source_path = ?", (source_path,)).fetchone()
     now = now_iso()
     if row is None:
         doc_id = uuid4()
         conn.execute(
-            "INSERT INTO doc(doc_id, source_path, title, mime, sha256, created_at, updated_at) VALUES(?,?,?,?,?,?,?)",
-            (doc_id, source_path, title, mime, sha256, now, now),
+            "INSERT INTO doc(doc_id, source_path, title, mime, sha256, file_size, mtime_ns, inode, folder_id, created_at, updated_at) VALUES(?,?,?,?,?,?,?,?,?,?,?)",
+            (doc_id, source_path, title, mime, sha256, size, mtime_ns, inode, ensure_folder(conn, source_path), now, now),
         )
+        changed = True
+    else:
+        doc_id = row["doc_id"]
+        changed = row["sha256"] != sha256
+        if changed:
+            conn.execute("UPDATE doc SET sha256=?, updated_at=? WHERE doc_id=?", (sha256, now, doc_id))
+        if file_sig is not None:
+            conn.execute("UPDATE doc SET file_size=?, mtime_ns=?, inode=? WHERE doc_id=?", (size, mtime_ns, inode, doc_id))
+    if commit and conn.in_transaction:
         conn.commit()
-        return doc_id, True
-    doc_id = row["doc_id"]
-    if row["sha256"] != sha256:
-        conn.execute("UPDATE doc SET sha256=?, updated_at=? WHERE doc_id=?", (sha256, now, doc_id))
-        conn.commit()
-        return doc_id, True
-    return doc_id, False
+    return doc_id, changed
 
-def delete_doc_chunks(conn: sqlite3.Connection, doc_id: str) -> None:
+def delete_doc_chunks(conn: sqlite3.Connection, doc_id: str, commit: bool = True) -> None:
+    doomed = [r[0] for r in conn.execute("SELECT chunk_id FROM chunk WHERE doc_id = ?", (doc_id,))]
+    _release_near_dups(conn, doc_id, doomed)
     conn.execute("DELETE FROM chunk WHERE doc_id = ?", (doc_id,))
-    conn.commit()
-
-def index_pdf(conn: sqlite3.Connection, pdf_path: str, force: bool = False, min_chars: int = 200) -> dict:
-    pdf_path = norm_path(pdf_path)
-    sha = sha256_file(pdf_path)
-    title = Path(pdf_path).name
-    doc_id, changed = upsert_doc(conn, pdf_path, sha, title=title, mime="application/pdf")
-    if force:
-        changed = True
-    if not changed:
-        return {"doc_id": doc_id, "source_path": pdf_path, "status": "unchanged"}
+    if commit:
+        conn.commit()
+
+def insert_chunks(
+    conn: sqlite3.Connection,
+    doc_id: str,
+    chunks: list[Chunk],
+    indexes: list[int] | None = None,
+    hashes: list[int] | None = None,
+) -> list[str]:
+    """Insert a doc's chunks with one executemany and return their chunk_ids. Does not commit.
+
+    `indexes` are their chunk_index values (default 0..n-1), `hashes` their
+    SimHashes (computed if not given). Text is compressed with the db's
+    active dictionary, if compression is on.
+    """
+    now = now_iso()
+    chunk_ids = [uuid4() for _ in chunks]
+    stored = encode_texts(conn, [text for _, _, text in chunks])
+    indexes = indexes if indexes is not None else list(range(len(chunks)))
+    hashes = hashes if hashes is not None else simhashes(text for _, _, text in chunks)
+    conn.executemany(
+        "INSERT INTO chunk(chunk_id, doc_id, chunk_index, page_start, page_end, text, char_count, simhash, created_at) VALUES(?,?,?,?,?,?,?,?,?)",
+        [
+            (cid, doc_id, idx, ps, pe, st, len(text), h, now)
+            for idx, cid, st, h, (ps, pe, text) in zip(indexes, chunk_ids, stored, hashes, chunks)
+        ],
+    )
+    return chunk_ids
+
+def near_duplicate(
+    conn: sqlite3.Connection,
+    h: int,
+    embed_model: str | None = None,
+    exclude_doc: str | None = None,
+    max_distance: int = DISTANCE,
+) -> str | None:
+    """chunk_id of a stored chunk within max_distance bits of SimHash h, or None.
+
+    Looked up through the LSH band indexes. With embed_model, only chunks
+    that have its embedding count; exclude_doc leaves out that doc's chunks.
+    """
+    if h == 0:
+        return None  # no words
+    sql = "SELECT c.chunk_id, c.simhash FROM chunk c"
+    params: list[object] = []
+    if embed_model is not None:
+        sql += " JOIN embedding e ON e.chunk_id = c.chunk_id AND e.embedding_model = ?"
+        params.append(embed_model)
+    if exclude_doc is not None:
+        sql += " WHERE c.doc_id != ? AND"
+        params.append(exclude_doc)
+    else:
+        sql += " WHERE"
+    for i, band in enumerate(bands(h)):
+        for cid, other in conn.execute(f"{sql} {band_sql(i, 'c.simhash')} = ?", (*params, band)):
+            if distance(h, other) <= max_distance:
+                return cid
+    return None
+
+def _skip_near_dups(
+    conn: sqlite3.Connection,
+    doc_id: str,
+    chunk_ids: list[str],
+    hashes: list[int],
+    embed_model: str,
+    own: dict[tuple[int, int], list[tuple[int, str]]],
+) -> set[str]:
+    """Point new chunks that nearly duplicate an embedded chunk at it (near_dup_of); returns their ids.
+
+    Other docs' chunks are looked up in the db; this doc's are in `own`
+    (LSH band -> [(simhash, chunk_id)] of its new chunks that get embedded),
+    since its stored chunks may be about to go and its new ones are not
+    embedded until the caller writes them.
+    """
+    skipped: dict[str, str] = {}
+    for cid, h in zip(chunk_ids, hashes):
+        keys = list(enumerate(bands(h)))
+        match = next((c for k in keys for oh, c in own.get(k, ()) if distance(h, oh) <= DISTANCE), None) if h else None
+        match = match or near_duplicate(conn, h, embed_model, exclude_doc=doc_id)
+        if match is not None:
+            skipped[cid] = match
+        elif h:
+            for k in keys:
+                own.setdefault(k, []).append((h, cid))
+    conn.executemany("UPDATE chunk SET near_dup_of=? WHERE chunk_id=?", [(m, c) for c, m in skipped.items()])
+    return set(skipped)
+
+def _release_near_dups(conn: sqlite3.Connection, doc_id: str, doomed: list[str]) -> int:
+    """Before doc_id's `doomed` chunks are deleted, give the chunks whose embedding they stand in for
+    another embedded near-duplicate, or embed them now (in the caller's transaction). Returns how many."""
+    gone = set(doomed)
+    rows: list[sqlite3.Row] = []
+    for i in range(0, len(doomed), 500):
+        part = doomed[i:i + 500]
+        rows += conn.execute(f"""
+          SELECT c.chunk_id, c.simhash, mb_text(c.text) AS text, e.embedding_model, e.embedding_dim, e.vec_format
+          FROM chunk c JOIN embedding e ON e.chunk_id = c.near_dup_of
+          WHERE c.near_dup_of IN ({",".join("?" * len(part))})
+        """, part).fetchall()
+    rows = [r for r in rows if r["chunk_id"] not in gone]
+    orphans: dict[tuple[str, int, str], list[sqlite3.Row]] = {}
+    for r in rows:
+        other = near_duplicate(conn, r["simhash"], r["embedding_model"], exclude_doc=doc_id)
+        if other is not None:
+            conn.execute("UPDATE chunk SET near_dup_of=? WHERE chunk_id=?", (other, r["chunk_id"]))
+        else:
+            orphans.setdefault((r["embedding_model"], r["embedding_dim"], r["vec_format"]), []).append(r)
+    for (model, dim, quant), group in orphans.items():
+        vecs = get_embedder(model)([r["text"] for r in group], dim)
+        write_embeddings(conn, [(r["chunk_id"], model, dim, v) for r, v in zip(group, vecs)], quant)
+        conn.executemany("UPDATE chunk SET near_dup_of=NULL WHERE chunk_id=?", [(r["chunk_id"],) for r in group])
+    if rows:
+        metrics.inc("ingest_chunks_total", sum(map(len, orphans.values())), kind="embed_released")
+    return len(rows)
+
+def embed_gaps(conn: sqlite3.Connection, model: str, dim: int, batch: int = 1024) -> int:
+    """Embed chunks that have neither an embedding nor a near_dup_of stand-in, in docs otherwise
+    embedded with `model` (e.g. left behind by an older version). Returns how many."""
+    rows = conn.execute("""
+      SELECT c.chunk_id, mb_text(c.text) AS text FROM chunk c
+      WHERE c.near_dup_of IS NULL
+        AND NOT EXISTS (SELECT 1 FROM embedding e WHERE e.chunk_id = c.chunk_id)
+        AND EXISTS (
+          SELECT 1 FROM chunk o JOIN embedding e ON e.chunk_id = o.chunk_id AND e.embedding_model = ? WHERE o.doc_id = c.doc_id
+        )
+    """, (model,)).fetchall()
+    embed = get_embedder(model)
+    for i in range(0, len(rows), batch):
+        part = rows[i:i + batch]
+        upsert_embeddings(conn, [(r["chunk_id"], model, dim, v) for r, v in zip(part, embed([r["text"] for r in part], dim))], sync_matrix=False)
+    metrics.inc("ingest_chunks_total", len(rows), kind="embed_repaired")
+    return len(rows)
+
+def _reusable(conn: sqlite3.Connection, doc_id: str, embed_model: str | None = None) -> dict[str, list[str]]:
+    """chunk key -> chunk_ids (in chunk order) of the doc's stored chunks, from the stored page hashes.
+
+    With embed_model, only chunks that already have that model's embedding count.
+    """
+    hashes = dict(conn.execute("SELECT page_no, text_hash FROM page WHERE doc_id=?", (doc_id,)).fetchall())
+    if not hashes:
+        return {}
+    sql = "SELECT c.chunk_id, c.page_start, c.page_end FROM chunk c"
+    params: list[object] = [doc_id]
+    where = "c.doc_id=?"
+    if embed_model is not None:
+        # A near-duplicate whose embedding was skipped counts as embedded.
+        sql += " LEFT JOIN embedding e ON e.chunk_id = c.chunk_id AND e.embedding_model = ?"
+        params.insert(0, embed_model)
+        where += " AND (e.chunk_id IS NOT NULL OR c.near_dup_of IS NOT NULL)"
+    rows = conn.execute(f"{sql} WHERE {where} ORDER BY c.chunk_index", params).fetchall()
+    out: dict[str, list[str]] = {}
+    for r, key in zip(rows, chunk_keys([(r["page_start"], r["page_end"], "") for r in rows], hashes)):
+        out.setdefault(key, []).append(r["chunk_id"])
+    return out
+
+def _write_pages(conn: sqlite3.Connection, doc_id: str, hashes: dict[int, str]) -> None:
+    """Store the doc's page hashes, touching only pages that changed."""
+    old = dict(conn.execute("SELECT page_no, text_hash FROM page WHERE doc_id=?", (doc_id,)).fetchall())
+    conn.executemany(
+        "INSERT INTO page(doc_id, page_no, text_hash) VALUES(?,?,?) "
+        "ON CONFLICT(doc_id, page_no) DO UPDATE SET text_hash=excluded.text_hash",
+        [(doc_id, n, h) for n, h in hashes.items() if old.get(n) != h],
+    )
+    conn.executemany("DELETE FROM page WHERE doc_id=? AND page_no=?", [(doc_id, n) for n in old if n not in hashes])
 
-    delete_doc_chunks(conn, doc_id)
+def extract_chunks(pdf_path: str, min_chars: int = 200) -> list[Chunk]:
+    """Extract + chunk one PDF. Pure CPU work, safe to run in a worker process."""
+    return list(iter_chunks(iter_pdf_pages(pdf_path), min_chars=min_chars))
 
-    pages = extract_pdf_pages(pdf_path)
+Keyed = tuple[Chunk, str]
+
+def _stream_chunks(
+    pages: Iterable[PageText], min_chars: int, hashes: dict[int, str], stage: str | None = "extract"
+) -> Iterator[Keyed]:
+    """(chunk, key) as pages come in, adding each page's hash to `hashes` on the way.
+
+    Time spent pulling pages is recorded as `stage` (None: not at all), the rest as chunk.
+    """
+    pulled = 0.0
+
+    def hashed() -> Iterator[PageText]:
+        nonlocal pulled
+        it = iter(pages)
+        while True:
+            t = time.perf_counter()
+            page = next(it, None)
+            pulled += time.perf_counter() - t
+            if page is None:
+                return
+            metrics.inc("ingest_pages_total")
+            h = page_hash(page.text)
+            if h:
+                hashes[page.page_no] = h
+            yield page
+
+    chunks = iter_chunks(hashed(), min_chars=min_chars)
+    inside = 0.0
+    try:
+        while True:
+            t = time.perf_counter()
+            chunk = next(chunks, None)
+            inside += time.perf_counter() - t
+            if chunk is None:
+                return
+            yield chunk, chunk_keys([chunk], hashes)[0]
+    finally:
+        chunks.close()
+        if stage is not None:
+            metrics.observe("ingest_stage_seconds", pulled, stage=stage)
+        metrics.observe("ingest_stage_seconds", inside - pulled, stage="chunk")
+
+Prepared = tuple[list[PageText], dict[int, np.ndarray] | None, list[tuple[int, int]]]
+
+def _extract_job(
+    pdf_path: str, min_chars: int, embed_model: str | None, dim: int, known: dict[str, int] | None = None
+) -> Prepared:
+    """Worker-side job: (pages, embeddings by chunk index, page ranges left for the caller to extract).
+
+    A doc of more than POOL_RANGE_PAGES pages comes back as its first range,
+    unembedded, plus the remaining ranges, so no process holds it whole.
+    Otherwise the chunks the writer will cut are embedded, if asked, except
+    those whose key is in `known` (key -> number of stored chunks it can keep).
+    """
+    ranges = _split(pdf_path, POOL_RANGE_PAGES) or [(1, None)]
+    with metrics.timer("ingest_stage_seconds", stage="extract"):
+        pages = list(iter_pdf_pages(pdf_path, *ranges[0]))
+    if embed_model is None or len(ranges) > 1:
+        return pages, None, ranges[1:]
     chunks = chunk_pages(pages, min_chars=min_chars)
+    keys = chunk_keys(chunks, page_hashes(pages))
+    left = dict(known or {})
+    todo = []
+    for i, key in enumerate(keys):
+        if left.get(key):
+            left[key] -= 1
+        else:
+            todo.append(i)
+    with metrics.timer("ingest_stage_seconds", stage="embed"):
+        vecs = get_embedder(embed_model)([chunks[i][2] for i in todo], dim) if todo else []
+    return pages, dict(zip(todo, vecs)), []
 
-    now = now_iso()
-    for idx, (ps, pe, text) in enumerate(chunks):
-        chunk_id = uuid4()
-        conn.execute(
-            "INSERT INTO chunk(chunk_id, doc_id, chunk_index, page_start, page_end, text, char_count, created_at) VALUES(?,?,?,?,?,?,?,?)",
-            (chunk_id, doc_id, idx, ps, pe, text, len(text), now),
+def _extract_range(pdf_path: str, first: int, last: int) -> list[PageText]:
+    """Worker-side job: the pages first..last of one PDF."""
+    return list(iter_pdf_pages(pdf_path, first, last))
+
+def _pool_job(fn: Callable, *args) -> tuple[object, Exception | None, dict]:
+    """fn(*args) in a pool process: (result, error, metrics recorded for this job) for the parent to merge."""
+    metrics.reset()
+    try:
+        return fn(*args), None, metrics.snapshot()
+    except Exception as e:  # noqa: BLE001
+        return None, e, metrics.snapshot()
+
+def _iter_ranges(pool: ProcessPoolExecutor, pdf_path: str, ranges: list[tuple[int, int]], ahead: int) -> Iterator[PageText]:
+    """Pages of one PDF in page order, its ranges extracted in the pool with up to `ahead` in flight."""
+    todo = iter(ranges)
+    pending: deque[Future] = deque()
+    try:
+        while True:
+            while len(pending) < ahead and (r := next(todo, None)) is not None:
+                pending.append(pool.submit(_pool_job, _extract_range, pdf_path, *r))
+            if not pending:
+                return
+            pages, err, snap = pending.popleft().result()
+            metrics.merge(snap)
+            if err is not None:
+                raise err
+            yield from pages
+    finally:
+        for f in pending:
+            f.cancel()
+
+def _split(pdf_path: str, split_pages: int) -> list[tuple[int, int]] | None:
+    """Page ranges for a doc longer than split_pages pages, else None (also when its pages can't be counted)."""
+    try:
+        n = pdf_page_count(pdf_path)
+    except Exception:  # noqa: BLE001
+        return None
+    return page_ranges(n, split_pages) if n > split_pages else None
+
+def _pool_context() -> multiprocessing.context.BaseContext:
+    """Start method for the extraction pool: fork only from a single-threaded process.
+
+    Forking while another thread (e.g. the API's request threads) holds a lock,
+    such as metrics' own, leaves the child waiting on it forever.
+    """
+    if threading.active_count() == 1:
+        return multiprocessing.get_context()
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+def _embed_fn(embed_model: str | None, dim: int) -> Callable[[list[str]], list[np.ndarray]] | None:
+    if embed_model is None:
+        return None
+    embedder = get_embedder(embed_model)
+    return lambda texts: list(embedder(texts, dim))
+
+def _known(conn: sqlite3.Connection, doc_id: str | None, embed_model: str | None) -> dict[str, int] | None:
+    if doc_id is None:
+        return None
+    return {key: len(ids) for key, ids in _reusable(conn, doc_id, embed_model).items()}
+
+def _check_doc(conn: sqlite3.Connection, pdf_path: str, force: bool, verify: bool = False) -> tuple[str | None, str, bool, tuple[int, int, int]]:
+    """Return (doc_id, sha256, needs_index, file_sig).
+
+    sha256 is only recomputed when (size, mtime_ns, inode) differ from the
+    stored values, or when `verify` asks for it. A file that was touched but
+    hashes the same gets its stored signature refreshed (not committed here).
+    """
+    sig = file_signature(pdf_path)
+    row = conn.execute(
+        "SELECT doc_id, sha256, file_size, mtime_ns, inode FROM doc WHERE source_path = ?", (pdf_path,)
+    ).fetchone()
+    if row is not None and not verify and (row["file_size"], row["mtime_ns"], row["inode"]) == sig:
+        return row["doc_id"], row["sha256"], force, sig
+    with metrics.timer("ingest_stage_seconds", stage="hash"):
+        sha = sha256_file(pdf_path)
+    metrics.inc("ingest_bytes_hashed_total", sig[0])
+    if row is None:
+        return None, sha, True, sig
+    if not force and row["sha256"] == sha:
+        conn.execute("UPDATE doc SET file_size=?, mtime_ns=?, inode=? WHERE doc_id=?", (*sig, row["doc_id"]))
+        return row["doc_id"], sha, False, sig
+    return row["doc_id"], sha, True, sig
+
+CACHED = "cached"  # _iter_checked job: replay the text cache
+DUPLICATE = "duplicate"  # _iter_checked job: same content as another doc; link to it
+
+def canonical_doc(conn: sqlite3.Connection, sha: str, exclude: str | None = None) -> sqlite3.Row | None:
+    """(doc_id, source_path) of the doc holding the chunks for content `sha`, other than `exclude`."""
+    return conn.execute(
+        "SELECT doc_id, source_path FROM doc WHERE sha256=? AND canonical_doc_id IS NULL AND doc_id IS NOT ? "
+        "ORDER BY created_at, source_path LIMIT 1",
+        (sha, exclude),
+    ).fetchone()
+
+def _hand_off(conn: sqlite3.Connection, doc_id: str) -> None:
+    """If other docs are aliases of doc_id, make the first of them canonical and move doc_id's chunks
+    and page hashes to it (chunk_ids, embeddings and FTS entries stay), so doc_id can change content."""
+    heir = conn.execute("SELECT doc_id FROM doc WHERE canonical_doc_id=? ORDER BY source_path LIMIT 1", (doc_id,)).fetchone()
+    if heir is None:
+        return
+    heir = heir[0]
+    conn.execute("UPDATE doc SET canonical_doc_id=NULL WHERE doc_id=?", (heir,))
+    conn.execute("UPDATE doc SET canonical_doc_id=? WHERE canonical_doc_id=?", (heir, doc_id))
+    conn.execute("UPDATE chunk SET doc_id=? WHERE doc_id=?", (heir, doc_id))
+    conn.execute("UPDATE page SET doc_id=? WHERE doc_id=?", (heir, doc_id))
+    bump_data_generation(conn)
+
+def _make_alias(conn: sqlite3.Connection, doc_id: str, canonical_id: str) -> None:
+    """Point doc_id at canonical_id and drop its own chunks (after handing them to its aliases, if any)."""
+    _hand_off(conn, doc_id)
+    delete_doc_chunks(conn, doc_id, commit=False)
+    conn.execute("DELETE FROM page WHERE doc_id=?", (doc_id,))
+    conn.execute("UPDATE doc SET canonical_doc_id=? WHERE doc_id=?", (canonical_id, doc_id))
+    bump_data_generation(conn)
+
+def _write_alias(
+    conn: sqlite3.Connection, pdf_path: str, sha: str, canonical: sqlite3.Row, file_sig: tuple[int, int, int] | None = None
+) -> dict:
+    """Upsert the doc row as another path of `canonical`'s content: no chunks of its own. The caller owns the transaction."""
+    old = conn.execute("SELECT doc_id FROM doc WHERE source_path=?", (pdf_path,)).fetchone()
+    if old is not None:
+        _hand_off(conn, old["doc_id"])  # before its sha changes, so its aliases keep their content
+    doc_id, _ = upsert_doc(conn, pdf_path, sha, title=Path(pdf_path).name, mime="application/pdf", commit=False, file_sig=file_sig)
+    _make_alias(conn, doc_id, canonical["doc_id"])
+    return {"doc_id": doc_id, "source_path": pdf_path, "status": "duplicate", "chunks": 0, "duplicate_of": canonical["source_path"]}
+
+def dedupe_docs(conn: sqlite3.Connection) -> int:
+    """Fold docs indexed separately with the same sha256 into the oldest one; returns how many became aliases.
+
+    For dbs indexed before dedup; new copies are linked at ingest. Does not commit.
+    """
+    made = 0
+    dups = conn.execute(
+        "SELECT sha256 FROM doc WHERE canonical_doc_id IS NULL AND sha256 IS NOT NULL GROUP BY sha256 HAVING COUNT(*) > 1"
+    ).fetchall()
+    for (sha,) in dups:
+        keep = canonical_doc(conn, sha)
+        others = conn.execute(
+            "SELECT doc_id FROM doc WHERE sha256=? AND canonical_doc_id IS NULL AND doc_id != ?", (sha, keep["doc_id"])
+        ).fetchall()
+        for (doc_id,) in others:
+            _make_alias(conn, doc_id, keep["doc_id"])
+            made += 1
+    return made
+
+def has_cached_text(conn: sqlite3.Connection, sha: str) -> bool:
+    row = conn.execute("SELECT page_count FROM text_cache WHERE sha256=?", (sha,)).fetchone()
+    return row is not None and row[0] is not None
+
+def cached_pages(conn: sqlite3.Connection, sha: str) -> Iterator[PageText]:
+    """The pages stored for file content `sha`, in page order, as the extractor returned them."""
+    cur = conn.execute(
+        "SELECT page_no, mb_text(text), extractor, extractor_version FROM text_cache_page WHERE sha256=? ORDER BY page_no", (sha,)
+    )
+    for page_no, text, extractor, version in cur:
+        yield PageText(page_no=page_no, text=text, extractor=extractor, extractor_version=version)
+
+def _caching(conn: sqlite3.Connection, sha: str, pages: Iterable[PageText], batch: int = WRITE_BATCH) -> Iterator[PageText]:
+    """Pass pages through, storing them `batch` at a time as the cached text of `sha`.
+
+    The entry only counts as complete (page_count set) once the last page went by.
+    """
+    conn.execute("DELETE FROM text_cache WHERE sha256=?", (sha,))
+    conn.execute("INSERT INTO text_cache(sha256, page_count, created_at) VALUES(?, NULL, ?)", (sha, now_iso()))
+    buf: list[PageText] = []
+    n = 0
+
+    def flush() -> None:
+        stored = encode_texts(conn, [p.text or "" for p in buf])
+        conn.executemany(
+            "INSERT INTO text_cache_page(sha256, page_no, extractor, extractor_version, text) VALUES(?,?,?,?,?)",
+            [(sha, p.page_no, p.extractor or "", p.extractor_version, st) for p, st in zip(buf, stored)],
         )
-    conn.commit()
-    return {"doc_id": doc_id, "source_path": pdf_path, "status": "indexed", "chunks": len(chunks)}
+        buf.clear()
+
+    for page in pages:
+        buf.append(page)
+        n += 1
+        if len(buf) >= batch:
+            flush()
+        yield page
+    flush()
+    conn.execute("UPDATE text_cache SET page_count=? WHERE sha256=?", (n, sha))
+
+def clear_text_cache(conn: sqlite3.Connection) -> int:
+    """Drop all cached page text; returns how many file contents had some. Does not commit."""
+    return conn.execute("DELETE FROM text_cache").rowcount
+
+def prune_text_cache(conn: sqlite3.Connection) -> int:
+    """Drop cached text of file contents no doc has any more. Does not commit."""
+    return conn.execute("DELETE FROM text_cache WHERE sha256 NOT IN (SELECT sha256 FROM doc WHERE sha256 IS NOT NULL)").rowcount
+
+@dataclass(frozen=True)
+class IndexOptions:
+    """How docs are chunked and embedded at ingest."""
+
+    min_chars: int = 200
+    embed_model: str | None = None  # also embed new chunks, so `related` needs no bootstrap
+    dim: int = 768
+    quant: str | None = None  # f32/f16/i8 format of the model's sidecar matrix
+    skip_near_dups: bool = False  # don't embed chunks within simhash.DISTANCE bits of an embedded one
+    text_cache: bool = False  # keep extracted page text (a second compressed copy) for re-chunking without the PDF
+
+def _open_doc(
+    conn: sqlite3.Connection, pdf_path: str, sha: str, file_sig: tuple[int, int, int] | None, embed_model: str | None, reuse: bool
+) -> tuple[str, dict[str, list[str]], dict[str, tuple[int, int, int]]]:
+    """Upsert the doc row: (doc_id, reusable chunk_ids by key, stored chunk_id -> (index, page_start, page_end)).
+
+    With nothing to reuse, its stored chunks are deleted right away.
+    """
+    prev = conn.execute("SELECT doc_id, sha256 FROM doc WHERE source_path=?", (pdf_path,)).fetchone()
+    if prev is not None and prev["sha256"] != sha:
+        _hand_off(conn, prev["doc_id"])  # its aliases keep the old content
+    doc_id, _ = upsert_doc(conn, pdf_path, sha, title=Path(pdf_path).name, mime="application/pdf", commit=False, file_sig=file_sig)
+    conn.execute("UPDATE doc SET canonical_doc_id=NULL WHERE doc_id=? AND canonical_doc_id IS NOT NULL", (doc_id,))
+    old = _reusable(conn, doc_id, embed_model) if reuse else {}
+    if not old:
+        delete_doc_chunks(conn, doc_id, commit=False)
+        return doc_id, old, {}
+    rows = conn.execute("SELECT chunk_id, chunk_index, page_start, page_end FROM chunk WHERE doc_id=?", (doc_id,)).fetchall()
+    return doc_id, old, {r["chunk_id"]: (r["chunk_index"], r["page_start"], r["page_end"]) for r in rows}
+
+def _match_batch(
+    conn: sqlite3.Connection,
+    part: list[tuple[Chunk, str | None]],
+    start: int,
+    old: dict[str, list[str]],
+    stored: dict[str, tuple[int, int, int]],
+    kept: set[str],
+) -> tuple[list[tuple[int, Chunk]], int]:
+    """Keep the stored chunk for each key in `old` (renumbered if it moved, added to `kept`): ([(index, chunk)] to insert, moved)."""
+    fresh: list[tuple[int, Chunk]] = []
+    updates = []
+    for i, (chunk, key) in enumerate(part, start):
+        ids = old.get(key) if key is not None else None
+        if ids:
+            cid = ids.pop(0)
+            kept.add(cid)
+            if stored[cid] != (i, *chunk[:2]):
+                updates.append((i, *chunk[:2], cid))
+        else:
+            fresh.append((i, chunk))
+    conn.executemany("UPDATE chunk SET chunk_index=?, page_start=?, page_end=? WHERE chunk_id=?", updates)
+    return fresh, len(updates)
+
+def _insert_batch(
+    conn: sqlite3.Connection,
+    doc_id: str,
+    fresh: list[tuple[int, Chunk]],
+    skip_model: str | None,
+    own: dict[tuple[int, int], list[tuple[int, str]]],
+) -> tuple[list[tuple[int, Chunk]], list[str], int]:
+    """Insert `fresh`: (those to embed, their chunk_ids, skipped). With skip_model, near duplicates are skipped (see _skip_near_dups)."""
+    sims = simhashes(text for _, (_, _, text) in fresh)
+    chunk_ids = insert_chunks(conn, doc_id, [c for _, c in fresh], [i for i, _ in fresh], sims)
+    if skip_model is None or not fresh:
+        return fresh, chunk_ids, 0
+    near = _skip_near_dups(conn, doc_id, chunk_ids, sims, skip_model, own)
+    keep = [k for k, cid in enumerate(chunk_ids) if cid not in near]
+    return [fresh[k] for k in keep], [chunk_ids[k] for k in keep], len(near)
+
+def _embed_batch(
+    embed: Callable[[list[str]], list[np.ndarray]], fresh: list[tuple[int, Chunk]], chunk_ids: list[str]
+) -> list[tuple[str, np.ndarray]]:
+    """[(chunk_id, vector)] of a batch's inserted chunks."""
+    return list(zip(chunk_ids, embed([text for _, (_, _, text) in fresh])))
+
+def _drop_stale(conn: sqlite3.Connection, doc_id: str, stale: list[str]) -> None:
+    """Delete stored chunks nothing matched (embeddings go through the FK cascade), releasing their near duplicates first."""
+    _release_near_dups(conn, doc_id, stale)
+    conn.executemany("DELETE FROM chunk WHERE chunk_id=?", [(cid,) for cid in stale])
+
+def _write_doc(
+    conn: sqlite3.Connection,
+    pdf_path: str,
+    sha: str,
+    keyed: Iterable[tuple[Chunk, str | None]],
+    opts: IndexOptions,
+    file_sig: tuple[int, int, int] | None = None,
+    hashes: dict[int, str] | None = None,
+    embed: Callable[[list[str]], list[np.ndarray]] | None = None,
+) -> tuple[dict, list[tuple[int, str]], list[tuple[str, np.ndarray]]]:
+    """Upsert the doc row and bring its chunks in line with `keyed`, WRITE_BATCH at a time. The caller owns the transaction.
+
+    `keyed` yields (chunk, key or None); stored chunks with the same key are
+    kept. `hashes` (page hashes, None: reuse nothing) is read after the last
+    chunk. Returns (info, [(chunk index, chunk_id)] of the inserted chunks to
+    embed, [(chunk_id, vector)] from `embed`).
+    """
+    t = time.perf_counter()
+    doc_id, old, stored = _open_doc(conn, pdf_path, sha, file_sig, opts.embed_model, hashes is not None)
+    skip_model = opts.embed_model if opts.skip_near_dups else None
+    writing, embedding = time.perf_counter() - t, 0.0
+    it = iter(keyed)
+    n = moved = skipped = 0
+    kept: set[str] = set()
+    own: dict[tuple[int, int], list[tuple[int, str]]] = {}
+    inserted: list[tuple[int, str]] = []
+    vectors: list[tuple[str, np.ndarray]] = []
+    while part := list(islice(it, WRITE_BATCH)):
+        t = time.perf_counter()
+        fresh, m = _match_batch(conn, part, n, old, stored, kept)
+        fresh, chunk_ids, s = _insert_batch(conn, doc_id, fresh, skip_model, own)
+        n, moved, skipped = n + len(part), moved + m, skipped + s
+        inserted += zip([i for i, _ in fresh], chunk_ids)
+        writing += time.perf_counter() - t
+        if embed is not None and fresh:
+            t = time.perf_counter()
+            vectors += _embed_batch(embed, fresh, chunk_ids)
+            embedding += time.perf_counter() - t
+    t = time.perf_counter()
+    stale = [cid for cid in stored if cid not in kept]
+    _drop_stale(conn, doc_id, stale)
+    if hashes is not None:
+        _write_pages(conn, doc_id, hashes)
+    if not old or stale or moved or inserted or skipped:
+        bump_data_generation(conn)
+    metrics.observe("ingest_stage_seconds", writing + time.perf_counter() - t, stage="write")
+    if embed is not None:
+        metrics.observe("ingest_stage_seconds", embedding, stage="embed")
+    metrics.inc("ingest_chunks_total", len(inserted) + skipped, kind="inserted")
+    metrics.inc("ingest_chunks_total", len(kept), kind="reused")
+    info = {"doc_id": doc_id, "source_path": pdf_path, "status": "indexed", "chunks": n, "reused": len(kept)}
+    if skip_model is not None:
+        metrics.inc("ingest_chunks_total", skipped, kind="embed_skipped")
+        info["near_duplicates"] = skipped
+    return info, inserted, vectors
+
+def index_pdf(
+    conn: sqlite3.Connection,
+    pdf_path: str,
+    options: IndexOptions | None = None,
+    force: bool = False,
+    verify: bool = False,
+) -> dict:
+    [(_p, info, err)] = index_pdfs(conn, [pdf_path], options, force=force, verify=verify)
+    if err is not None:
+        raise err
+    return info
+
+def index_pages(
+    conn: sqlite3.Connection,
+    source_path: str,
+    pages: list[PageText],
+    options: IndexOptions | None = None,
+    commit: bool = True,
+) -> dict:
+    """Index already extracted pages as the doc at source_path; no file is read.
+
+    For fixtures, benchmarks and text from other extractors. The doc's sha256
+    is taken over the page texts, so unchanged pages are skipped like files.
+    """
+    opts = options or IndexOptions()
+    sha = hashlib.sha256("\f".join(p.text or "" for p in pages).encode("utf-8")).hexdigest()
+    row = conn.execute("SELECT doc_id, sha256 FROM doc WHERE source_path=?", (norm_path(source_path),)).fetchone()
+    if row is not None and row["sha256"] == sha:
+        return {"doc_id": row["doc_id"], "source_path": source_path, "status": "unchanged"}
+    hashes: dict[int, str] = {}
+    info, _inserted, vectors = _write_doc(
+        conn, norm_path(source_path), sha, _stream_chunks(pages, opts.min_chars, hashes), opts,
+        hashes=hashes, embed=_embed_fn(opts.embed_model, opts.dim),
+    )
+    if commit:
+        conn.commit()
+    if vectors:
+        upsert_embeddings(
+            conn, [(cid, opts.embed_model, opts.dim, v) for cid, v in vectors], sync_matrix=matrix_current(conn, opts.embed_model)
+        )
+    return info
+
+def index_pdfs(
+    conn: sqlite3.Connection,
+    pdf_paths: Iterable[str],
+    options: IndexOptions | None = None,
+    force: bool = False,
+    verify: bool = False,
+    reextract: bool = False,
+    workers: int = 1,
+    out_of_process: bool = False,
+    split_pages: int = 0,
+    batch_docs: int = 1,
+    bulk: bool = False,
+) -> Iterator[tuple[str, dict | None, Exception | None]]:
+    """Index many PDFs, yielding (path, info, error) in input order; this process is the only SQLite writer.
+
+    `force`/`verify`/`reextract` re-index, re-hash and re-extract regardless;
+    `workers`/`out_of_process`/`split_pages` set up the extraction pool;
+    commits come every `batch_docs` docs, and `bulk` fills chunk_fts once at the end.
+    """
+    opts = options or IndexOptions()
+    embed_model = opts.embed_model
+    if embed_model is not None:
+        get_embedder(embed_model)
+    emb_items: list[tuple[str, str, int, np.ndarray]] = []
+    written = 0
+
+    def commit_batch() -> None:
+        with metrics.timer("ingest_stage_seconds", stage="commit"):
+            conn.commit()
+        if emb_items:
+            # Append to the sidecar only while it is current; otherwise ensure_matrix rebuilds once at the end.
+            with metrics.timer("ingest_stage_seconds", stage="embed_write"):
+                upsert_embeddings(conn, emb_items, sync_matrix=matrix_current(conn, embed_model))
+            emb_items.clear()
+
+    def sync_matrix() -> None:
+        if written:
+            embed_gaps(conn, embed_model, opts.dim)
+        with metrics.timer("ingest_stage_seconds", stage="matrix"):
+            ensure_matrix(conn, embed_model, opts.quant)
+
+    with ExitStack() as stack:
+        use_pool = workers > 1 or out_of_process
+        pool = stack.enter_context(ProcessPoolExecutor(max_workers=max(1, workers), mp_context=_pool_context())) if use_pool else None
+        if bulk:
+            stack.enter_context(fts_bulk_load(conn))
+        if embed_model is not None:
+            stack.callback(sync_matrix)
+        stack.callback(commit_batch)
+        stack.callback(prune_text_cache, conn)
+        in_batch = 0
+        ahead = max(1, workers) * 2
+        checked = _iter_checked(conn, pdf_paths, force, verify, opts, pool, ahead, split_pages, reextract)
+        for p, norm, doc_id, sha, sig, job, err in checked:
+            if err is not None:
+                metrics.inc("ingest_docs_total", status="failed")
+                yield p, None, err
+                continue
+            if job is None:
+                metrics.inc("ingest_docs_total", status="unchanged")
+                yield p, {"doc_id": doc_id, "source_path": norm, "status": "unchanged"}, None
+                continue
+            if not conn.in_transaction:
+                conn.execute("BEGIN")
+            conn.execute("SAVEPOINT index_doc")
+            try:
+                canonical = canonical_doc(conn, sha, doc_id) if job == DUPLICATE else None
+                if canonical is not None:
+                    info, vectors = _write_alias(conn, norm, sha, canonical, file_sig=sig), []
+                else:
+                    info, vectors = _index_doc(conn, norm, sha, sig, job, pool, ahead, opts)
+            except Exception as e:  # noqa: BLE001
+                conn.execute("ROLLBACK TO index_doc")
+                conn.execute("RELEASE index_doc")
+                metrics.inc("ingest_docs_total", status="failed")
+                yield p, None, e
+                continue
+            conn.execute("RELEASE index_doc")
+            emb_items.extend((cid, embed_model, opts.dim, v) for cid, v in vectors)
+            metrics.inc("ingest_docs_total", status=info["status"])
+            written += 1
+            in_batch += 1
+            if in_batch >= batch_docs:
+                commit_batch()
+                in_batch = 0
+            yield p, info, None
+
+def _index_doc(
+    conn: sqlite3.Connection,
+    norm: str,
+    sha: str,
+    sig: tuple[int, int, int] | None,
+    job: Future | list | str | bool,
+    pool: ProcessPoolExecutor | None,
+    ahead: int,
+    opts: IndexOptions,
+) -> tuple[dict, list[tuple[str, np.ndarray]]]:
+    """Get the doc's pages as `job` says (see _iter_checked) and write its chunks: (info, [(chunk_id, vector)]).
+
+    A DUPLICATE whose original is gone (it failed earlier in the run) is
+    extracted inline. Pool workers embed before near duplicates are known, so
+    with skip_near_dups the skipped chunks' vectors are dropped.
+    """
+    vecs = None
+    if isinstance(job, Future):
+        prepared, job_err, snap = job.result()
+        metrics.merge(snap)
+        if job_err is not None:
+            raise job_err
+        pages, vecs, rest = prepared
+        stage = None  # timed in the worker
+        if rest:
+            pages, stage = chain(pages, _iter_ranges(pool, norm, rest, ahead)), "extract"
+    elif job == CACHED:
+        pages, stage = cached_pages(conn, sha), "text_cache"
+    elif isinstance(job, list):
+        pages, stage = _iter_ranges(pool, norm, job, ahead), "extract"
+    else:
+        pages, stage = iter_pdf_pages(norm), "extract"
+    if job != CACHED and opts.text_cache:
+        pages = _caching(conn, sha, pages)
+    elif job != CACHED:
+        conn.execute("DELETE FROM text_cache WHERE sha256=?", (sha,))  # re-extracted without caching: drop the old text
+    # Pages stream into batched writes; pool results were embedded in the worker.
+    hashes: dict[int, str] = {}
+    info, inserted, vectors = _write_doc(
+        conn, norm, sha, _stream_chunks(pages, opts.min_chars, hashes, stage), opts, file_sig=sig,
+        hashes=hashes, embed=_embed_fn(opts.embed_model, opts.dim) if vecs is None else None,
+    )
+    if vecs:
+        vectors = [(cid, vecs[i]) for i, cid in inserted if i in vecs]
+    return info, vectors
+
+def _iter_checked(
+    conn: sqlite3.Connection,
+    pdf_paths: Iterable[str],
+    force: bool,
+    verify: bool,
+    opts: IndexOptions,
+    pool: ProcessPoolExecutor | None,
+    max_pending: int,
+    split_pages: int = 0,
+    reextract: bool = False,
+) -> Iterator[tuple[str, str, str | None, str, tuple | None, Future | list | str | bool | None, Exception | None]]:
+    """Yield (path, norm_path, doc_id, sha, file_sig, job, error) in input order.
+
+    job is None for unchanged docs, DUPLICATE when a doc with the same sha256
+    is indexed already or comes earlier in this run, CACHED when the doc's
+    text is in the text cache, a Future when extraction was submitted to the
+    pool, page ranges when the caller should have the pool extract the doc in
+    pieces (see index_pdfs), or True when the caller should extract inline.
+    At most `max_pending` entries are kept ahead so results don't pile up in
+    memory.
+    """
+    pending: deque = deque()
+    queued: set[str] = set()  # sha256 of docs ahead of this one in the run
+    for p in pdf_paths:
+        try:
+            norm = norm_path(p)
+            doc_id, sha, needed, sig = _check_doc(conn, norm, force, verify)
+        except Exception as e:  # noqa: BLE001
+            pending.append((p, p, None, "", None, None, e))
+        else:
+            job: Future | list | str | bool | None = None
+            if needed:
+                if sha in queued or canonical_doc(conn, sha, doc_id) is not None:
+                    job = DUPLICATE
+                elif not reextract and has_cached_text(conn, sha):
+                    job = CACHED
+                elif pool is not None and split_pages > 0 and (ranges := _split(norm, split_pages)):
+                    job = ranges
+                elif pool is not None:
+                    job = pool.submit(
+                        _pool_job, _extract_job, norm, opts.min_chars, opts.embed_model, opts.dim, _known(conn, doc_id, opts.embed_model)
+                    )
+                else:
+                    job = True
+                queued.add(sha)
+            pending.append((p, norm, doc_id, sha, sig, job, None))
+        while len(pending) >= max_pending:
+            yield pending.popleft()
+    while pending:
+        yield pending.popleft()
 
 def list_pdfs(path: str, glob_pat: str = "*.pdf") -> list[str]:
     p = Path(path).expanduser().resolve()
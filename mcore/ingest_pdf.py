@@ -1,58 +1,187 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
-from typing import List
+from functools import lru_cache
+from typing import Iterator, List
 from pathlib import Path
+import codecs
 import subprocess
 import shutil
+import time
+
+from .metrics import metrics
+
+READ_BLOCK = 1 << 16  # bytes of pdftotext output read at a time
 
 @dataclass
 class PageText:
     page_no: int  # 1-based
     text: str
+    extractor: str | None = None  # pymupdf, pypdf or pdftotext; set by iter_pdf_pages
+    extractor_version: str | None = None
 
-def _extract_with_pymupdf(pdf_path: str) -> List[PageText]:
+def _extract_with_pymupdf(pdf_path: str, first: int = 1, last: int | None = None) -> Iterator[PageText]:
     import fitz  # PyMuPDF
     doc = fitz.open(pdf_path)
-    out: List[PageText] = []
-    for i in range(doc.page_count):
-        page = doc.load_page(i)
-        text = page.get_text("text") or ""
-        out.append(PageText(page_no=i+1, text=text))
-    doc.close()
-    return out
-
-def _extract_with_pypdf(pdf_path: str) -> List[PageText]:
+    try:
+        for i in range(first - 1, min(last or doc.page_count, doc.page_count)):
+            page = doc.load_page(i)
+            yield PageText(page_no=i+1, text=page.get_text("text") or "")
+    finally:
+        doc.close()
+
+def _extract_with_pypdf(pdf_path: str, first: int = 1, last: int | None = None) -> Iterator[PageText]:
     from pypdf import PdfReader
     reader = PdfReader(pdf_path)
-    out: List[PageText] = []
-    for i, page in enumerate(reader.pages):
-        text = page.extract_text() or ""
-        out.append(PageText(page_no=i+1, text=text))
-    return out
+    n = len(reader.pages)
+    for i in range(first - 1, min(last or n, n)):
+        yield PageText(page_no=i+1, text=reader.pages[i].extract_text() or "")
 
-def _extract_with_pdftotext(pdf_path: str) -> List[PageText]:
+def _extract_with_pdftotext(pdf_path: str, first: int = 1, last: int | None = None) -> Iterator[PageText]:
+    """Read pdftotext's stdout in blocks and yield each page at its form feed; blank pages are skipped."""
     pdftotext = shutil.which("pdftotext")
     if not pdftotext:
         raise RuntimeError("pdftotext not found")
-    proc = subprocess.run([pdftotext, "-layout", pdf_path, "-"], check=True, stdout=subprocess.PIPE)
-    txt = proc.stdout.decode("utf-8", errors="ignore")
-    pages = txt.split("\f")
-    out: List[PageText] = []
-    for i, t in enumerate(pages):
-        t = t.strip()
-        if t:
-            out.append(PageText(page_no=i+1, text=t))
-    return out
+    pages = ["-f", str(first)] + (["-l", str(last)] if last else [])
+    proc = subprocess.Popen([pdftotext, "-layout", *pages, pdf_path, "-"], stdout=subprocess.PIPE)
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+    buf = ""
+    page_no = first
+    try:
+        while True:
+            block = proc.stdout.read(READ_BLOCK)
+            buf += decoder.decode(block, final=not block)
+            *done, buf = buf.split("\f")
+            for t in done:
+                t = t.strip()
+                if t:
+                    yield PageText(page_no=page_no, text=t)
+                page_no += 1
+            if not block:
+                break
+        if proc.wait() != 0:  # before the last page, which may be cut short
+            raise subprocess.CalledProcessError(proc.returncode, proc.args)
+        if buf.strip():
+            yield PageText(page_no=page_no, text=buf.strip())
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+        proc.stdout.close()
+        proc.wait()
 
-def extract_pdf_pages(pdf_path: str) -> List[PageText]:
+EXTRACTORS = (_extract_with_pymupdf, _extract_with_pypdf, _extract_with_pdftotext)
+
+@lru_cache(maxsize=None)
+def extractor_version(name: str) -> str | None:
+    """Installed version of an extractor backend, or None if it can't be told."""
+    try:
+        if name == "pymupdf":
+            import fitz  # PyMuPDF
+            return str(fitz.VersionBind)
+        if name == "pypdf":
+            import pypdf
+            return str(pypdf.__version__)
+        if name == "pdftotext":
+            proc = subprocess.run([shutil.which("pdftotext") or "pdftotext", "-v"], capture_output=True, text=True, timeout=10)
+            words = (proc.stderr or proc.stdout).split()
+            return words[2] if len(words) > 2 and words[1] == "version" else None
+    except Exception:
+        return None
+    return None
+
+def iter_pdf_pages(pdf_path: str, first: int = 1, last: int | None = None) -> Iterator[PageText]:
+    """Pages, one at a time, from the first extractor that yields any; attempts are timed and counted in metrics.
+
+    An extractor that raises or yields nothing falls through to the next one.
+    If it raises after handing out pages, the next extractor resumes at the
+    page after the last one handed out; the error is raised only when no later
+    extractor gets through the rest (one that finds no text there ends the doc). `first`..`last` (1-based, inclusive;
+    last=None for the end) limits it to a page range.
+    """
     pdf_path = str(Path(pdf_path).expanduser().resolve())
     errors = []
-    for fn in (_extract_with_pymupdf, _extract_with_pypdf, _extract_with_pdftotext):
+    resumed = blank = False  # pages handed out before a failure; a later extractor found none after it
+    for fn in EXTRACTORS:
+        name = fn.__name__.removeprefix("_extract_with_")
+        t = time.perf_counter()
+        it = fn(pdf_path, first, last)
         try:
-            pages = fn(pdf_path)
-            if pages:
-                return pages
+            page = next(it, None)
         except Exception as e:
             errors.append(f"{fn.__name__}: {e}")
+            _attempt(name, time.perf_counter() - t, "error", e)
+            continue
+        if page is None:
+            _attempt(name, time.perf_counter() - t, "empty")
+            blank = blank or resumed
+            continue
+        if fn is not EXTRACTORS[0]:
+            metrics.inc("ingest_extract_fallbacks_total", extractor=name)
+        version = extractor_version(name)
+        spent = time.perf_counter() - t
+        result = "error"
+        try:
+            while page is not None:
+                page.extractor, page.extractor_version = name, version
+                first = page.page_no + 1
+                yield page  # time spent by the consumer is not the extractor's
+                t = time.perf_counter()
+                try:
+                    page = next(it, None)
+                finally:
+                    spent += time.perf_counter() - t
+            result = "ok"
+        except GeneratorExit:
+            result = "ok"  # consumer stopped early
+            raise
+        except Exception as e:
+            errors.append(f"{fn.__name__} from page {first}: {e}")
+            _attempt(name, spent, "error", e)
+            resumed = True
+            if last is not None and first > last:
+                return
+            continue
+        finally:
+            it.close()
+            if result == "ok":
+                _attempt(name, spent, "ok")
+        return
+    if blank:
+        return  # the pages after the failure have no text
+    metrics.inc("ingest_extract_failures_total")
     raise RuntimeError("Failed to extract PDF text. Tried: " + " | ".join(errors))
+
+def pdf_page_count(pdf_path: str) -> int:
+    """Number of pages, from whichever of PyMuPDF, pypdf or pdfinfo can tell."""
+    try:
+        import fitz  # PyMuPDF
+        with fitz.open(pdf_path) as doc:
+            return doc.page_count
+    except Exception:
+        pass
+    try:
+        from pypdf import PdfReader
+        return len(PdfReader(pdf_path).pages)
+    except Exception:
+        pass
+    pdfinfo = shutil.which("pdfinfo")
+    if pdfinfo:
+        out = subprocess.run([pdfinfo, pdf_path], capture_output=True, text=True, errors="ignore").stdout
+        for line in out.splitlines():
+            if line.startswith("Pages:"):
+                return int(line.split()[1])
+    raise RuntimeError(f"Could not count pages of {pdf_path}")
+
+def page_ranges(page_count: int, size: int) -> list[tuple[int, int]]:
+    """(first, last) 1-based inclusive ranges of at most `size` pages covering the document."""
+    return [(a, min(a + size - 1, page_count)) for a in range(1, page_count + 1, size)]
+
+def _attempt(name: str, seconds: float, result: str, error: Exception | None = None) -> None:
+    metrics.observe("ingest_extractor_seconds", seconds, extractor=name, result=result)
+    metrics.inc("ingest_extractor_attempts_total", extractor=name, result=result)
+    if error is not None:
+        metrics.inc("ingest_extractor_errors_total", extractor=name, error=type(error).__name__)
+
+def extract_pdf_pages(pdf_path: str) -> List[PageText]:
+    """All pages at once; see iter_pdf_pages()."""
+    return list(iter_pdf_pages(pdf_path))
@@ -0,0 +1,142 @@
+from __future__ import annotations
+
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+# Histogram bucket upper bounds, seconds.
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+HELP = {
+    "ingest_stage_seconds": "Time per ingest stage (hash, extract, chunk, embed, write, commit, embed_write, fts_merge, matrix).",
+    "ingest_extractor_seconds": "Time per PDF extractor attempt, by extractor and result.",
+    "ingest_docs_total": "Docs seen by ingest, by status.",
+    "ingest_pages_total": "Pages extracted.",
+    "ingest_chunks_total": "Chunks written (inserted), kept from the previous version (reused), not embedded as near-duplicates (embed_skipped), embedded when their stand-in went (embed_released) or found without an embedding (embed_repaired).",
+    "ingest_bytes_hashed_total": "Bytes read by sha256.",
+    "ingest_extractor_attempts_total": "PDF extractor attempts, by extractor and result (ok, empty, error).",
+    "ingest_extractor_errors_total": "Errors raised by PDF extractors, by extractor and exception type.",
+    "ingest_extract_fallbacks_total": "Docs extracted by a later extractor after an earlier one failed or found no text.",
+    "ingest_extract_failures_total": "Docs no extractor could read.",
+    "ingest_fts_rebuilds_total": "Bulk-load merges that found chunk_fts out of line with chunk and rebuilt it.",
+}
+
+Key = tuple[str, tuple[tuple[str, str], ...]]
+
+def _key(name: str, labels: dict[str, object]) -> Key:
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+class Metrics:
+    """Process-wide timers (histograms) and counters for ingest stages.
+
+    Worker processes record into their own instance; snapshot() is plain,
+    picklable data that the parent merge()s, so totals cover the whole run.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._timers: dict[Key, list] = {}  # [count, sum, max, bucket counts]
+        self._counters: dict[Key, float] = {}
+
+    @contextmanager
+    def timer(self, name: str, **labels: object) -> Iterator[None]:
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - t, **labels)
+
+    def observe(self, name: str, seconds: float, **labels: object) -> None:
+        key = _key(name, labels)
+        with self._lock:
+            h = self._timers.get(key)
+            if h is None:
+                h = self._timers[key] = [0, 0.0, 0.0, [0] * len(BUCKETS)]
+            h[0] += 1
+            h[1] += seconds
+            h[2] = max(h[2], seconds)
+            for i, b in enumerate(BUCKETS):
+                if seconds <= b:
+                    h[3][i] += 1
+                    break
+
+    def inc(self, name: str, n: float = 1, **labels: object) -> None:
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + n
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "timers": {k: [h[0], h[1], h[2], list(h[3])] for k, h in self._timers.items()},
+                "counters": dict(self._counters),
+            }
+
+    def merge(self, snap: dict) -> None:
+        with self._lock:
+            for k, (count, total, peak, buckets) in snap["timers"].items():
+                h = self._timers.get(k)
+                if h is None:
+                    h = self._timers[k] = [0, 0.0, 0.0, [0] * len(BUCKETS)]
+                h[0] += count
+                h[1] += total
+                h[2] = max(h[2], peak)
+                h[3] = [a + b for a, b in zip(h[3], buckets)]
+            for k, v in snap["counters"].items():
+                self._counters[k] = self._counters.get(k, 0) + v
+
+    def reset(self) -> None:
+        with self._lock:
+            self._timers.clear()
+            self._counters.clear()
+
+    def prometheus(self, prefix: str = "membox_") -> str:
+        """Text exposition format (histograms for timers, counters as-is)."""
+        snap = self.snapshot()
+        lines: list[str] = []
+
+        def fmt(labels: tuple[tuple[str, str], ...], extra: tuple[tuple[str, str], ...] = ()) -> str:
+            pairs = labels + extra
+            if not pairs:
+                return ""
+            return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+        for name in sorted({k[0] for k in snap["timers"]}):
+            full = prefix + name
+            lines += [f"# HELP {full} {HELP.get(name, name)}", f"# TYPE {full} histogram"]
+            for (n, labels), (count, total, _peak, buckets) in sorted(snap["timers"].items()):
+                if n != name:
+                    continue
+                cum = 0
+                for b, c in zip(BUCKETS, buckets):
+                    cum += c
+                    lines.append(f"{full}_bucket{fmt(labels, (('le', repr(b)),))} {cum}")
+                lines.append(f"{full}_bucket{fmt(labels, (('le', '+Inf'),))} {count}")
+                lines.append(f"{full}_sum{fmt(labels)} {total:.6f}")
+                lines.append(f"{full}_count{fmt(labels)} {count}")
+        for name in sorted({k[0] for k in snap["counters"]}):
+            full = prefix + name
+            lines += [f"# HELP {full} {HELP.get(name, name)}", f"# TYPE {full} counter"]
+            for (n, labels), v in sorted(snap["counters"].items()):
+                if n == name:
+                    lines.append(f"{full}{fmt(labels)} {v:g}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> list[str]:
+        """Human-readable lines: one per timer (slowest stage first), then counters."""
+        snap = self.snapshot()
+        rows = sorted(snap["timers"].items(), key=lambda kv: -kv[1][1])
+        out = [f"{'timer':<60} {'count':>7} {'total s':>9} {'mean ms':>9} {'max ms':>9}"]
+        for (name, labels), (count, total, peak, _b) in rows:
+            label = name.removesuffix("_seconds") + "".join(f" {k}={v}" for k, v in labels)
+            out.append(f"{label:<60} {count:>7} {total:>9.3f} {1000 * total / max(count, 1):>9.2f} {1000 * peak:>9.2f}")
+        for (name, labels), val in sorted(snap["counters"].items()):
+            label = name.removesuffix("_total") + "".join(f" {k}={v}" for k, v in labels)
+            out.append(f"{label:<60} {val:>7g}")
+        return out
+
+def _escape(v: str) -> str:
+    return v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+metrics = Metrics()
@@ -1,16 +1,42 @@
 PRAGMA journal_mode=WAL;
 PRAGMA foreign_keys=ON;
 
+-- Directories docs live in; doc.folder_id points at the doc's parent directory.
+CREATE TABLE IF NOT EXISTS folder (
+  folder_id INTEGER PRIMARY KEY,
+  path TEXT NOT NULL UNIQUE
+);
+
 CREATE TABLE IF NOT EXISTS doc (
   doc_id TEXT PRIMARY KEY,
   source_path TEXT NOT NULL,
   title TEXT,
   mime TEXT,
   sha256 TEXT,
+  file_size INTEGER,
+  mtime_ns INTEGER,
+  inode INTEGER,
+  folder_id INTEGER REFERENCES folder(folder_id),
+  -- Set when another doc has the same sha256 and holds the chunks; this one is just another path to it.
+  canonical_doc_id TEXT REFERENCES doc(doc_id),
   created_at TEXT NOT NULL,
   updated_at TEXT NOT NULL
 );
 CREATE UNIQUE INDEX IF NOT EXISTS idx_doc_source_path ON doc(source_path);
+CREATE INDEX IF NOT EXISTS idx_doc_folder ON doc(folder_id);
+CREATE INDEX IF NOT EXISTS idx_doc_sha256 ON doc(sha256);
+CREATE INDEX IF NOT EXISTS idx_doc_canonical ON doc(canonical_doc_id);
+
+-- Small counters; 'data_generation' is bumped whenever a doc's chunks are written or a doc is removed.
+CREATE TABLE IF NOT EXISTS meta (
+  key TEXT PRIMARY KEY,
+  value INTEGER NOT NULL
+) WITHOUT ROWID;
+
+CREATE TRIGGER IF NOT EXISTS trg_doc_ad AFTER DELETE ON doc BEGIN
+  INSERT INTO meta(key, value) VALUES('data_generation', 1)
+  ON CONFLICT(key) DO UPDATE SET value = value + 1;
+END;
 
 CREATE TABLE IF NOT EXISTS chunk (
   chunk_id TEXT PRIMARY KEY,
@@ -20,33 +46,92 @@ CREATE TABLE IF NOT EXISTS chunk (
   page_end INTEGER,
   text TEXT NOT NULL,
   char_count INTEGER NOT NULL,
+  simhash INTEGER,  -- 64-bit SimHash of the text (mcore/simhash.py)
+  near_dup_of TEXT REFERENCES chunk(chunk_id) ON DELETE SET NULL,  -- chunk whose embedding stands in for this one's (skipped)
   created_at TEXT NOT NULL
 );
 CREATE INDEX IF NOT EXISTS idx_chunk_doc ON chunk(doc_id, chunk_index);
 
+-- LSH over simhash: one index per 16-bit band (simhash.band_sql); near-duplicates share a band.
+CREATE INDEX IF NOT EXISTS idx_chunk_lsh0 ON chunk((simhash >> 0) & 65535);
+CREATE INDEX IF NOT EXISTS idx_chunk_lsh1 ON chunk((simhash >> 16) & 65535);
+CREATE INDEX IF NOT EXISTS idx_chunk_lsh2 ON chunk((simhash >> 32) & 65535);
+CREATE INDEX IF NOT EXISTS idx_chunk_lsh3 ON chunk((simhash >> 48) & 65535);
+CREATE INDEX IF NOT EXISTS idx_chunk_near_dup ON chunk(near_dup_of) WHERE near_dup_of IS NOT NULL;
+
+-- Hash of each page's text as of the last index (pages with text only); reindexing a changed
+-- file keeps the chunks whose pages hash the same (see indexer._write_doc).
+CREATE TABLE IF NOT EXISTS page (
+  doc_id TEXT NOT NULL REFERENCES doc(doc_id) ON DELETE CASCADE,
+  page_no INTEGER NOT NULL,
+  text_hash TEXT NOT NULL,
+  PRIMARY KEY (doc_id, page_no)
+) WITHOUT ROWID;
+
+-- Extracted page text by file content, so a forced reindex or re-chunking of an unchanged file
+-- never reopens the PDF. page_count is set once every page is stored (NULL while extracting);
+-- text is stored like chunk.text (see text_dict). Rows whose sha256 no doc has are pruned at ingest.
+CREATE TABLE IF NOT EXISTS text_cache (
+  sha256 TEXT PRIMARY KEY,
+  page_count INTEGER,
+  created_at TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS text_cache_page (
+  sha256 TEXT NOT NULL REFERENCES text_cache(sha256) ON DELETE CASCADE,
+  page_no INTEGER NOT NULL,
+  extractor TEXT NOT NULL,
+  extractor_version TEXT,
+  text TEXT NOT NULL,
+  PRIMARY KEY (sha256, page_no)
+);
+
+-- chunk.text is TEXT, or a BLOB compressed with a text_dict dictionary (see mcore/textcodec.py).
+-- mb_text() (registered by db.connect) returns it as plain text either way.
+CREATE TABLE IF NOT EXISTS text_dict (
+  dict_id INTEGER PRIMARY KEY,
+  codec TEXT NOT NULL,  -- zlib, zstd, or none (compression switched off)
+  data BLOB NOT NULL,
+  created_at TEXT NOT NULL
+);
+
+-- The indexed text ends in two spaces, so on a trigram chunk_fts every 1-2 character substring
+-- starts some trigram and search._like_candidates can find it in the vocabulary (fts5vocab).
+CREATE VIEW IF NOT EXISTS chunk_plain AS
+  SELECT rowid AS chunk_rowid, mb_text(text) || '  ' AS text, doc_id, chunk_id, page_start FROM chunk;
+
+-- External content: the index reads text (and the UNINDEXED columns) from chunk, through
+-- chunk_plain, by rowid instead of storing a second copy. Keep db.create_fts() in sync.
 CREATE VIRTUAL TABLE IF NOT EXISTS chunk_fts USING fts5(
   text,
   doc_id UNINDEXED,
   chunk_id UNINDEXED,
   page_start UNINDEXED,
+  content = 'chunk_plain',
+  content_rowid = 'chunk_rowid',
   tokenize = 'unicode61'
 );
 
 CREATE TRIGGER IF NOT EXISTS trg_chunk_ai AFTER INSERT ON chunk BEGIN
   INSERT INTO chunk_fts(rowid, text, doc_id, chunk_id, page_start)
-  VALUES (new.rowid, new.text, new.doc_id, new.chunk_id, new.page_start);
+  VALUES (new.rowid, mb_text(new.text) || '  ', new.doc_id, new.chunk_id, new.page_start);
 END;
 
+-- A 'delete' for a row chunk_fts never indexed corrupts it, and during a bulk load
+-- (db.fts_bulk_load) new rows are not indexed until the merge: only delete indexed rows.
 CREATE TRIGGER IF NOT EXISTS trg_chunk_ad AFTER DELETE ON chunk BEGIN
   INSERT INTO chunk_fts(chunk_fts, rowid, text, doc_id, chunk_id, page_start)
-  VALUES ('delete', old.rowid, old.text, old.doc_id, old.chunk_id, old.page_start);
+  SELECT 'delete', old.rowid, mb_text(old.text) || '  ', old.doc_id, old.chunk_id, old.page_start
+  WHERE EXISTS (SELECT 1 FROM chunk_fts_docsize WHERE id = old.rowid);
 END;
 
-CREATE TRIGGER IF NOT EXISTS trg_chunk_au AFTER UPDATE ON chunk BEGIN
+-- Only text is indexed; the UNINDEXED columns are read through, so moving a chunk costs no FTS work.
+CREATE TRIGGER IF NOT EXISTS trg_chunk_au AFTER UPDATE OF text ON chunk BEGIN
   INSERT INTO chunk_fts(chunk_fts, rowid, text, doc_id, chunk_id, page_start)
-  VALUES ('delete', old.rowid, old.text, old.doc_id, old.chunk_id, old.page_start);
+  SELECT 'delete', old.rowid, mb_text(old.text) || '  ', old.doc_id, old.chunk_id, old.page_start
+  WHERE EXISTS (SELECT 1 FROM chunk_fts_docsize WHERE id = old.rowid);
   INSERT INTO chunk_fts(rowid, text, doc_id, chunk_id, page_start)
-  VALUES (new.rowid, new.text, new.doc_id, new.chunk_id, new.page_start);
+  VALUES (new.rowid, mb_text(new.text) || '  ', new.doc_id, new.chunk_id, new.page_start);
 END;
 
 CREATE TABLE IF NOT EXISTS embedding (
@@ -54,6 +139,37 @@ CREATE TABLE IF NOT EXISTS embedding (
   embedding_model TEXT NOT NULL,
   embedding_dim INTEGER NOT NULL,
   vec BLOB NOT NULL,
+  vec_format TEXT NOT NULL DEFAULT 'f32',  -- f32 | f16 | i8 (float32 scale + int8 codes)
   created_at TEXT NOT NULL
 );
 CREATE INDEX IF NOT EXISTS idx_embedding_model ON embedding(embedding_model);
+
+-- Bumped whenever a model's embeddings change; sidecar matrices compare against it.
+CREATE TABLE IF NOT EXISTS embedding_state (
+  embedding_model TEXT PRIMARY KEY,
+  generation INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TRIGGER IF NOT EXISTS trg_embedding_ad AFTER DELETE ON embedding BEGIN
+  UPDATE embedding_state SET generation = generation + 1 WHERE embedding_model = old.embedding_model;
+END;
+
+-- Contiguous matrix file per model, next to the db (<db>.vec/<model>.<quant>), in f32, f16 or i8 rows.
+-- epoch changes on full rebuild only; appends keep it and extend n_rows.
+CREATE TABLE IF NOT EXISTS embedding_matrix (
+  embedding_model TEXT PRIMARY KEY,
+  file_name TEXT NOT NULL,
+  dim INTEGER NOT NULL,
+  n_rows INTEGER NOT NULL,
+  generation INTEGER NOT NULL,
+  epoch INTEGER NOT NULL,
+  quant TEXT NOT NULL DEFAULT 'f32',
+  updated_at TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS embedding_matrix_row (
+  embedding_model TEXT NOT NULL,
+  row_no INTEGER NOT NULL,
+  chunk_id TEXT NOT NULL,
+  PRIMARY KEY (embedding_model, row_no)
+) WITHOUT ROWID;
@@ -0,0 +1,480 @@
+from __future__ import annotations
+
+import re
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable
+
+import numpy as np
+
+from .ann import IVFIndex, ivf_topk, load_ivf
+from .db import fts_tokenizer, path_range
+from .embedder import get_embedder
+from .simhash import collapse as collapse_near_dups
+from .vector_cache import VectorCache
+from .vector_store import (
+    Matrix, cosine_topk, exact_vectors, is_quantized, load_embeddings, rescore_exact, upsert_embeddings,
+)
+from .util import norm_path
+
+MODES = ("fts", "vector", "hybrid")
+FUSIONS = ("rrf", "weighted")
+
+# Vector candidates are filtered by doc/path after scoring; over-fetch so filters still leave enough.
+_FILTER_OVERSAMPLE = 4
+# Likewise for collapse=True, which folds near-duplicate hits into the best ranked one.
+_COLLAPSE_OVERSAMPLE = 3
+
+_executor: ThreadPoolExecutor | None = None
+
+def _pool() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="membox-search")
+    return _executor
+
+def resolve_doc(conn: sqlite3.Connection, doc: str) -> str | None:
+    """doc_id holding the chunks of the doc at this path (or with this id): its canonical doc for a duplicate."""
+    row = conn.execute(
+        "SELECT COALESCE(canonical_doc_id, doc_id) AS doc_id FROM doc WHERE source_path=? OR doc_id=?", (doc, doc)
+    ).fetchone()
+    return row["doc_id"] if row else None
+
+def doc_paths(conn: sqlite3.Connection, source_paths: Iterable[str]) -> dict[str, list[str]]:
+    """source_path of a doc holding chunks -> it plus the paths of its duplicates, sorted after it."""
+    out = {p: [p] for p in source_paths}
+    if not out:
+        return out
+    marks = ",".join("?" * len(out))
+    for canon, alias in conn.execute(f"""
+      SELECT c.source_path, a.source_path FROM doc c JOIN doc a ON a.canonical_doc_id = c.doc_id
+      WHERE c.source_path IN ({marks}) ORDER BY a.source_path
+    """, list(out)):
+        out[canon].append(alias)
+    return out
+
+def _in_scope(path: str, path_prefix: str | None, folder: str | None) -> bool:
+    """Whether path passes the prefix/folder filters, as _filters applies them to docs."""
+    if path_prefix and not path.startswith(path_prefix.rstrip("/")):
+        return False
+    if folder:
+        root, parent = norm_path(folder), str(Path(path).parent)
+        return parent == root or parent.startswith(root.rstrip("/") + "/")
+    return True
+
+def _filters(
+    doc_id: str | None, path_prefix: str | None, alias: str = "c", folder: str | None = None
+) -> tuple[str, list[object]]:
+    """WHERE fragment restricting `alias`.doc_id; prefix/folder become indexed id-sets, never LIKE.
+
+    A duplicate under the prefix/folder brings in its canonical doc's chunks.
+    """
+    where: list[str] = []
+    params: list[object] = []
+    if doc_id:
+        where.append(f"{alias}.doc_id = ?")
+        params.append(doc_id)
+    if path_prefix:
+        where.append(f"{alias}.doc_id IN (SELECT COALESCE(canonical_doc_id, doc_id) FROM doc WHERE source_path >= ? AND source_path < ?)")
+        params.extend(path_range(path_prefix.rstrip("/")))
+    if folder:
+        root = norm_path(folder)
+        where.append(
+            f"{alias}.doc_id IN (SELECT COALESCE(canonical_doc_id, doc_id) FROM doc WHERE folder_id IN "
+            "(SELECT folder_id FROM folder WHERE path = ? OR (path >= ? AND path < ?)))"
+        )
+        params.extend((root, *path_range(root.rstrip("/") + "/")))
+    return ((" AND " + " AND ".join(where)) if where else ""), params
+
+# Anything beyond bare terms is passed to MATCH untouched.
+_FTS_SYNTAX = re.compile(r'["*():^+\-]|\b(?:AND|OR|NOT|NEAR)\b')
+
+def _trigram_terms(q: str) -> tuple[str | None, list[str]]:
+    """Split a bare-terms query into a MATCH for terms of 3+ chars and LIKE terms for shorter ones.
+
+    The trigram tokenizer cannot match anything shorter than 3 characters, which
+    rules out most 2-character Chinese words; those become LIKE filters instead.
+    """
+    if _FTS_SYNTAX.search(q):
+        return q, []
+    long_terms: list[str] = []
+    short_terms: list[str] = []
+    for t in q.split():
+        (long_terms if len(t) >= 3 else short_terms).append(t)
+    return (" ".join(f'"{t}"' for t in long_terms) or None), short_terms
+
+def _like(term: str) -> str:
+    return "%" + term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+def fts_candidates(
+    conn: sqlite3.Connection,
+    q: str,
+    limit: int,
+    doc_id: str | None = None,
+    path_prefix: str | None = None,
+    snippet_tokens: int = 24,
+    max_chars: int = 400,
+    folder: str | None = None,
+) -> list[sqlite3.Row]:
+    """BM25 top-`limit` from chunk_fts, best first (bm25() is lower-is-better).
+
+    On a trigram chunk_fts, terms under 3 characters are matched with LIKE on
+    the MATCH results; a query of only such terms goes to _like_candidates.
+    Ordering by the FTS rank column (bm25) lets FTS5 sort, so snippets and
+    previews are only built for the rows returned.
+    """
+    like_terms: list[str] = []
+    if fts_tokenizer(conn) == "trigram":
+        match, like_terms = _trigram_terms(q)
+        if match is None:
+            return _like_candidates(conn, like_terms, limit, doc_id, path_prefix, max_chars, folder)
+        q = match
+    where_sql, params = _filters(doc_id, path_prefix, folder=folder)
+    for t in like_terms:
+        where_sql += " AND mb_text(c.text) LIKE ? ESCAPE '\\'"
+        params.append(_like(t))
+    sql = f"""
+    SELECT d.source_path,
+           c.page_start, c.page_end, c.chunk_id, c.simhash,
+           f.rank AS bm25_score,
+           rtrim(snippet(chunk_fts, 0, '[', ']', '…', ?)) AS snip,
+           substr(mb_text(c.text), 1, ?) AS text_preview
+    FROM chunk_fts f
+    JOIN chunk c ON c.rowid = f.rowid
+    JOIN doc d ON d.doc_id = c.doc_id
+    WHERE chunk_fts MATCH ? {where_sql}
+    ORDER BY f.rank
+    LIMIT ?
+    """
+    return conn.execute(sql, (snippet_tokens, max_chars, q, *params, limit)).fetchall()
+
+def _like_candidates(
+    conn: sqlite3.Connection,
+    terms: list[str],
+    limit: int,
+    doc_id: str | None,
+    path_prefix: str | None,
+    max_chars: int,
+    folder: str | None = None,
+) -> list[sqlite3.Row]:
+    """Chunks containing every term (all under 3 characters), in rowid order, without decoding every chunk.
+
+    The trigram index cannot match such terms, but each occurrence starts some
+    trigram (indexed text ends in two spaces), so the trigrams of the index
+    vocabulary that start with the term narrow the rows LIKE then checks.
+    """
+    conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS temp.chunk_fts_terms USING fts5vocab(main, chunk_fts, row)")
+    groups: list[str] = []
+    for t in terms:
+        grams = [r[0] for r in conn.execute("SELECT term FROM temp.chunk_fts_terms WHERE term >= ? AND term < ?", path_range(t.lower()))]
+        if not grams:
+            return []
+        groups.append("(" + " OR ".join('"' + g.replace('"', '""') + '"' for g in grams) + ")")
+    where_sql, params = _filters(doc_id, path_prefix, folder=folder)
+    like_sql = " AND ".join("mb_text(c.text) LIKE ? ESCAPE '\\'" for _ in terms)
+    return conn.execute(f"""
+      SELECT d.source_path, c.page_start, c.page_end, c.chunk_id, c.simhash,
+             NULL AS bm25_score,
+             substr(mb_text(c.text), 1, ?) AS snip,
+             substr(mb_text(c.text), 1, ?) AS text_preview
+      FROM chunk_fts f
+      JOIN chunk c ON c.rowid = f.rowid
+      JOIN doc d ON d.doc_id = c.doc_id
+      WHERE chunk_fts MATCH ? AND {like_sql} {where_sql}
+      ORDER BY f.rowid
+      LIMIT ?
+    """, (max_chars, max_chars, " AND ".join(groups), *[_like(t) for t in terms], *params, limit)).fetchall()
+
+@dataclass
+class VectorScorer:
+    """A query vector against one model's matrix (and IVF index, if probing).
+
+    Calling it only does numpy work, so it can run on another thread while the
+    caller keeps using `conn`. On a quantized matrix with `rescore` set, the
+    call over-fetches approximate hits and refine() re-ranks them with the
+    embedding table's vectors on the caller's connection.
+    """
+
+    model: str
+    qvec: np.ndarray
+    ids: list[str]
+    mat: Matrix
+    index: IVFIndex | None = None
+    nprobe: int = 0
+    rescore: int = 0
+
+    def __call__(self, limit: int) -> list[tuple[str, float]]:
+        if self.rescore and is_quantized(self.mat):
+            limit = max(limit, self.rescore)
+        if self.index is not None:
+            return ivf_topk(self.qvec, self.ids, self.mat, self.index, k=limit, nprobe=self.nprobe)
+        return cosine_topk(self.qvec, self.ids, self.mat, k=limit)
+
+    def refine(self, conn: sqlite3.Connection, pairs: list[tuple[str, float]], limit: int) -> list[tuple[str, float]]:
+        if not (self.rescore and is_quantized(self.mat)):
+            return pairs[:limit]
+        return rescore_exact(self.qvec, pairs, lambda cids: exact_vectors(conn, self.model, cids, self.mat.shape[1]), limit)
+
+def vector_scorer(
+    conn: sqlite3.Connection,
+    q: str | np.ndarray,
+    model: str,
+    nprobe: int = 0,
+    nlist: int = 0,
+    cache: VectorCache | None = None,
+    rescore: int = 0,
+) -> VectorScorer | None:
+    """Load the model's matrix (and IVF index) and embed q. q may be text or an already computed vector.
+
+    None when the model has no embeddings yet.
+    """
+    embed = get_embedder(model)
+    ids, dim, mat = cache.get(conn, model) if cache is not None else load_embeddings(conn, model)
+    if not ids:
+        return None
+    qvec = embed([q], dim)[0] if isinstance(q, str) else q
+    index = None
+    if nprobe > 0:
+        index = cache.ivf(conn, model, nlist=nlist) if cache is not None else load_ivf(conn, model, ids, mat, nlist=nlist)
+    return VectorScorer(model, qvec, ids, mat, index, nprobe, rescore)
+
+def hydrate(
+    conn: sqlite3.Connection,
+    chunk_ids: list[str],
+    max_chars: int = 400,
+    doc_id: str | None = None,
+    path_prefix: str | None = None,
+    folder: str | None = None,
+) -> dict[str, sqlite3.Row]:
+    """chunk_id -> (source_path, pages, simhash, preview) for many chunks in one query; filters drop rows."""
+    if not chunk_ids:
+        return {}
+    where_sql, params = _filters(doc_id, path_prefix, folder=folder)
+    marks = ",".join("?" * len(chunk_ids))
+    rows = conn.execute(f"""
+      SELECT d.source_path, c.page_start, c.page_end, c.chunk_id, c.simhash, substr(mb_text(c.text), 1, ?) AS text_preview
+      FROM chunk c JOIN doc d ON d.doc_id = c.doc_id
+      WHERE c.chunk_id IN ({marks}) {where_sql}
+    """, (max_chars, *chunk_ids, *params)).fetchall()
+    return {r["chunk_id"]: r for r in rows}
+
+def rrf_fuse(ranked: list[list[str]], weights: list[float], k: int = 60) -> dict[str, float]:
+    """Reciprocal rank fusion: sum of w / (k + rank) over the lists an id appears in."""
+    out: dict[str, float] = {}
+    for ids, w in zip(ranked, weights):
+        for rank, cid in enumerate(ids, 1):
+            out[cid] = out.get(cid, 0.0) + w / (k + rank)
+    return out
+
+def weighted_fuse(scored: list[list[tuple[str, float]]], weights: list[float]) -> dict[str, float]:
+    """Min-max normalize each list's scores (higher = better) to [0, 1], then weighted sum."""
+    out: dict[str, float] = {}
+    for pairs, w in zip(scored, weights):
+        if not pairs:
+            continue
+        s = np.array([p[1] for p in pairs], dtype=np.float64)
+        span = float(s.max() - s.min())
+        norm = (s - s.min()) / span if span > 0 else np.ones_like(s)
+        for (cid, _), v in zip(pairs, norm):
+            out[cid] = out.get(cid, 0.0) + w * float(v)
+    return out
+
+def search(
+    conn: sqlite3.Connection,
+    q: str,
+    topk: int = 10,
+    mode: str = "fts",
+    doc_id: str | None = None,
+    path_prefix: str | None = None,
+    snippet_tokens: int = 24,
+    max_chars: int = 400,
+    fts_limit: int = 50,
+    vector_limit: int = 50,
+    fusion: str = "rrf",
+    rrf_k: int = 60,
+    fts_weight: float = 1.0,
+    vector_weight: float = 1.0,
+    embed_model: str = "hashed-bow",
+    nprobe: int = 0,
+    cache: VectorCache | None = None,
+    folder: str | None = None,
+    rescore: int = 0,
+    collapse: bool = False,
+) -> list[dict]:
+    """Keyword, vector or hybrid search; returns hit dicts best first.
+
+    hybrid takes the BM25 top-`fts_limit` and the cosine top-`vector_limit`
+    (scored on a worker thread while the FTS query runs) and merges them with
+    reciprocal rank fusion or weighted normalized scores. `rescore` re-ranks that
+    many quantized-matrix candidates at full precision. `collapse` keeps only
+    the best ranked of near-duplicate chunks (by SimHash), counting the rest
+    in its near_duplicates. sqlite3.Error from a bad FTS query propagates.
+    """
+    if mode not in MODES:
+        raise ValueError(f"Unknown search mode: {mode} (known: {', '.join(MODES)})")
+    if fusion not in FUSIONS:
+        raise ValueError(f"Unknown fusion: {fusion} (known: {', '.join(FUSIONS)})")
+
+    want = topk
+    if collapse:
+        topk, fts_limit, vector_limit = (n * _COLLAPSE_OVERSAMPLE for n in (topk, fts_limit, vector_limit))
+    if mode == "fts":
+        fts_limit = topk
+    scorer = vector_scorer(conn, q, embed_model, nprobe=nprobe, cache=cache, rescore=rescore) if mode != "fts" else None
+    vlimit = (topk if mode == "vector" else vector_limit) * (_FILTER_OVERSAMPLE if doc_id or path_prefix or folder else 1)
+    fut = _pool().submit(scorer, vlimit) if scorer is not None else None
+    try:
+        fts_rows = fts_candidates(conn, q, fts_limit, doc_id, path_prefix, snippet_tokens, max_chars, folder) if mode != "vector" else []
+    finally:
+        vec_pairs = fut.result() if fut is not None else []
+    if scorer is not None:
+        vec_pairs = scorer.refine(conn, vec_pairs, vlimit)
+
+    fts_by_id = {r["chunk_id"]: r for r in fts_rows}
+    extra = hydrate(conn, [cid for cid, _ in vec_pairs if cid not in fts_by_id], max_chars, doc_id, path_prefix, folder)
+    vec_pairs = [(cid, s) for cid, s in vec_pairs if cid in fts_by_id or cid in extra]
+    vec_pairs = vec_pairs[:topk if mode == "vector" else vector_limit]
+
+    fts_rank = {r["chunk_id"]: i for i, r in enumerate(fts_rows, 1)}
+    vec_rank = {cid: i for i, (cid, _) in enumerate(vec_pairs, 1)}
+    if mode == "fts":
+        scores = {r["chunk_id"]: 1.0 / (1.0 + float(r["bm25_score"] or 0.0)) for r in fts_rows}
+        order = list(fts_rank)
+    elif mode == "vector":
+        scores = dict(vec_pairs)
+        order = list(vec_rank)
+    else:
+        if fusion == "rrf":
+            scores = rrf_fuse([list(fts_rank), list(vec_rank)], [fts_weight, vector_weight], k=rrf_k)
+        else:
+            bm25_pairs = [(r["chunk_id"], -float(r["bm25_score"] or 0.0)) for r in fts_rows]
+            scores = weighted_fuse([bm25_pairs, vec_pairs], [fts_weight, vector_weight])
+        order = sorted(scores, key=lambda c: -scores[c])
+
+    hits: list[dict] = []
+    top = [fts_by_id.get(cid) or extra[cid] for cid in order[:topk]]
+    paths = doc_paths(conn, {r["source_path"] for r in top})
+    for cid, r in zip(order, top):
+        # Filtered to a duplicate's location: name that copy, not the canonical one elsewhere.
+        shown = next((p for p in paths[r["source_path"]] if _in_scope(p, path_prefix, folder)), r["source_path"])
+        hits.append({
+            "source_path": shown,
+            "paths": paths[r["source_path"]],
+            "page_start": r["page_start"],
+            "page_end": r["page_end"],
+            "chunk_id": cid,
+            "score": scores[cid],
+            "snippet": r["snip"] if cid in fts_by_id else r["text_preview"],
+            "text": r["text_preview"],
+            "fts_rank": fts_rank.get(cid),
+            "vector_rank": vec_rank.get(cid),
+        })
+    if collapse:
+        hits = collapse_near_dups(hits, [r["simhash"] for r in top])[:want]
+    return hits
+
+
+def ensure_doc_embeddings(conn: sqlite3.Connection, doc_id: str, model: str, dim: int) -> None:
+    """Embed the doc's chunks that have no embedding for `model` yet (except near-duplicates skipped at ingest)."""
+    rows = conn.execute("""
+      SELECT c.chunk_id, mb_text(c.text) AS text
+      FROM chunk c
+      LEFT JOIN embedding e ON e.chunk_id = c.chunk_id AND e.embedding_model = ?
+      WHERE c.doc_id = ? AND e.chunk_id IS NULL AND c.near_dup_of IS NULL
+      ORDER BY c.chunk_index
+    """, (model, doc_id)).fetchall()
+    if not rows:
+        return
+    vecs = get_embedder(model)([r["text"] for r in rows], dim)
+    upsert_embeddings(conn, [(r["chunk_id"], model, dim, v) for r, v in zip(rows, vecs)])
+
+def bootstrap_embeddings(conn: sqlite3.Connection, model: str, dim: int, batch: int = 1024) -> None:
+    """Embed every chunk without a near_dup_of, paging by rowid so neither texts nor vectors are all held at once."""
+    embed = get_embedder(model)
+    last = 0
+    while True:
+        rows = conn.execute(
+            "SELECT rowid, chunk_id, mb_text(text) AS text FROM chunk WHERE rowid > ? AND near_dup_of IS NULL ORDER BY rowid LIMIT ?",
+            (last, batch),
+        ).fetchall()
+        if not rows:
+            return
+        vecs = embed([r["text"] for r in rows], dim)
+        upsert_embeddings(conn, [(r["chunk_id"], model, dim, v) for r, v in zip(rows, vecs)])
+        last = rows[-1]["rowid"]
+
+def related_seed(
+    conn: sqlite3.Connection,
+    query: str | None = None,
+    chunk_id: str | None = None,
+    doc: str | None = None,
+    page: int | None = None,
+) -> tuple[str, str | None]:
+    """(seed text, doc_id it came from) for a related lookup.
+
+    Raises ValueError when no target was given and LookupError when the chunk,
+    doc or page does not exist.
+    """
+    if query:
+        return query, None
+    if chunk_id:
+        row = conn.execute("SELECT doc_id, mb_text(text) AS text FROM chunk WHERE chunk_id=?", (chunk_id,)).fetchone()
+        if not row:
+            raise LookupError(f"No such chunk_id: {chunk_id}")
+        return row["text"], row["doc_id"]
+    if not doc or not page:
+        raise ValueError("Need either a query, a chunk_id, or a doc and page")
+    doc_id = resolve_doc(conn, doc)
+    if doc_id is None:
+        raise LookupError(f"No such doc: {doc}")
+    row = conn.execute("""
+      SELECT chunk_id, mb_text(text) AS text
+      FROM chunk
+      WHERE doc_id=? AND page_start<=? AND page_end>=?
+      ORDER BY ABS(page_start-?) ASC
+      LIMIT 1
+    """, (doc_id, page, page, page)).fetchone()
+    if not row:
+        raise LookupError(f"No chunk found for page {page}")
+    return row["text"], doc_id
+
+def related(
+    conn: sqlite3.Connection,
+    seed: str,
+    topk: int = 10,
+    embed_model: str = "hashed-bow",
+    nprobe: int = 0,
+    nlist: int = 0,
+    max_chars: int = 200,
+    cache: VectorCache | None = None,
+    rescore: int = 0,
+    collapse: bool = False,
+) -> list[dict] | None:
+    """Chunks most similar to `seed` text, hydrated in one query; None if the model has no embeddings.
+
+    `collapse` folds near-duplicate hits into the best ranked one, as in search().
+    """
+    scorer = vector_scorer(conn, seed, embed_model, nprobe=nprobe, nlist=nlist, cache=cache, rescore=rescore)
+    if scorer is None:
+        return None
+    limit = topk * _COLLAPSE_OVERSAMPLE if collapse else topk
+    top = scorer.refine(conn, scorer(limit), limit)
+    rows = hydrate(conn, [cid for cid, _ in top], max_chars)
+    paths = doc_paths(conn, {r["source_path"] for r in rows.values()})
+    hits = [
+        {
+            "score": score,
+            "source_path": rows[cid]["source_path"],
+            "paths": paths[rows[cid]["source_path"]],
+            "page_start": rows[cid]["page_start"],
+            "page_end": rows[cid]["page_end"],
+            "chunk_id": cid,
+            "preview": rows[cid]["text_preview"],
+        }
+        for cid, score in top if cid in rows
+    ]
+    if collapse:
+        hits = collapse_near_dups(hits, [rows[h["chunk_id"]]["simhash"] for h in hits])[:topk]
+    return hits
@@ -0,0 +1,71 @@
+from __future__ import annotations
+
+import hashlib
+import re
+from typing import Iterable
+
+import numpy as np
+
+# 64-bit SimHash per chunk, stored signed (SQLite INTEGER). Near-duplicates differ in few bits.
+BITS = 64
+# LSH: the hash split into 4 bands of 16 bits, each indexed on chunk. Hashes within 3 bits of
+# each other always agree exactly on some band; up to DISTANCE bits apart they mostly do, so a
+# band lookup finds most near-duplicates without scanning.
+BANDS = 4
+BAND_BITS = 16
+# Max differing bits for two chunks to count as near-duplicates. One changed word in a
+# 300-word chunk moves ~3 bits; unrelated chunks differ in ~32.
+DISTANCE = 6
+
+_WORD = re.compile(r"\w+")
+_MASK = (1 << BITS) - 1
+_SHINGLE = 3
+
+def _features(text: str) -> list[bytes]:
+    words = _WORD.findall(text.lower())
+    if len(words) < _SHINGLE:
+        return [w.encode("utf-8") for w in words]
+    return [" ".join(words[i:i + _SHINGLE]).encode("utf-8") for i in range(len(words) - _SHINGLE + 1)]
+
+def simhash(text: str) -> int:
+    """SimHash of the text's word 3-shingles, as a signed 64-bit int (0 for text without words)."""
+    feats = _features(text)
+    if not feats:
+        return 0
+    digests = np.frombuffer(b"".join(hashlib.blake2b(f, digest_size=8).digest() for f in feats), dtype="<u8")
+    bits = np.unpackbits(digests.view(np.uint8).reshape(-1, 8), axis=1, bitorder="little")
+    votes = 2 * bits.sum(axis=0, dtype=np.int64) - len(feats)
+    value = int(np.packbits(votes > 0, bitorder="little").view("<u8")[0])
+    return value - (1 << BITS) if value >= 1 << (BITS - 1) else value
+
+def simhashes(texts: Iterable[str]) -> list[int]:
+    return [simhash(t) for t in texts]
+
+def distance(a: int, b: int) -> int:
+    """Number of differing bits."""
+    return bin((a ^ b) & _MASK).count("1")
+
+def band_sql(i: int, col: str = "simhash") -> str:
+    """SQL expression for band i of `col`; must match the idx_chunk_lsh<i> index expressions in schema.sql."""
+    return f"(({col} >> {i * BAND_BITS}) & {(1 << BAND_BITS) - 1})"
+
+def bands(h: int) -> list[int]:
+    """The values band_sql() computes, in Python (arithmetic shift on the signed value, like SQLite)."""
+    return [(h >> (i * BAND_BITS)) & ((1 << BAND_BITS) - 1) for i in range(BANDS)]
+
+def collapse(items: list[dict], hashes: list[int | None], max_distance: int = DISTANCE) -> list[dict]:
+    """Drop items whose hash is within max_distance bits of an earlier (better ranked) item's.
+
+    Kept items get near_duplicates = how many were folded into them; items
+    without a hash (or with 0, no words) are always kept.
+    """
+    kept: list[tuple[dict, int | None]] = []
+    for item, h in zip(items, hashes):
+        rep = None
+        if h:
+            rep = next((k for k, kh in kept if kh and distance(kh, h) <= max_distance), None)
+        if rep is None:
+            kept.append(({**item, "near_duplicates": 0}, h))
+        else:
+            rep["near_duplicates"] += 1
+    return [k for k, _ in kept]
@@ -0,0 +1,140 @@
+from __future__ import annotations
+
+import hashlib
+import sqlite3
+import threading
+import zlib
+from collections import Counter
+from typing import Callable, Iterable
+
+# Compressed chunk.text values are BLOBs: 1 codec byte, 4-byte little-endian dict_id, payload.
+# Plain TEXT values are stored as-is, so compressed and uncompressed rows can coexist.
+_ZLIB = 1
+_ZSTD = 2
+CODECS = {"zlib": _ZLIB, "zstd": _ZSTD}
+
+ZLIB_DICT_SIZE = 32 * 1024  # zlib's window; a larger preset dictionary is never referenced
+ZSTD_DICT_SIZE = 112 * 1024
+
+def zstd_available() -> bool:
+    try:
+        import zstandard  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+def _zlib_dict(samples: list[str], size: int = ZLIB_DICT_SIZE) -> bytes:
+    """Preset dictionary for zlib: the sample's most valuable words, most frequent last.
+
+    zlib has no trainer; it just back-references into the dictionary, and nearer
+    (later) bytes are cheaper to reference.
+    """
+    counts = Counter(w for s in samples for w in s.split())
+    ranked = sorted(counts.items(), key=lambda kv: kv[1] * len(kv[0]))
+    out: list[bytes] = []
+    used = 0
+    for word, n in reversed(ranked):
+        if n < 2:
+            break
+        b = word.encode("utf-8") + b" "
+        if used + len(b) > size:
+            break
+        out.append(b)
+        used += len(b)
+    return b"".join(reversed(out))
+
+def train_dict(samples: list[str], codec: str = "zlib") -> bytes:
+    if codec == "zstd":
+        import zstandard
+        data = [s.encode("utf-8") for s in samples if s]
+        return zstandard.train_dictionary(ZSTD_DICT_SIZE, data).as_bytes()
+    return _zlib_dict(samples)
+
+class TextCodec:
+    """Compress/decompress chunk text with one DB dictionary."""
+
+    def __init__(self, dict_id: int, codec: str, data: bytes) -> None:
+        self.dict_id = dict_id
+        self.codec = codec
+        self.data = data
+        self._header = bytes([CODECS[codec]]) + dict_id.to_bytes(4, "little")
+        self._local = threading.local()
+
+    def _zstd(self):
+        # zstandard (de)compressors are not thread-safe; keep one pair per thread.
+        pair = getattr(self._local, "zstd", None)
+        if pair is None:
+            import zstandard
+            zdict = zstandard.ZstdCompressionDict(self.data)
+            pair = self._local.zstd = (
+                zstandard.ZstdCompressor(level=9, dict_data=zdict),
+                zstandard.ZstdDecompressor(dict_data=zdict),
+            )
+        return pair
+
+    def compress(self, text: str) -> str | bytes:
+        """BLOB if that is smaller than the UTF-8 text, else the text unchanged."""
+        raw = text.encode("utf-8")
+        if self.codec == "zstd":
+            payload = self._zstd()[0].compress(raw)
+        else:
+            c = zlib.compressobj(9, zdict=self.data) if self.data else zlib.compressobj(9)
+            payload = c.compress(raw) + c.flush()
+        blob = self._header + payload
+        return blob if len(blob) < len(raw) else text
+
+    def decompress(self, blob: bytes) -> str:
+        payload = blob[5:]
+        if self.codec == "zstd":
+            raw = self._zstd()[1].decompress(payload)
+        else:
+            d = zlib.decompressobj(zdict=self.data) if self.data else zlib.decompressobj()
+            raw = d.decompress(payload) + d.flush()
+        return raw.decode("utf-8")
+
+_codecs: dict[tuple[int, str, bytes], TextCodec] = {}
+
+def _codec(dict_id: int, codec: str, data: bytes) -> TextCodec:
+    key = (dict_id, codec, hashlib.blake2b(data, digest_size=16).digest())
+    tc = _codecs.get(key)
+    if tc is None:
+        tc = _codecs[key] = TextCodec(dict_id, codec, data)
+    return tc
+
+def active_codec(conn: sqlite3.Connection) -> TextCodec | None:
+    """Codec new chunk text is written with; None when compression is off (or never enabled)."""
+    try:
+        row = conn.execute("SELECT dict_id, codec, data FROM text_dict ORDER BY dict_id DESC LIMIT 1").fetchone()
+    except sqlite3.OperationalError:  # no text_dict yet (db not initialized)
+        return None
+    if row is None or row[1] == "none":
+        return None
+    return _codec(row[0], row[1], row[2])
+
+def encode_texts(conn: sqlite3.Connection, texts: Iterable[str]) -> list[str | bytes]:
+    codec = active_codec(conn)
+    return list(texts) if codec is None else [codec.compress(t) for t in texts]
+
+def _decoder(conn: sqlite3.Connection) -> Callable[[object], object]:
+    def load(dict_id: int) -> TextCodec:
+        row = conn.execute("SELECT codec, data FROM text_dict WHERE dict_id=?", (dict_id,)).fetchone()
+        if row is None:
+            raise ValueError(f"chunk text uses missing dictionary {dict_id}")
+        return _codec(dict_id, row[0], row[1])
+
+    by_id: dict[int, TextCodec] = {}
+
+    def mb_text(value: object) -> object:
+        if not isinstance(value, bytes):
+            return value
+        dict_id = int.from_bytes(value[1:5], "little")
+        tc = by_id.get(dict_id)
+        if tc is None:
+            tc = by_id[dict_id] = load(dict_id)
+        return tc.decompress(value)
+
+    return mb_text
+
+def register(conn: sqlite3.Connection) -> None:
+    """Add mb_text(x): chunk.text as a string, whether it is stored compressed or not."""
+    conn.create_function("mb_text", 1, _decoder(conn), deterministic=True)
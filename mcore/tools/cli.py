@@ -16,6 +16,9 @@ from mcore.tools.commands import index as cmd_index
 from mcore.tools.commands import search as cmd_search
 from mcore.tools.commands import related as cmd_related
 from mcore.tools.commands import api as cmd_api
+from mcore.tools.commands import migrate as cmd_migrate
+from mcore.tools.commands import compress as cmd_compress
+from mcore.tools.commands import bench as cmd_bench
 
 load_dotenv()
 
@@ -51,16 +54,41 @@ def build_parser() -> argparse.ArgumentParser:
     pi.add_argument("path", help="PDF file or directory")
     pi.add_argument("--glob", default="*.pdf", help='Glob pattern when indexing a directory (default: "*.pdf")')
     pi.add_argument("--force", action="store_true", help="Force rebuild even if sha256 unchanged")
+    pi.add_argument("--verify", action="store_true", help="Re-hash every file instead of trusting size/mtime/inode")
+    pi.add_argument("--reextract", action="store_true", help="Extract PDFs again instead of reusing cached page text")
+    pi.add_argument("--text-cache", action="store_true",
+                    help="Keep extracted page text so --force / --min-chars re-runs skip the PDFs (stores the text a second time)")
     pi.add_argument("--min-chars", type=int, default=200, help="Merge short pages until reaching min chars (default: 200)")
+    pi.add_argument("--workers", type=int, default=1, help="Extract/chunk PDFs in N worker processes (default: 1)")
+    pi.add_argument("--split-pages", type=int, default=0,
+                    help="With --workers > 1, extract docs longer than N pages as N-page ranges in parallel; 0 = off")
+    pi.add_argument("--batch-docs", type=int, default=1, help="Commit once per N indexed docs (default: 1)")
+    pi.add_argument("--bulk", action="store_true", help="Bulk load: suspend FTS insert trigger, merge chunk_fts once at the end")
+    pi.add_argument("--embed-model", default=None, help="Also embed new chunks with this model (e.g. hashed-bow)")
+    pi.add_argument("--dim", type=int, default=768, help="Embedding dim for --embed-model (default: 768)")
+    pi.add_argument("--skip-near-dups", action="store_true",
+                    help="With --embed-model, don't embed new chunks that nearly duplicate an embedded one")
+    pi.add_argument("--quant", choices=["f32", "f16", "i8"], default=None,
+                    help="Store the --embed-model matrix as float32, float16 or int8 (default: keep current, f32 if new)")
     pi.add_argument("--quiet", action="store_true", help="Less output")
+    pi.add_argument("--stats", action="store_true", help="Print per-stage timings and extractor counters at the end")
     pi.set_defaults(_run=cmd_index.run)
 
-    ps = sub.add_parser("search", help="Keyword search via SQLite FTS5")
+    ps = sub.add_parser("search", help="Keyword (FTS5), vector or hybrid search")
     ps.add_argument("query", help="FTS query string")
     ps.add_argument("-n", "--topk", type=int, default=10, help="Top K results (default: 10)")
     ps.add_argument("--doc", help="Restrict search to a doc (path or doc_id)")
     ps.add_argument("--path-prefix", help="Restrict to docs whose source_path starts with prefix")
+    ps.add_argument("--folder", help="Restrict to docs in this folder or its subfolders")
     ps.add_argument("--show", type=int, default=200, help="Preview length (chars-ish) (default: 200)")
+    ps.add_argument("--mode", choices=["fts", "vector", "hybrid"], default="fts", help="fts = BM25, hybrid = BM25 + cosine fused")
+    ps.add_argument("--fts-limit", type=int, default=50, help="BM25 candidates for hybrid (default: 50)")
+    ps.add_argument("--vector-limit", type=int, default=50, help="Cosine candidates for hybrid (default: 50)")
+    ps.add_argument("--fusion", choices=["rrf", "weighted"], default="rrf", help="How hybrid merges the two lists")
+    ps.add_argument("--embed-model", default="hashed-bow", help="Embedding model for vector/hybrid (default: hashed-bow)")
+    ps.add_argument("--nprobe", type=int, default=0, help="Search N IVF lists instead of all rows; 0 = exact (default: 0)")
+    ps.add_argument("--rescore", type=int, default=0, help="Re-rank N f16/i8 matrix candidates at full precision (default: 0)")
+    ps.add_argument("--collapse", action="store_true", help="Keep only the best ranked of near-duplicate chunks")
     ps.add_argument("--format", choices=["text", "json"], default="text")
     ps.set_defaults(_run=cmd_search.run)
 
@@ -72,12 +100,52 @@ def build_parser() -> argparse.ArgumentParser:
     pr.add_argument("--page", type=int, help="Page number in doc (1-based)")
     pr.add_argument("-n", "--topk", type=int, default=10, help="Top K results (default: 10)")
     pr.add_argument("--show", type=int, default=200, help="Preview length (chars) (default: 200)")
-    pr.add_argument("--embed-model", default="hashed-bow", help="Embedding model name (default: hashed-bow)")
+    pr.add_argument("--embed-model", default="hashed-bow", help="Embedding model name: hashed-bow, hashed-bow-cjk (default: hashed-bow)")
     pr.add_argument("--dim", type=int, default=768, help="Embedding dim (default: 768)")
     pr.add_argument("--bootstrap", action="store_true", help="If no embeddings exist, compute for all chunks once")
+    pr.add_argument("--nprobe", type=int, default=0, help="Search N IVF lists instead of all rows; 0 = exact (default: 0)")
+    pr.add_argument("--nlist", type=int, default=0, help="IVF list count when (re)building the index; 0 = sqrt(rows)")
+    pr.add_argument("--quant", choices=["f32", "f16", "i8"], default=None, help="Convert the model's matrix to this format first")
+    pr.add_argument("--rescore", type=int, default=0, help="Re-rank N f16/i8 matrix candidates at full precision (default: 0)")
+    pr.add_argument("--collapse", action="store_true", help="Keep only the best ranked of near-duplicate chunks")
     pr.add_argument("--format", choices=["text", "json"], default="text")
     pr.set_defaults(_run=cmd_related.run)
 
+    pm = sub.add_parser("migrate", help="Upgrade the db schema; optionally rebuild the FTS index")
+    pm.add_argument(
+        "--fts-tokenizer", choices=["unicode61", "trigram"], default=None,
+        help="Rebuild chunk_fts with this tokenizer; trigram matches CJK sub-phrases and substrings",
+    )
+    pm.add_argument("--rebuild-fts", action="store_true", help="Rebuild chunk_fts from chunk even if the tokenizer is unchanged")
+    pm.add_argument("--check-fts", action="store_true", help="Check chunk_fts against chunk (reads every chunk); exit 2 on problems")
+    pm.add_argument("--drop-text-cache", action="store_true", help="Delete all cached page text (see index --text-cache)")
+    pm.add_argument("--dedupe", action="store_true", help="Make docs with identical content (sha256) share one copy of chunks")
+    pm.add_argument("--vacuum", action="store_true", help="VACUUM (and rebuild chunk_fts) to give freed pages back to the file system")
+    pm.set_defaults(_run=cmd_migrate.run)
+
+    pc = sub.add_parser("compress", help="Compress stored chunk text with a dictionary trained on this db")
+    pc.add_argument("--codec", choices=["auto", "zstd", "zlib", "none"], default="auto",
+                    help="auto = zstd if the zstandard package is installed, else zlib; none = store plain text again")
+    pc.add_argument("--sample", type=int, default=2000, help="Chunks to train the dictionary on (default: 2000)")
+    pc.add_argument("--batch", type=int, default=1000, help="Chunks rewritten per transaction (default: 1000)")
+    pc.set_defaults(_run=cmd_compress.run)
+
+    pb = sub.add_parser("bench", help="Benchmark ingest/search/related on a synthetic corpus (ignores --db)")
+    pb.add_argument("--docs", type=int, default=50, help="Synthetic docs (default: 50)")
+    pb.add_argument("--pages", type=int, default=20, help="Pages per doc (default: 20)")
+    pb.add_argument("--words", type=int, default=250, help="Words per page (default: 250)")
+    pb.add_argument("--source", choices=["pages", "pdf"], default="pages",
+                    help="pages = index PageText directly; pdf = write text-only PDFs and time extraction too")
+    pb.add_argument("--queries", type=int, default=200, help="FTS queries to time (default: 200)")
+    pb.add_argument("--related", type=int, default=100, help="related lookups to time (default: 100)")
+    pb.add_argument("--embed-model", default="hashed-bow")
+    pb.add_argument("--dim", type=int, default=768)
+    pb.add_argument("--workers", type=int, default=1, help="Extraction processes with --source pdf (default: 1)")
+    pb.add_argument("--min-chars", type=int, default=200)
+    pb.add_argument("--seed", type=int, default=0, help="Same seed, same corpus and queries (default: 0)")
+    pb.add_argument("--workdir", default=None, help="Keep the corpus and bench.sqlite here (default: a temp dir)")
+    pb.add_argument("--out", default=None, help="Write the JSON result here instead of stdout")
+
     cmd_api.add_parser(sub)
 
     return p
@@ -86,6 +154,8 @@ def main(argv: list[str] | None = None) -> int:
     args = build_parser().parse_args(argv)
     if args.cmd == "api":
         return cmd_api.run(args)
+    if args.cmd == "bench":
+        return cmd_bench.run(args)
 
     conn = connect(args.db)
     try:
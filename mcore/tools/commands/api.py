@@ -3,6 +3,8 @@ from __future__ import annotations
 import argparse
 import json
 import os
+import sys
+import time
 import urllib.error
 import urllib.request
 
@@ -20,31 +22,68 @@ def add_parser(sub: argparse._SubParsersAction) -> None:
     pa_ing.add_argument("path")
     pa_ing.add_argument("--glob", default="*.pdf")
     pa_ing.add_argument("--force", action="store_true")
+    pa_ing.add_argument("--verify", action="store_true", help="Re-hash files instead of trusting size/mtime/inode")
     pa_ing.add_argument("--min-chars", type=int, default=200)
+    pa_ing.add_argument("--workers", type=int, default=1)
+    pa_ing.add_argument("--embed-model", default=None, help="Also embed new chunks with this model")
+    pa_ing.add_argument("--dim", type=int, default=768)
+    pa_ing.add_argument("--wait", action="store_true", help="Poll the background job until it finishes")
+    pa_ing.add_argument("--poll", type=float, default=1.0, help="Seconds between polls with --wait")
 
     pa_s = pa_sub.add_parser("search", help="Search indexed content")
     pa_s.add_argument("query")
     pa_s.add_argument("--topk", type=int, default=10)
     pa_s.add_argument("--doc", default=None)
     pa_s.add_argument("--path-prefix", default=None)
+    pa_s.add_argument("--folder", default=None)
     pa_s.add_argument("--snippet-tokens", type=int, default=24)
     pa_s.add_argument("--max-chars", type=int, default=400)
+    pa_s.add_argument("--mode", choices=["fts", "vector", "hybrid"], default="fts")
+    pa_s.add_argument("--fts-limit", type=int, default=50)
+    pa_s.add_argument("--vector-limit", type=int, default=50)
+    pa_s.add_argument("--fusion", choices=["rrf", "weighted"], default="rrf")
+    pa_s.add_argument("--embed-model", default="hashed-bow")
+    pa_s.add_argument("--nprobe", type=int, default=0)
     pa_s.add_argument("--format", choices=["text", "json"], default="text")
 
+    pa_rel = pa_sub.add_parser("related", help="Related chunks by embedding similarity")
+    tgt = pa_rel.add_mutually_exclusive_group(required=True)
+    tgt.add_argument("--query")
+    tgt.add_argument("--chunk-id")
+    tgt.add_argument("--doc", help="Doc path or doc_id (with --page)")
+    pa_rel.add_argument("--page", type=int, default=None)
+    pa_rel.add_argument("--topk", type=int, default=10)
+    pa_rel.add_argument("--max-chars", type=int, default=200)
+    pa_rel.add_argument("--embed-model", default="hashed-bow")
+    pa_rel.add_argument("--nprobe", type=int, default=0)
+    pa_rel.add_argument("--format", choices=["text", "json"], default="text")
+
     pa_r = pa_sub.add_parser("reindex", help="Reindex path or existing docs")
     pa_r.add_argument("--path", default=None)
     pa_r.add_argument("--glob", default="*.pdf")
     pa_r.add_argument("--force", action="store_true", default=True, help="Force rebuild (default: true)")
     pa_r.add_argument("--no-force", dest="force", action="store_false", help="Do not force rebuild")
+    pa_r.add_argument("--verify", action="store_true", help="Re-hash files instead of trusting size/mtime/inode")
     pa_r.add_argument("--min-chars", type=int, default=200)
+    pa_r.add_argument("--workers", type=int, default=1)
+    pa_r.add_argument("--embed-model", default=None, help="Also embed new chunks with this model")
+    pa_r.add_argument("--dim", type=int, default=768)
+    pa_r.add_argument("--wait", action="store_true", help="Poll the background job until it finishes")
+    pa_r.add_argument("--poll", type=float, default=1.0, help="Seconds between polls with --wait")
+
+    pa_j = pa_sub.add_parser("job", help="Show (or list) background ingest/reindex jobs")
+    pa_j.add_argument("job_id", nargs="?", default=None)
+    pa_j.add_argument("--cancel", action="store_true", help="Cancel the job")
+    pa_j.add_argument("--wait", action="store_true", help="Poll the job until it finishes")
+    pa_j.add_argument("--poll", type=float, default=1.0)
 
-def _post_json(url: str, payload: dict) -> dict:
-    data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+def _post_json(url: str, payload: dict | None) -> dict:
+    data = json.dumps(payload, ensure_ascii=False).encode("utf-8") if payload is not None else None
     req = urllib.request.Request(
         url,
         data=data,
         headers={"Content-Type": "application/json"},
-        method="POST",
+        method="POST" if payload is not None else "GET",
     )
     try:
         with urllib.request.urlopen(req, timeout=300) as resp:
@@ -54,6 +93,18 @@ def _post_json(url: str, payload: dict) -> dict:
         detail = e.read().decode("utf-8", errors="replace")
         raise SystemExit(f"HTTP {e.code}: {detail}") from e
 
+def _get_json(url: str) -> dict:
+    return _post_json(url, None)
+
+def _wait_job(base: str, job: dict, poll: float) -> dict:
+    while job.get("status") in ("queued", "running"):
+        print(f"\r{job['status']}: {job['done']}/{job['total']} files, {job['failed']} failed",
+              end="", file=sys.stderr, flush=True)
+        time.sleep(poll)
+        job = _get_json(f"{base}/jobs/{job['job_id']}")
+    print(file=sys.stderr)
+    return job
+
 def run(args) -> int:
     base = args.base.rstrip("/")
 
@@ -62,9 +113,15 @@ def run(args) -> int:
             "path": args.path,
             "glob": args.glob,
             "force": bool(args.force),
+            "verify": bool(args.verify),
             "min_chars": args.min_chars,
+            "workers": args.workers,
+            "embed_model": args.embed_model,
+            "dim": args.dim,
         }
         out = _post_json(f"{base}/ingest", payload)
+        if args.wait:
+            out = _wait_job(base, out, args.poll)
 
     elif args.api_cmd == "search":
         payload = {
@@ -72,8 +129,15 @@ def run(args) -> int:
             "topk": args.topk,
             "doc": args.doc,
             "path_prefix": args.path_prefix,
+            "folder": args.folder,
             "snippet_tokens": args.snippet_tokens,
             "max_chars": args.max_chars,
+            "mode": args.mode,
+            "fts_limit": args.fts_limit,
+            "vector_limit": args.vector_limit,
+            "fusion": args.fusion,
+            "embed_model": args.embed_model,
+            "nprobe": args.nprobe,
         }
         out = _post_json(f"{base}/search", payload)
 
@@ -90,14 +154,49 @@ def run(args) -> int:
                 print(f"    {r.get('snippet', '')}")
             return 0
 
+    elif args.api_cmd == "related":
+        payload = {
+            "query": args.query,
+            "chunk_id": args.chunk_id,
+            "doc": args.doc,
+            "page": args.page,
+            "topk": args.topk,
+            "max_chars": args.max_chars,
+            "embed_model": args.embed_model,
+            "nprobe": args.nprobe,
+        }
+        out = _post_json(f"{base}/related", payload)
+
+        if args.format == "text":
+            for i, r in enumerate(out.get("hits", []), 1):
+                print(f"{i:>2}. score={r['score']:.3f}  {r['source_path']}  p.{r['page_start']}-{r['page_end']}")
+                print("    " + r["preview"].replace("\n", " "))
+            return 0
+
     elif args.api_cmd == "reindex":
         payload = {
             "path": args.path,
             "glob": args.glob,
             "force": bool(args.force),
+            "verify": bool(args.verify),
             "min_chars": args.min_chars,
+            "workers": args.workers,
+            "embed_model": args.embed_model,
+            "dim": args.dim,
         }
         out = _post_json(f"{base}/reindex", payload)
+        if args.wait:
+            out = _wait_job(base, out, args.poll)
+
+    elif args.api_cmd == "job":
+        if args.job_id is None:
+            out = _get_json(f"{base}/jobs")
+        elif args.cancel:
+            out = _post_json(f"{base}/jobs/{args.job_id}/cancel", {})
+        else:
+            out = _get_json(f"{base}/jobs/{args.job_id}")
+            if args.wait:
+                out = _wait_job(base, out, args.poll)
 
     else:
         raise SystemExit("Unknown api command")
@@ -0,0 +1,32 @@
+from __future__ import annotations
+
+import json
+import sys
+import tempfile
+from mcore.bench import run_bench
+
+def run(args) -> int:
+    opts = {
+        "docs": args.docs, "pages": args.pages, "words": args.words, "source": args.source,
+        "queries": args.queries, "related_queries": args.related, "embed_model": args.embed_model,
+        "dim": args.dim, "workers": args.workers, "min_chars": args.min_chars, "seed": args.seed,
+    }
+    if args.workdir:
+        result = run_bench(args.workdir, **opts)
+    else:
+        with tempfile.TemporaryDirectory(prefix="membox-bench-") as d:
+            result = run_bench(d, **opts)
+
+    out = json.dumps(result, indent=2)
+    if not args.out:
+        print(out)
+        return 0
+    with open(args.out, "w", encoding="utf-8") as f:
+        f.write(out + "\n")
+    ing, fts, emb, rel = result["ingest"], result["fts"], result["embed"], result["related"]
+    print(f"ingest   {ing['pages_per_s']} pages/s ({ing['pages']} pages, {ing['chunks']} chunks)", file=sys.stderr)
+    print(f"fts      p50={fts['p50_ms']}ms p99={fts['p99_ms']}ms", file=sys.stderr)
+    print(f"embed    {emb['chunks_per_s']} chunks/s", file=sys.stderr)
+    print(f"related  p50={rel['p50_ms']}ms p99={rel['p99_ms']}ms cold={rel['cold_ms']}ms", file=sys.stderr)
+    print(f"wrote {args.out}", file=sys.stderr)
+    return 0
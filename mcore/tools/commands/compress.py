@@ -0,0 +1,65 @@
+from __future__ import annotations
+
+import sqlite3
+from mcore.db import init_db
+from mcore.textcodec import TextCodec, train_dict, zstd_available
+from mcore.util import now_iso
+
+def _text_bytes(conn: sqlite3.Connection) -> tuple[int, int]:
+    row = conn.execute(
+        "SELECT COALESCE(SUM(length(CAST(text AS BLOB))), 0), COALESCE(SUM(length(CAST(mb_text(text) AS BLOB))), 0) FROM chunk"
+    ).fetchone()
+    return int(row[0]), int(row[1])
+
+def run(conn: sqlite3.Connection, args) -> int:
+    init_db(conn)
+    codec = args.codec
+    if codec == "auto":
+        codec = "zstd" if zstd_available() else "zlib"
+    if codec == "zstd" and not zstd_available():
+        print("zstd needs the zstandard package (pip install zstandard); use --codec zlib")
+        return 2
+
+    stored, plain = _text_bytes(conn)
+    data = b""
+    if codec != "none":
+        samples = [r[0] for r in conn.execute("SELECT mb_text(text) FROM chunk ORDER BY random() LIMIT ?", (args.sample,))]
+        try:
+            data = train_dict(samples, codec)
+        except Exception as e:  # noqa: BLE001  (zstd training fails on tiny samples)
+            print(f"Could not train a {codec} dictionary from {len(samples)} chunks: {e}")
+            return 2
+    cur = conn.execute("INSERT INTO text_dict(codec, data, created_at) VALUES(?,?,?)", (codec, data, now_iso()))
+    dict_id = int(cur.lastrowid)
+    conn.commit()
+    tc = TextCodec(dict_id, codec, data) if codec != "none" else None
+
+    # Stored bytes change but the text does not, so chunk_fts needs no update: skip its trigger.
+    # Cached page text (text_cache_page) is rewritten too, since older dictionaries are dropped.
+    conn.execute("DROP TRIGGER IF EXISTS trg_chunk_au")
+    conn.commit()
+    try:
+        for table in ("chunk", "text_cache_page"):
+            last = 0
+            while True:
+                rows = conn.execute(
+                    f"SELECT rowid, mb_text(text) FROM {table} WHERE rowid > ? ORDER BY rowid LIMIT ?", (last, args.batch)
+                ).fetchall()
+                if not rows:
+                    break
+                conn.executemany(
+                    f"UPDATE {table} SET text=? WHERE rowid=?",
+                    [(tc.compress(t) if tc else t, rid) for rid, t in rows],
+                )
+                conn.commit()
+                last = rows[-1][0]
+        conn.execute("DELETE FROM text_dict WHERE dict_id < ?", (dict_id,))
+        conn.commit()
+    finally:
+        init_db(conn)
+
+    after, _ = _text_bytes(conn)
+    print(f"codec={codec} dict_id={dict_id} dict_bytes={len(data)}")
+    print(f"text: {plain / 1e6:.1f} MB plain, {stored / 1e6:.1f} MB stored before, {after / 1e6:.1f} MB stored now")
+    print("Run `mm migrate --vacuum` to shrink the file itself.")
+    return 0
@@ -1,23 +1,42 @@
 from __future__ import annotations
 
 import sqlite3
+import time
 from .common import print_kv
-from mcore.indexer import index_pdf, list_pdfs
+from mcore.indexer import IndexOptions, index_pdfs, list_pdfs
 from mcore.db import init_db
+from mcore.metrics import metrics
 
 def run(conn: sqlite3.Connection, args) -> int:
     init_db(conn)
+    metrics.reset()
+    t = time.perf_counter()
     pdfs = list_pdfs(args.path, glob_pat=args.glob)
-    total = indexed = unchanged = 0
-    for p in pdfs:
+    total = indexed = unchanged = duplicates = 0
+    options = IndexOptions(
+        min_chars=args.min_chars, embed_model=args.embed_model, dim=args.dim, quant=args.quant,
+        skip_near_dups=args.skip_near_dups, text_cache=args.text_cache,
+    )
+    for _p, info, err in index_pdfs(
+        conn, pdfs, options,
+        force=args.force, verify=args.verify, reextract=args.reextract,
+        workers=args.workers, split_pages=args.split_pages, batch_docs=args.batch_docs, bulk=args.bulk,
+    ):
+        if err is not None:
+            raise err
         total += 1
-        info = index_pdf(conn, p, force=args.force, min_chars=args.min_chars)
         if info["status"] == "indexed":
             indexed += 1
+        elif info["status"] == "duplicate":
+            duplicates += 1
         else:
             unchanged += 1
         if not args.quiet:
             print_kv(info)
     if not args.quiet:
-        print(f"\nDone. total={total} indexed={indexed} unchanged={unchanged}")
+        print(f"\nDone. total={total} indexed={indexed} duplicate={duplicates} unchanged={unchanged}")
+    if args.stats:
+        print(f"\nwall {time.perf_counter() - t:.3f}s (stage times include worker processes, so they can exceed it)")
+        for line in metrics.summary():
+            print(line)
     return 0
@@ -0,0 +1,49 @@
+from __future__ import annotations
+
+import sqlite3
+from mcore.db import SCHEMA_VERSION, fts_problems, fts_tokenizer, init_db, rebuild_fts, vacuum
+from mcore.indexer import clear_text_cache, dedupe_docs
+
+def _db_bytes(conn: sqlite3.Connection) -> int:
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    return int(conn.execute("PRAGMA page_count").fetchone()[0]) * int(conn.execute("PRAGMA page_size").fetchone()[0])
+
+def run(conn: sqlite3.Connection, args) -> int:
+    before = int(conn.execute("PRAGMA user_version").fetchone()[0])
+    size = _db_bytes(conn)
+    init_db(conn)
+    print(f"schema: v{before} -> v{SCHEMA_VERSION}")
+
+    current = fts_tokenizer(conn)
+    tokenizer = args.fts_tokenizer or current
+    if tokenizer != current or args.rebuild_fts:
+        try:
+            rebuild_fts(conn, tokenizer)
+        except sqlite3.OperationalError as e:
+            print(f"Could not rebuild chunk_fts with {tokenizer}: {e}")
+            return 2
+        print(f"chunk_fts: rebuilt, tokenizer {current} -> {tokenizer}")
+    else:
+        print(f"chunk_fts: tokenizer {current}")
+    if args.check_fts:
+        problems = fts_problems(conn, deep=True)
+        conn.commit()  # integrity-check is an INSERT; end its transaction
+        for p in problems:
+            print(f"chunk_fts: {p}")
+        if problems:
+            print("chunk_fts: run `mm migrate --rebuild-fts` to fix")
+            return 2
+        print("chunk_fts: consistent with chunk")
+    if args.drop_text_cache:
+        dropped = clear_text_cache(conn)
+        conn.commit()
+        print(f"text cache: dropped {dropped} files' pages")
+    if args.dedupe:
+        made = dedupe_docs(conn)
+        conn.commit()
+        print(f"dedupe: {made} docs now share another doc's chunks")
+    if args.vacuum:
+        vacuum(conn)
+        print("vacuumed")
+    print(f"size: {size / 1e6:.1f} MB -> {_db_bytes(conn) / 1e6:.1f} MB")
+    return 0
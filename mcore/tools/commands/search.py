@@ -2,45 +2,41 @@ from __future__ import annotations
 
 import sqlite3
 from mcore.db import init_db
+from mcore.search import resolve_doc, search
 
 def run(conn: sqlite3.Connection, args) -> int:
     init_db(conn)
     q = args.query.strip()
 
-    where = []
-    params = []
-
+    doc_id = None
     if args.doc:
-        row = conn.execute("SELECT doc_id FROM doc WHERE source_path=? OR doc_id=?", (args.doc, args.doc)).fetchone()
-        if not row:
+        doc_id = resolve_doc(conn, args.doc)
+        if doc_id is None:
             print(f"No such doc: {args.doc}")
             return 2
-        where.append("f.doc_id = ?")
-        params.append(row["doc_id"])
-
-    if args.path_prefix:
-        where.append("d.source_path LIKE ?")
-        params.append(args.path_prefix.rstrip("/") + "%")
-
-    where_sql = (" AND " + " AND ".join(where)) if where else ""
 
     snip_tokens = max(8, int(args.show // 8))
-    sql = f"""
-    SELECT d.source_path, f.page_start, f.chunk_id,
-           snippet(chunk_fts, 0, '[', ']', '…', ?) AS snip
-    FROM chunk_fts f
-    JOIN doc d ON d.doc_id = f.doc_id
-    WHERE chunk_fts MATCH ? {where_sql}
-    LIMIT ?
-    """
-    rows = conn.execute(sql, (snip_tokens, q, *params, args.topk)).fetchall()
+    hits = search(
+        conn, q, topk=args.topk, mode=args.mode, doc_id=doc_id, path_prefix=args.path_prefix,
+        snippet_tokens=snip_tokens, max_chars=args.show,
+        fts_limit=args.fts_limit, vector_limit=args.vector_limit, fusion=args.fusion,
+        embed_model=args.embed_model, nprobe=args.nprobe, folder=args.folder, rescore=args.rescore,
+        collapse=args.collapse,
+    )
 
     if args.format == "json":
         import json
-        print(json.dumps([dict(r) for r in rows], ensure_ascii=False, indent=2))
+        keys = ("source_path", "paths", "page_start", "page_end", "chunk_id", "score", "fts_rank", "vector_rank")
+        if args.collapse:
+            keys += ("near_duplicates",)
+        print(json.dumps([{**{k: h[k] for k in keys}, "snip": h["snippet"]} for h in hits], ensure_ascii=False, indent=2))
         return 0
 
-    for i, r in enumerate(rows, 1):
-        print(f"{i:>2}. {r['source_path']}  p.{r['page_start']}")
-        print(f"    {r['snip']}")
+    for i, h in enumerate(hits, 1):
+        score = f"  score={h['score']:.3f}" if args.mode != "fts" else ""
+        dups = f"  (+{h['near_duplicates']} near-duplicate)" if h.get("near_duplicates") else ""
+        print(f"{i:>2}. {h['source_path']}  p.{h['page_start']}{score}{dups}")
+        if len(h["paths"]) > 1:
+            print(f"    also at: {', '.join(p for p in h['paths'] if p != h['source_path'])}")
+        print(f"    {h['snippet']}".replace("\n", " "))
     return 0
@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import hashlib
+import os
 import uuid
 from datetime import datetime, timezone
 from pathlib import Path
@@ -18,5 +19,10 @@ def sha256_file(path: str) -> str:
             h.update(chunk)
     return h.hexdigest()
 
+def file_signature(path: str) -> tuple[int, int, int]:
+    """(size, mtime_ns, inode): cheap stand-in for the content hash when nothing changed."""
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns, st.st_ino
+
 def norm_path(path: str) -> str:
     return str(Path(path).expanduser().resolve())
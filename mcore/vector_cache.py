@@ -0,0 +1,103 @@
+from __future__ import annotations
+
+import sqlite3
+import threading
+from dataclasses import dataclass
+
+import numpy as np
+
+from .ann import IVFIndex, load_ivf
+from .vector_store import (
+    Int8Matrix, Matrix, _generation, _matrix_meta, alloc_matrix, ensure_matrix, fetch_all_embeddings, open_matrix, sidecar_dir,
+)
+
+@dataclass
+class _Entry:
+    generation: int
+    epoch: int
+    dim: int
+    ids: list[str]
+    buf: Matrix  # (capacity, dim); rows [:n] are live
+    n: int
+    ivf: IVFIndex | None = None
+    ivf_key: tuple[int, int, int] | None = None
+
+    def matrix(self) -> Matrix:
+        return self.buf[:self.n]
+
+def _empty() -> np.ndarray:
+    return np.zeros((0, 0), dtype=np.float32)
+
+def _resident(disk: Matrix) -> Matrix:
+    if isinstance(disk, Int8Matrix):
+        return Int8Matrix(np.array(disk.codes), np.array(disk.scale))
+    return np.array(disk)
+
+class VectorCache:
+    """Per-model embedding matrices held in process memory for a long-running service.
+
+    Each lookup costs one generation read. When the model's generation moved,
+    rows appended to the sidecar (same epoch) are copied onto the end of the
+    resident matrix; a new epoch (sidecar rebuilt) reloads it. Snapshots handed
+    out earlier stay valid: rows [:n] are never rewritten in place.
+
+    `quant` (f16/i8) converts the sidecar to that format and keeps it resident
+    as such (2x/4x smaller than f32); None keeps whatever the sidecar has.
+    """
+
+    def __init__(self, quant: str | None = None) -> None:
+        self.quant = quant
+        self._entries: dict[str, _Entry] = {}
+        self._lock = threading.Lock()
+
+    def get(self, conn: sqlite3.Connection, model: str) -> tuple[list[str], int, Matrix]:
+        gen = _generation(conn, model)
+        with self._lock:
+            e = self._entries.get(model)
+            if e is None or e.generation != gen:
+                e = self._entries[model] = self._refresh(conn, model, e, gen)
+            return e.ids, e.dim, e.matrix()
+
+    def ivf(self, conn: sqlite3.Connection, model: str, nlist: int = 0) -> IVFIndex | None:
+        """IVF index over the resident matrix; only re-checked when the matrix changed."""
+        ids, _, mat = self.get(conn, model)
+        with self._lock:
+            e = self._entries[model]
+            key = (e.epoch, e.n, nlist)
+            if e.ivf_key != key and e.n:
+                e.ivf = load_ivf(conn, model, ids[:e.n], mat, nlist=nlist)
+                e.ivf_key = key
+            return e.ivf
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def _refresh(self, conn: sqlite3.Connection, model: str, e: _Entry | None, gen: int) -> _Entry:
+        d = sidecar_dir(conn)
+        if d is None:
+            ids, dim, mat = fetch_all_embeddings(conn, model, self.quant or "f32")
+            return _Entry(gen, 0, dim, ids, mat, len(ids))
+        ensure_matrix(conn, model, self.quant)
+        meta = _matrix_meta(conn, model)
+        if meta is None or meta["n_rows"] == 0:
+            return _Entry(gen, 0, 0, [], _empty(), 0)
+        n, dim, epoch = int(meta["n_rows"]), int(meta["dim"]), int(meta["epoch"])
+        disk = open_matrix(d, meta)
+        if e is not None and e.epoch == epoch and e.dim == dim and e.n <= n:
+            tail = [r[0] for r in conn.execute(
+                "SELECT chunk_id FROM embedding_matrix_row WHERE embedding_model=? AND row_no >= ? ORDER BY row_no",
+                (model, e.n),
+            )]
+            if len(tail) == n - e.n:
+                buf = e.buf
+                if n > buf.shape[0]:
+                    buf = alloc_matrix(meta["quant"], max(n, 2 * buf.shape[0]), dim)
+                    buf[:e.n] = e.buf[:e.n]
+                buf[e.n:n] = disk[e.n:n]
+                e.ids.extend(tail)
+                return _Entry(gen, epoch, dim, e.ids, buf, n, e.ivf, e.ivf_key)
+        ids = [r[0] for r in conn.execute(
+            "SELECT chunk_id FROM embedding_matrix_row WHERE embedding_model=? ORDER BY row_no", (model,)
+        )]
+        return _Entry(gen, epoch, dim, ids, _resident(disk), n)
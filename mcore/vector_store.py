@@ -1,14 +1,104 @@
 from __future__ import annotations
 
+import os
+import re
 import sqlite3
+from pathlib import Path
+from typing import Callable
+
 import numpy as np
 
-def _vec_to_blob(v: np.ndarray) -> bytes:
-    v = np.asarray(v, dtype=np.float32)
-    return v.tobytes()
+# Storage/matrix formats: float32, float16, or int8 codes with one float32 scale per vector.
+QUANTS = ("f32", "f16", "i8")
+_BLOCK = 8192
+
+class Int8Matrix:
+    """(n, dim) int8 codes plus a per-row float32 scale: row i ~= codes[i] * scale[i].
+
+    Indexing returns an Int8Matrix; np.asarray() gives the dequantized float32 rows.
+    """
+
+    dtype = np.dtype(np.int8)
+
+    def __init__(self, codes: np.ndarray, scale: np.ndarray) -> None:
+        self.codes = codes
+        self.scale = scale
+
+    @property
+    def shape(self) -> tuple[int, ...]:
+        return self.codes.shape
+
+    @property
+    def size(self) -> int:
+        return self.codes.size
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + self.scale.nbytes
+
+    def __len__(self) -> int:
+        return self.codes.shape[0]
+
+    def __getitem__(self, idx) -> Int8Matrix:
+        return Int8Matrix(self.codes[idx], self.scale[idx])
+
+    def __setitem__(self, idx, other: Int8Matrix) -> None:
+        self.codes[idx] = other.codes
+        self.scale[idx] = other.scale
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        out = self.codes.astype(np.float32) * self.scale[:, None]
+        return out if dtype is None else out.astype(dtype, copy=False)
+
+Matrix = np.ndarray | Int8Matrix
+
+def _check_quant(quant: str) -> None:
+    if quant not in QUANTS:
+        raise ValueError(f"Unknown vector format: {quant} (known: {', '.join(QUANTS)})")
+
+def _i8_dtype(dim: int) -> np.dtype:
+    """On-disk int8 row: scale first, then the codes (sidecar rows and embedding.vec alike)."""
+    return np.dtype([("scale", "<f4"), ("codes", "i1", (dim,))])
+
+def row_bytes(quant: str, dim: int) -> int:
+    return dim * 4 if quant == "f32" else dim * 2 if quant == "f16" else dim + 4
 
-def _blob_to_vec(b: bytes, dim: int) -> np.ndarray:
-    v = np.frombuffer(b, dtype=np.float32)
+def quantize(mat: np.ndarray, quant: str) -> Matrix:
+    """float32 rows -> the `quant` format."""
+    _check_quant(quant)
+    mat = np.asarray(mat, dtype=np.float32)
+    if quant == "f32":
+        return mat
+    if quant == "f16":
+        return mat.astype(np.float16)
+    scale = np.abs(mat).max(axis=1) / 127.0 if mat.size else np.zeros(mat.shape[0], dtype=np.float32)
+    scale[scale == 0] = 1.0
+    return Int8Matrix(np.rint(mat / scale[:, None]).astype(np.int8), scale.astype(np.float32))
+
+def alloc_matrix(quant: str, n: int, dim: int) -> Matrix:
+    if quant == "i8":
+        return Int8Matrix(np.zeros((n, dim), dtype=np.int8), np.ones(n, dtype=np.float32))
+    return np.zeros((n, dim), dtype=np.float16 if quant == "f16" else np.float32)
+
+def is_quantized(mat: Matrix) -> bool:
+    return isinstance(mat, Int8Matrix) or mat.dtype != np.float32
+
+def _rows_to_bytes(mat: Matrix) -> bytes:
+    if not isinstance(mat, Int8Matrix):
+        return mat.tobytes()
+    rec = np.empty(len(mat), dtype=_i8_dtype(mat.shape[1]))
+    rec["scale"] = mat.scale
+    rec["codes"] = mat.codes
+    return rec.tobytes()
+
+def _vec_to_blob(v: np.ndarray, quant: str = "f32") -> bytes:
+    return _rows_to_bytes(quantize(np.asarray(v, dtype=np.float32)[None, :], quant))
+
+def _blob_to_vec(b: bytes, dim: int, quant: str = "f32") -> np.ndarray:
+    if quant == "i8":
+        v = np.frombuffer(b, dtype=np.int8, offset=4).astype(np.float32) * np.frombuffer(b, dtype="<f4", count=1)[0]
+    else:
+        v = np.frombuffer(b, dtype=np.float16 if quant == "f16" else np.float32).astype(np.float32, copy=False)
     if v.size != dim:
         out = np.zeros(dim, dtype=np.float32)
         n = min(dim, v.size)
@@ -16,40 +106,302 @@ def _blob_to_vec(b: bytes, dim: int) -> np.ndarray:
         return out
     return v
 
-def upsert_embeddings(conn: sqlite3.Connection, items: list[tuple[str, str, int, np.ndarray]]) -> None:
-    now = conn.execute("SELECT datetime('now')").fetchone()[0]
-    for chunk_id, model, dim, vec in items:
-        blob = _vec_to_blob(vec)
-        conn.execute(
-            "INSERT INTO embedding(chunk_id, embedding_model, embedding_dim, vec, created_at) VALUES(?,?,?,?,?) "
-            "ON CONFLICT(chunk_id) DO UPDATE SET embedding_model=excluded.embedding_model, embedding_dim=excluded.embedding_dim, vec=excluded.vec, created_at=excluded.created_at",
-            (chunk_id, model, dim, blob, now),
-        )
+def _generation(conn: sqlite3.Connection, model: str) -> int:
+    row = conn.execute("SELECT generation FROM embedding_state WHERE embedding_model=?", (model,)).fetchone()
+    return int(row[0]) if row else 0
+
+def embedding_generation(conn: sqlite3.Connection, model: str) -> int:
+    """Moves whenever the model's embeddings are written or deleted."""
+    return _generation(conn, model)
+
+def _bump_generation(conn: sqlite3.Connection, model: str) -> None:
+    conn.execute(
+        "INSERT INTO embedding_state(embedding_model, generation) VALUES(?, 1) "
+        "ON CONFLICT(embedding_model) DO UPDATE SET generation = generation + 1",
+        (model,),
+    )
+
+def _existing_ids(conn: sqlite3.Connection, chunk_ids: list[str]) -> set[str]:
+    found: set[str] = set()
+    for i in range(0, len(chunk_ids), 500):
+        part = chunk_ids[i:i + 500]
+        marks = ",".join("?" * len(part))
+        found.update(r[0] for r in conn.execute(f"SELECT chunk_id FROM embedding WHERE chunk_id IN ({marks})", part))
+    return found
+
+def upsert_embeddings(
+    conn: sqlite3.Connection,
+    items: list[tuple[str, str, int, np.ndarray]],
+    sync_matrix: bool = True,
+    quant: str = "f32",
+) -> None:
+    """Insert/replace embeddings and commit.
+
+    `quant` is the format the vectors are stored in (f16 halves the table, i8
+    quarters it, but rescoring then has only that precision to go back to).
+    With sync_matrix=False the sidecar is left alone (and goes stale); callers
+    writing many batches use that and call ensure_matrix() once at the end.
+    """
+    _check_quant(quant)
+    by_model: dict[str, list[tuple[str, str, int, np.ndarray]]] = {}
+    for it in items:
+        by_model.setdefault(it[1], []).append(it)
+    # Pure appends of new chunk_ids to an up-to-date sidecar extend it in place; anything else rebuilds.
+    appendable = {
+        model: matrix_current(conn, model) and not _existing_ids(conn, [it[0] for it in group])
+        for model, group in by_model.items()
+    }
+    write_embeddings(conn, items, quant)
     conn.commit()
+    if not sync_matrix or sidecar_dir(conn) is None:
+        return
+    for model, group in by_model.items():
+        if not (appendable[model] and _append_matrix(conn, model, group)):
+            rebuild_matrix(conn, model)
 
-def fetch_all_embeddings(conn: sqlite3.Connection, model_name: str) -> tuple[list[str], int, np.ndarray]:
-    rows = conn.execute("SELECT chunk_id, embedding_dim, vec FROM embedding WHERE embedding_model=?", (model_name,)).fetchall()
+def write_embeddings(conn: sqlite3.Connection, items: list[tuple[str, str, int, np.ndarray]], quant: str = "f32") -> None:
+    """Insert/replace embeddings inside the caller's transaction; the sidecar goes stale until ensure_matrix()."""
+    _check_quant(quant)
+    now = conn.execute("SELECT datetime('now')").fetchone()[0]
+    conn.executemany(
+        "INSERT INTO embedding(chunk_id, embedding_model, embedding_dim, vec, vec_format, created_at) VALUES(?,?,?,?,?,?) "
+        "ON CONFLICT(chunk_id) DO UPDATE SET embedding_model=excluded.embedding_model, embedding_dim=excluded.embedding_dim, "
+        "vec=excluded.vec, vec_format=excluded.vec_format, created_at=excluded.created_at",
+        [(chunk_id, model, dim, _vec_to_blob(vec, quant), quant, now) for chunk_id, model, dim, vec in items],
+    )
+    for model in {it[1] for it in items}:
+        _bump_generation(conn, model)
+
+def fetch_all_embeddings(conn: sqlite3.Connection, model_name: str, quant: str = "f32") -> tuple[list[str], int, Matrix]:
+    """All of the model's vectors as one matrix in the `quant` format, whatever format they are stored in."""
+    _check_quant(quant)
+    rows = conn.execute(
+        "SELECT chunk_id, embedding_dim, vec, vec_format FROM embedding WHERE embedding_model=?", (model_name,)
+    ).fetchall()
     if not rows:
         return [], 0, np.zeros((0, 0), dtype=np.float32)
     dim = int(rows[0]["embedding_dim"])
-    ids = []
-    mat = np.zeros((len(rows), dim), dtype=np.float32)
-    for i, r in enumerate(rows):
-        ids.append(r["chunk_id"])
-        mat[i, :] = _blob_to_vec(r["vec"], dim)
+    ids = [r["chunk_id"] for r in rows]
+    mat = alloc_matrix(quant, len(rows), dim)
+    for s in range(0, len(rows), _BLOCK):
+        part = rows[s:s + _BLOCK]
+        mat[s:s + len(part)] = quantize(np.stack([_blob_to_vec(r["vec"], dim, r["vec_format"]) for r in part]), quant)
     return ids, dim, mat
 
-def cosine_topk(query: np.ndarray, ids: list[str], mat: np.ndarray, k: int = 10) -> list[tuple[str, float]]:
+def exact_vectors(conn: sqlite3.Connection, model: str, chunk_ids: list[str], dim: int = 0) -> np.ndarray:
+    """float32 rows for chunk_ids, in that order, from the embedding table (zeros if gone).
+
+    `dim` is the row width (default: the stored vectors'); pass the matrix's so a result
+    with none of them found still has the query's width.
+    """
+    found: dict[str, np.ndarray] = {}
+    for i in range(0, len(chunk_ids), 500):
+        part = chunk_ids[i:i + 500]
+        marks = ",".join("?" * len(part))
+        for r in conn.execute(
+            f"SELECT chunk_id, embedding_dim, vec, vec_format FROM embedding WHERE embedding_model=? AND chunk_id IN ({marks})",
+            (model, *part),
+        ):
+            dim = dim or int(r["embedding_dim"])
+            found[r["chunk_id"]] = _blob_to_vec(r["vec"], dim, r["vec_format"])
+    out = np.zeros((len(chunk_ids), dim), dtype=np.float32)
+    for i, cid in enumerate(chunk_ids):
+        if cid in found:
+            out[i] = found[cid]
+    return out
+
+def sidecar_dir(conn: sqlite3.Connection) -> Path | None:
+    """<db>.vec next to the main db file; None for in-memory dbs."""
+    row = conn.execute("PRAGMA database_list").fetchone()
+    if not row or not row[2]:
+        return None
+    return Path(row[2] + ".vec")
+
+def sidecar_name(model: str, suffix: str = ".f32") -> str:
+    """File name for model with suffix; matrices use the format as suffix (.f32/.f16/.i8)."""
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", model) + suffix
+
+def _matrix_meta(conn: sqlite3.Connection, model: str) -> sqlite3.Row | None:
+    return conn.execute(
+        "SELECT file_name, dim, n_rows, generation, epoch, quant FROM embedding_matrix WHERE embedding_model=?", (model,)
+    ).fetchone()
+
+def matrix_epoch(conn: sqlite3.Connection, model: str) -> int:
+    """Sidecar epoch: stays the same while the matrix is only appended to."""
+    meta = _matrix_meta(conn, model)
+    return int(meta["epoch"]) if meta else 0
+
+def matrix_current(conn: sqlite3.Connection, model: str) -> bool:
+    """True if the sidecar file exists and reflects the model's current generation."""
+    d = sidecar_dir(conn)
+    meta = _matrix_meta(conn, model)
+    if d is None or meta is None or meta["generation"] != _generation(conn, model):
+        return False
+    p = d / meta["file_name"]
+    return p.exists() and p.stat().st_size == meta["n_rows"] * row_bytes(meta["quant"], meta["dim"])
+
+def matrix_quant(conn: sqlite3.Connection, model: str) -> str:
+    meta = _matrix_meta(conn, model)
+    return meta["quant"] if meta else "f32"
+
+def ensure_matrix(conn: sqlite3.Connection, model: str, quant: str | None = None) -> None:
+    """Rebuild the sidecar if it is stale or, with `quant`, in another format."""
+    if sidecar_dir(conn) is None:
+        return
+    if not matrix_current(conn, model) or (quant is not None and quant != matrix_quant(conn, model)):
+        rebuild_matrix(conn, model, quant)
+
+def open_matrix(d: Path, meta: sqlite3.Row) -> Matrix:
+    """Read-only memmap over a sidecar matrix (meta must have n_rows > 0)."""
+    n, dim, quant = int(meta["n_rows"]), int(meta["dim"]), meta["quant"]
+    if quant == "i8":
+        rec = np.memmap(d / meta["file_name"], dtype=_i8_dtype(dim), mode="r", shape=(n,))
+        return Int8Matrix(rec["codes"], rec["scale"])
+    return np.memmap(d / meta["file_name"], dtype=np.float16 if quant == "f16" else np.float32, mode="r", shape=(n, dim))
+
+def rebuild_matrix(conn: sqlite3.Connection, model: str, quant: str | None = None) -> None:
+    """Rewrite <db>.vec/<model>.<quant> and its id map from the embedding table.
+
+    quant=None keeps the sidecar's current format (f32 for a new one).
+    """
+    d = sidecar_dir(conn)
+    if d is None:
+        return
+    d.mkdir(parents=True, exist_ok=True)
+    meta = _matrix_meta(conn, model)
+    quant = quant or (meta["quant"] if meta else "f32")
+    _check_quant(quant)
+    gen = _generation(conn, model)
+    file_name = sidecar_name(model, "." + quant)
+    tmp = d / (file_name + ".tmp")
+    ids: list[str] = []
+    dim = 0
+    with open(tmp, "wb") as f:
+        for r in conn.execute(
+            "SELECT chunk_id, embedding_dim, vec, vec_format FROM embedding WHERE embedding_model=? ORDER BY rowid", (model,)
+        ):
+            if not dim:
+                dim = int(r["embedding_dim"])
+            f.write(_rows_to_bytes(quantize(_blob_to_vec(r["vec"], dim, r["vec_format"])[None, :], quant)))
+            ids.append(r["chunk_id"])
+    os.replace(tmp, d / file_name)
+    if meta is not None and meta["file_name"] != file_name:
+        (d / meta["file_name"]).unlink(missing_ok=True)
+    epoch = (meta["epoch"] + 1) if meta else 1
+    conn.execute("DELETE FROM embedding_matrix_row WHERE embedding_model=?", (model,))
+    conn.executemany(
+        "INSERT INTO embedding_matrix_row(embedding_model, row_no, chunk_id) VALUES(?,?,?)",
+        [(model, i, cid) for i, cid in enumerate(ids)],
+    )
+    conn.execute(
+        "INSERT INTO embedding_matrix(embedding_model, file_name, dim, n_rows, generation, epoch, quant, updated_at) "
+        "VALUES(?,?,?,?,?,?,?,datetime('now')) "
+        "ON CONFLICT(embedding_model) DO UPDATE SET file_name=excluded.file_name, dim=excluded.dim, n_rows=excluded.n_rows, "
+        "generation=excluded.generation, epoch=excluded.epoch, quant=excluded.quant, updated_at=excluded.updated_at",
+        (model, file_name, dim, len(ids), gen, epoch, quant),
+    )
+    conn.commit()
+
+def _append_matrix(conn: sqlite3.Connection, model: str, items: list[tuple[str, str, int, np.ndarray]]) -> bool:
+    d = sidecar_dir(conn)
+    meta = _matrix_meta(conn, model)
+    if d is None or meta is None or (meta["n_rows"] and any(dim != meta["dim"] for _, _, dim, _ in items)):
+        return False
+    dim = meta["dim"] if meta["n_rows"] else items[0][2]
+    start = meta["n_rows"]
+    rows = np.stack([_blob_to_vec(_vec_to_blob(vec), dim) for _, _, _, vec in items])
+    with open(d / meta["file_name"], "ab") as f:
+        f.write(_rows_to_bytes(quantize(rows, meta["quant"])))
+    conn.executemany(
+        "INSERT INTO embedding_matrix_row(embedding_model, row_no, chunk_id) VALUES(?,?,?)",
+        [(model, start + i, it[0]) for i, it in enumerate(items)],
+    )
+    conn.execute(
+        "UPDATE embedding_matrix SET dim=?, n_rows=?, generation=?, updated_at=datetime('now') WHERE embedding_model=?",
+        (dim, start + len(items), _generation(conn, model), model),
+    )
+    conn.commit()
+    return True
+
+def load_embeddings(conn: sqlite3.Connection, model_name: str, quant: str | None = None) -> tuple[list[str], int, Matrix]:
+    """Like fetch_all_embeddings, but returns a read-only np.memmap over the sidecar matrix.
+
+    The sidecar is rebuilt first if it is missing, behind the embedding table,
+    or (with `quant`) in another format. Falls back to fetch_all_embeddings for
+    in-memory dbs.
+    """
+    d = sidecar_dir(conn)
+    if d is None:
+        return fetch_all_embeddings(conn, model_name, quant or "f32")
+    ensure_matrix(conn, model_name, quant)
+    meta = _matrix_meta(conn, model_name)
+    if meta is None or meta["n_rows"] == 0:
+        return [], 0, np.zeros((0, 0), dtype=np.float32)
+    ids = [r[0] for r in conn.execute(
+        "SELECT chunk_id FROM embedding_matrix_row WHERE embedding_model=? ORDER BY row_no", (model_name,)
+    )]
+    return ids, int(meta["dim"]), open_matrix(d, meta)
+
+def scores(mat: Matrix, q: np.ndarray) -> np.ndarray:
+    """mat @ q as float32; quantized matrices are widened one block at a time."""
+    if not is_quantized(mat):
+        return mat @ q
+    out = np.empty(mat.shape[0], dtype=np.float32)
+    for s in range(0, mat.shape[0], _BLOCK):
+        blk = mat[s:s + _BLOCK]
+        if isinstance(blk, Int8Matrix):
+            out[s:s + len(blk)] = (blk.codes.astype(np.float32) @ q) * blk.scale
+        else:
+            out[s:s + len(blk)] = blk.astype(np.float32) @ q
+    return out
+
+def _top(sims: np.ndarray, k: int) -> np.ndarray:
+    if k >= sims.shape[0]:
+        return np.argsort(-sims)
+    idx = np.argpartition(-sims, k)[:k]
+    return idx[np.argsort(-sims[idx])]
+
+def rescore_exact(
+    query: np.ndarray, pairs: list[tuple[str, float]], exact: Callable[[list[str]], np.ndarray], k: int
+) -> list[tuple[str, float]]:
+    """Re-rank candidate (chunk_id, score) pairs with the full-precision vectors from `exact`.
+
+    If `exact` has no vectors to give (the rows went since the matrix was built), the pairs stay as they are.
+    """
+    if not pairs:
+        return []
+    q = np.asarray(query, dtype=np.float32)
+    n = float(np.linalg.norm(q))
+    if n > 0:
+        q = q / n
+    cand = [cid for cid, _ in pairs]
+    vecs = exact(cand)
+    if vecs.shape[1] != q.shape[0]:
+        return pairs[:k]
+    sims = vecs @ q
+    return [(cand[i], float(sims[i])) for i in _top(sims, k)]
+
+def cosine_topk(
+    query: np.ndarray,
+    ids: list[str],
+    mat: Matrix,
+    k: int = 10,
+    rescore: int = 0,
+    exact: Callable[[list[str]], np.ndarray] | None = None,
+) -> list[tuple[str, float]]:
+    """Top-k rows of mat by cosine with query.
+
+    On a quantized matrix, rescore=N with an `exact` (chunk_ids -> float32 rows)
+    callable takes the top max(k, N) approximate hits and re-ranks them exactly.
+    """
     if mat.size == 0:
         return []
     q = np.asarray(query, dtype=np.float32)
     n = float(np.linalg.norm(q))
     if n > 0:
         q = q / n
-    sims = mat @ q
-    if k >= sims.shape[0]:
-        idx = np.argsort(-sims)
-    else:
-        idx = np.argpartition(-sims, k)[:k]
-        idx = idx[np.argsort(-sims[idx])]
-    return [(ids[i], float(sims[i])) for i in idx]
+    sims = scores(mat, q)
+    refine = bool(rescore) and exact is not None and is_quantized(mat)
+    idx = _top(sims, max(k, rescore) if refine else k)
+    pairs = [(ids[i], float(sims[i])) for i in idx]
+    return rescore_exact(q, pairs, exact, k) if refine else pairs
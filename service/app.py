@@ -1,8 +1,20 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
+from .deps import close_pools, get_db_path, get_pool
+from .jobs import jobs
 from .routes import router
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Open the pool (and run init_db) once, before the first request.
+    get_pool(get_db_path())
+    yield
+    jobs.shutdown()
+    close_pools()
+
 def create_app() -> FastAPI:
-    app = FastAPI(title="membox API", version="0.5")
+    app = FastAPI(title="membox API", version="0.5", lifespan=lifespan)
     app.include_router(router)
     return app
 
@@ -0,0 +1,83 @@
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable
+
+
+class SearchCache:
+    """Bounded LRU + TTL cache of /search responses.
+
+    Entries are only valid for the generation they were computed under; the
+    first lookup that sees a new generation drops everything. `version` is
+    checked per entry instead (e.g. the embedding generation a vector search
+    used), so requests under different versions don't evict each other.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 300.0) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[Hashable, tuple[float, Hashable, Any]] = OrderedDict()
+        self._generation: Hashable = None
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.expired = self.invalidations = self.stale = 0
+
+    def _sync(self, generation: Hashable) -> None:
+        if generation != self._generation:
+            if self._data:
+                self.invalidations += 1
+            self._data.clear()
+            self._generation = generation
+
+    def get(self, key: Hashable, generation: Hashable, version: Hashable = None) -> Any | None:
+        with self._lock:
+            self._sync(generation)
+            item = self._data.get(key)
+            if item is not None and self.ttl > 0 and time.monotonic() - item[0] > self.ttl:
+                del self._data[key]
+                self.expired += 1
+                item = None
+            if item is not None and item[1] != version:
+                del self._data[key]
+                self.stale += 1
+                item = None
+            if item is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[2]
+
+    def put(self, key: Hashable, generation: Hashable, value: Any, version: Hashable = None) -> None:
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            if generation != self._generation:
+                # Another request already saw newer (or older) data; don't mix generations.
+                return
+            self._data[key] = (time.monotonic(), version, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expired": self.expired,
+                "invalidations": self.invalidations,
+                "stale": self.stale,
+            }
@@ -1,20 +1,138 @@
-import os, sqlite3
+import os, queue, sqlite3, threading
 from typing import Iterator
 from dotenv import load_dotenv
 from fastapi import Depends
 
 from mcore.db import connect, init_db
+from mcore.vector_cache import VectorCache
+from .cache import SearchCache
 from mcore.util import norm_path
 
 load_dotenv()
 
+# env var -> connection pragma; unset vars keep SQLite's default except synchronous.
+_PRAGMA_ENV = {
+    "MEMBOX_SQLITE_CACHE_SIZE": "cache_size",
+    "MEMBOX_SQLITE_MMAP_SIZE": "mmap_size",
+    "MEMBOX_SQLITE_TEMP_STORE": "temp_store",
+    "MEMBOX_SQLITE_SYNCHRONOUS": "synchronous",
+    "MEMBOX_SQLITE_BUSY_TIMEOUT": "busy_timeout",
+}
+
 def get_db_path() -> str:
     return norm_path(os.getenv("MEMBOX_DB_PATH", "data/membox.sqlite"))
 
+def sqlite_pragmas() -> dict[str, str]:
+    pragmas = {"synchronous": "NORMAL", "busy_timeout": "5000"}
+    for env, name in _PRAGMA_ENV.items():
+        value = os.getenv(env)
+        if value:
+            pragmas[name] = value
+    return pragmas
+
+
+class ConnectionPool:
+    """Long-lived, pre-initialized connections handed out one request at a time.
+
+    The schema is applied once, when the pool is created. Each connection keeps
+    its own prepared-statement cache, so hot queries are parsed once per
+    connection instead of once per request.
+    """
+
+    def __init__(self, db_path: str, size: int, pragmas: dict[str, str], cached_statements: int = 256) -> None:
+        self.db_path = db_path
+        self.size = size
+        self.pragmas = pragmas
+        self.cached_statements = cached_statements
+        self._idle: queue.LifoQueue[sqlite3.Connection] = queue.LifoQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+        conn = self._open()
+        init_db(conn)
+        self._idle.put(conn)
+
+    def _open(self) -> sqlite3.Connection:
+        self._opened += 1
+        return connect(
+            self.db_path,
+            pragmas=self.pragmas,
+            check_same_thread=False,
+            cached_statements=self.cached_statements,
+        )
+
+    def acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._opened < self.size:
+                return self._open()
+        return self._idle.get()
+
+    def release(self, conn: sqlite3.Connection) -> None:
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    def close(self) -> None:
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+_pools: dict[str, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+def get_pool(db_path: str) -> ConnectionPool:
+    pool = _pools.get(db_path)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(db_path)
+            if pool is None:
+                size = int(os.getenv("MEMBOX_SQLITE_POOL_SIZE", "16"))
+                pool = _pools[db_path] = ConnectionPool(db_path, size, sqlite_pragmas())
+    return pool
+
+def close_pools() -> None:
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
+        _vector_caches.clear()
+        _search_caches.clear()
+
+
+_vector_caches: dict[str, VectorCache] = {}
+
+def get_vector_cache(db_path: str = Depends(get_db_path)) -> VectorCache:
+    cache = _vector_caches.get(db_path)
+    if cache is None:
+        with _pools_lock:
+            cache = _vector_caches.setdefault(db_path, VectorCache(quant=os.getenv("MEMBOX_VECTOR_QUANT") or None))
+    return cache
+
 def get_conn(db_path: str = Depends(get_db_path)) -> Iterator[sqlite3.Connection]:
-    conn = connect(db_path)
-    init_db(conn)
+    pool = get_pool(db_path)
+    conn = pool.acquire()
     try:
         yield conn
     finally:
-        conn.close()
+        pool.release(conn)
+
+
+_search_caches: dict[str, SearchCache] = {}
+
+def get_search_cache(db_path: str = Depends(get_db_path)) -> SearchCache:
+    cache = _search_caches.get(db_path)
+    if cache is None:
+        with _pools_lock:
+            cache = _search_caches.get(db_path)
+            if cache is None:
+                cache = _search_caches[db_path] = SearchCache(
+                    maxsize=int(os.getenv("MEMBOX_SEARCH_CACHE_SIZE", "1024")),
+                    ttl=float(os.getenv("MEMBOX_SEARCH_CACHE_TTL", "300")),
+                )
+    return cache
@@ -0,0 +1,167 @@
+from __future__ import annotations
+
+import queue
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Optional
+
+from mcore.db import connect
+from mcore.indexer import index_pdfs
+from mcore.util import now_iso, uuid4
+from .deps import sqlite_pragmas
+
+TERMINAL = ("done", "failed", "cancelled")
+
+
+@dataclass
+class Job:
+    job_id: str
+    kind: str
+    db_path: str
+    targets: list[str]
+    options: dict[str, Any]
+    status: str = "queued"
+    done: int = 0
+    indexed: int = 0
+    unchanged: int = 0
+    duplicates: int = 0
+    results: list[dict] = field(default_factory=list)
+    errors: list[dict] = field(default_factory=list)
+    detail: Optional[str] = None
+    created_at: str = field(default_factory=now_iso)
+    started_at: Optional[str] = None
+    finished_at: Optional[str] = None
+    cancel_event: threading.Event = field(default_factory=threading.Event, repr=False)
+
+    def snapshot(self) -> dict:
+        return {
+            "job_id": self.job_id,
+            "kind": self.kind,
+            "status": self.status,
+            "total": len(self.targets),
+            "done": self.done,
+            "indexed": self.indexed,
+            "unchanged": self.unchanged,
+            "duplicates": self.duplicates,
+            "failed": len(self.errors),
+            "results": list(self.results),
+            "errors": list(self.errors),
+            "detail": self.detail,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobManager:
+    """Runs ingest/reindex jobs one at a time on a background thread.
+
+    One job runs at a time, so this thread is the only writer. It uses its own
+    connection, outside the request pool, and runs extraction in worker
+    processes, so /search keeps its threads, connections and GIL time while a
+    big ingest runs.
+    """
+
+    def __init__(self, keep_finished: int = 100) -> None:
+        self.keep_finished = keep_finished
+        self._jobs: OrderedDict[str, Job] = OrderedDict()
+        self._queue: queue.Queue[Job | None] = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+
+    def submit(self, kind: str, db_path: str, targets: list[str], options: dict[str, Any]) -> dict:
+        job = Job(job_id=uuid4(), kind=kind, db_path=db_path, targets=targets, options=options)
+        with self._lock:
+            self._jobs[job.job_id] = job
+            self._prune()
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name="membox-jobs", daemon=True)
+                self._thread.start()
+            snap = job.snapshot()
+        self._queue.put(job)
+        return snap
+
+    def get(self, job_id: str) -> dict | None:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return job.snapshot() if job else None
+
+    def list(self) -> list[dict]:
+        with self._lock:
+            return [j.snapshot() for j in reversed(self._jobs.values())]
+
+    def cancel(self, job_id: str) -> dict | None:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            if job.status not in TERMINAL:
+                job.cancel_event.set()
+                if job.status == "queued":
+                    job.status = "cancelled"
+                    job.finished_at = now_iso()
+            return job.snapshot()
+
+    def shutdown(self, timeout: float = 10.0) -> None:
+        with self._lock:
+            for job in self._jobs.values():
+                if job.status not in TERMINAL:
+                    job.cancel_event.set()
+            thread = self._thread
+        self._queue.put(None)
+        if thread is not None:
+            thread.join(timeout)
+
+    def _prune(self) -> None:
+        finished = [j.job_id for j in self._jobs.values() if j.status in TERMINAL]
+        for job_id in finished[:max(0, len(finished) - self.keep_finished)]:
+            del self._jobs[job_id]
+
+    def _loop(self) -> None:
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            if job.cancel_event.is_set():
+                continue
+            self._run(job)
+
+    def _run(self, job: Job) -> None:
+        with self._lock:
+            job.status = "running"
+            job.started_at = now_iso()
+        conn = connect(job.db_path, pragmas=sqlite_pragmas())
+        status, detail = "done", None
+        try:
+            runs = index_pdfs(conn, job.targets, out_of_process=True, **job.options)
+            try:
+                for p, info, err in runs:
+                    with self._lock:
+                        job.done += 1
+                        if err is not None:
+                            job.errors.append({"path": p, "error": str(err)})
+                        else:
+                            if info["status"] == "indexed":
+                                job.indexed += 1
+                            elif info["status"] == "duplicate":
+                                job.duplicates += 1
+                            else:
+                                job.unchanged += 1
+                            job.results.append(info)
+                    if job.cancel_event.is_set():
+                        status = "cancelled"
+                        break
+            finally:
+                runs.close()
+        except Exception as e:  # noqa: BLE001
+            status, detail = "failed", str(e)
+        finally:
+            conn.close()
+        with self._lock:
+            job.status = status
+            job.detail = detail
+            job.finished_at = now_iso()
+
+
+jobs = JobManager()
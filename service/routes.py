@@ -1,13 +1,22 @@
 from __future__ import annotations
 
 import sqlite3
-from typing import List, Optional
+from typing import List, Literal, Optional
 
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import PlainTextResponse
 from pydantic import BaseModel, Field
 
-from mcore.indexer import index_pdf, list_pdfs
-from .deps import get_conn
+from mcore.db import data_generation
+from mcore.embedder import get_embedder
+from mcore.indexer import IndexOptions, list_pdfs
+from mcore.metrics import metrics
+from mcore.search import ensure_doc_embeddings, related as run_related, related_seed, resolve_doc, search as run_search
+from mcore.vector_cache import VectorCache
+from mcore.vector_store import embedding_generation
+from .cache import SearchCache
+from .deps import get_conn, get_db_path, get_search_cache, get_vector_cache
+from .jobs import jobs
 
 router = APIRouter()
 
@@ -21,7 +30,15 @@ class IngestRequest(BaseModel):
     path: str = Field(..., description="PDF file or directory")
     glob: str = Field("*.pdf", description="Glob pattern when path is a directory")
     force: bool = Field(False, description="Force rebuild even if sha256 unchanged")
+    verify: bool = Field(False, description="Re-hash files instead of trusting size/mtime/inode")
+    reextract: bool = Field(False, description="Extract PDFs again instead of reusing cached page text")
     min_chars: int = Field(200, ge=1, description="Merge short pages until reaching this size")
+    workers: int = Field(1, ge=1, le=64, description="Extract/chunk PDFs in N worker processes")
+    split_pages: int = Field(0, ge=0, description="Extract docs longer than this many pages as page ranges in parallel; 0 = off")
+    embed_model: Optional[str] = Field(None, description="Also embed new chunks with this model (e.g. hashed-bow)")
+    dim: int = Field(768, ge=8, le=4096, description="Embedding dim for embed_model")
+    skip_near_dups: bool = Field(False, description="Don't embed new chunks that nearly duplicate an embedded one")
+    text_cache: bool = Field(False, description="Keep extracted page text so later re-chunking skips the PDFs")
 
 
 class IngestResult(BaseModel):
@@ -29,45 +46,57 @@ class IngestResult(BaseModel):
     source_path: str
     status: str
     chunks: Optional[int] = None
+    duplicate_of: Optional[str] = Field(None, description="For status duplicate: the path whose chunks this doc shares")
+    near_duplicates: Optional[int] = Field(None, description="With skip_near_dups: new chunks left unembedded as near-duplicates")
 
 
-class IngestResponse(BaseModel):
+class JobInfo(BaseModel):
+    job_id: str
+    kind: str
+    status: str = Field(..., description="queued, running, done, failed or cancelled")
     total: int
+    done: int
     indexed: int
     unchanged: int
-    results: List[IngestResult]
+    duplicates: int = 0
+    failed: int
+    results: List[IngestResult] = Field(default_factory=list)
     errors: List[OperationError] = Field(default_factory=list)
+    detail: Optional[str] = None
+    created_at: str
+    started_at: Optional[str] = None
+    finished_at: Optional[str] = None
 
 
-@router.post("/ingest", response_model=IngestResponse)
-def ingest(req: IngestRequest, conn: sqlite3.Connection = Depends(get_conn)) -> IngestResponse:
+def _job_options(req: IngestRequest | ReindexRequest) -> dict:
+    options = IndexOptions(
+        min_chars=req.min_chars, embed_model=req.embed_model, dim=req.dim, skip_near_dups=req.skip_near_dups,
+        text_cache=req.text_cache,
+    )
+    return {
+        "options": options, "force": req.force, "verify": req.verify, "reextract": req.reextract,
+        "workers": req.workers, "split_pages": req.split_pages,
+    }
+
+
+def _check_embed_model(model: Optional[str]) -> None:
+    if model is None:
+        return
+    try:
+        get_embedder(model)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.post("/ingest", response_model=JobInfo, status_code=202)
+def ingest(req: IngestRequest, db_path: str = Depends(get_db_path)) -> JobInfo:
+    _check_embed_model(req.embed_model)
     try:
         pdfs = list_pdfs(req.path, glob_pat=req.glob)
     except FileNotFoundError as e:
         raise HTTPException(status_code=404, detail=str(e))
 
-    indexed = unchanged = 0
-    results: list[IngestResult] = []
-    errors: list[OperationError] = []
-
-    for p in pdfs:
-        try:
-            info = index_pdf(conn, p, force=req.force, min_chars=req.min_chars)
-            if info["status"] == "indexed":
-                indexed += 1
-            else:
-                unchanged += 1
-            results.append(IngestResult(**info))
-        except Exception as e:  # noqa: BLE001
-            errors.append(OperationError(path=p, error=str(e)))
-
-    return IngestResponse(
-        total=len(pdfs),
-        indexed=indexed,
-        unchanged=unchanged,
-        results=results,
-        errors=errors,
-    )
+    return JobInfo(**jobs.submit("ingest", db_path, pdfs, _job_options(req)))
 
 
 class SearchRequest(BaseModel):
@@ -75,18 +104,35 @@ class SearchRequest(BaseModel):
     topk: int = Field(10, ge=1, le=100, description="Number of results to return")
     doc: Optional[str] = Field(None, description="Restrict to doc path or doc_id")
     path_prefix: Optional[str] = Field(None, description="Restrict to docs whose path starts with this prefix")
+    folder: Optional[str] = Field(None, description="Restrict to docs in this folder or its subfolders")
     snippet_tokens: int = Field(24, ge=4, description="Token count for snippet()")
     max_chars: int = Field(400, ge=1, description="Max chars of chunk text to return")
+    mode: Literal["fts", "vector", "hybrid"] = Field("fts", description="BM25 only, cosine only, or both fused")
+    fts_limit: int = Field(50, ge=1, le=1000, description="BM25 candidates considered in hybrid mode")
+    vector_limit: int = Field(50, ge=1, le=1000, description="Cosine candidates considered in hybrid mode")
+    fusion: Literal["rrf", "weighted"] = Field("rrf", description="Reciprocal rank fusion or weighted normalized scores")
+    rrf_k: int = Field(60, ge=1, description="RRF rank constant")
+    fts_weight: float = Field(1.0, ge=0.0)
+    vector_weight: float = Field(1.0, ge=0.0)
+    embed_model: str = Field("hashed-bow", description="Embedding model for vector/hybrid")
+    nprobe: int = Field(0, ge=0, description="Search N IVF lists instead of all rows; 0 = exact")
+    rescore: int = Field(0, ge=0, le=1000, description="Re-rank N quantized-matrix candidates at full precision")
+    collapse: bool = Field(False, description="Keep only the best ranked of near-duplicate chunks")
+    use_cache: bool = Field(True, description="Serve/store this result in the search cache")
 
 
 class SearchHit(BaseModel):
     source_path: str
+    paths: List[str] = Field(default_factory=list, description="source_path and every duplicate of that doc")
     page_start: Optional[int]
     page_end: Optional[int]
     chunk_id: str
     score: float
     snippet: str
     text: str
+    fts_rank: Optional[int] = None
+    vector_rank: Optional[int] = None
+    near_duplicates: int = Field(0, description="With collapse: near-duplicate hits folded into this one")
 
 
 class SearchResponse(BaseModel):
@@ -94,86 +140,172 @@ class SearchResponse(BaseModel):
     hits: List[SearchHit]
 
 
+_HYBRID_ONLY = {"fts_limit", "vector_limit", "fusion", "rrf_k", "fts_weight", "vector_weight", "embed_model", "nprobe", "rescore"}
+
+
+def _search_key(req: SearchRequest) -> tuple:
+    """Requests that must return the same hits map to the same key."""
+    fields = req.model_dump(exclude={"use_cache", "query", "path_prefix"} | (_HYBRID_ONLY if req.mode == "fts" else set()))
+    prefix = req.path_prefix.rstrip("/") if req.path_prefix else None
+    return (" ".join(req.query.split()), prefix, *sorted(fields.items()))
+
+
 @router.post("/search", response_model=SearchResponse)
-def search(req: SearchRequest, conn: sqlite3.Connection = Depends(get_conn)) -> SearchResponse:
+def search(
+    req: SearchRequest,
+    conn: sqlite3.Connection = Depends(get_conn),
+    cache: VectorCache = Depends(get_vector_cache),
+    results: SearchCache = Depends(get_search_cache),
+) -> SearchResponse:
     q = req.query.strip()
     if not q:
         raise HTTPException(status_code=400, detail="Query cannot be empty")
 
-    where = []
-    params: list[object] = []
+    key = _search_key(req)
+    gen = data_generation(conn)
+    version = embedding_generation(conn, req.embed_model) if req.mode != "fts" else None
+    if req.use_cache:
+        hits = results.get(key, gen, version)
+        if hits is not None:
+            return SearchResponse(query=q, hits=hits)
 
+    doc_id = None
     if req.doc:
-        row = conn.execute(
-            "SELECT doc_id FROM doc WHERE source_path=? OR doc_id=?",
-            (req.doc, req.doc),
-        ).fetchone()
-        if not row:
+        doc_id = resolve_doc(conn, req.doc)
+        if doc_id is None:
             raise HTTPException(status_code=404, detail=f"No such doc: {req.doc}")
-        where.append("f.doc_id = ?")
-        params.append(row["doc_id"])
-
-    if req.path_prefix:
-        where.append("d.source_path LIKE ?")
-        params.append(req.path_prefix.rstrip("/") + "%")
-
-    where_sql = (" AND " + " AND ".join(where)) if where else ""
-
-    sql = f"""
-    SELECT d.source_path,
-           c.page_start, c.page_end, c.chunk_id,
-           bm25(chunk_fts) AS bm25_score,
-           snippet(chunk_fts, 0, '[', ']', '…', ?) AS snip,
-           substr(c.text, 1, ?) AS text_preview
-    FROM chunk_fts f
-    JOIN doc d ON d.doc_id = f.doc_id
-    JOIN chunk c ON c.chunk_id = f.chunk_id
-    WHERE chunk_fts MATCH ? {where_sql}
-    ORDER BY bm25_score
-    LIMIT ?
-    """
+    if req.mode != "fts":
+        _check_embed_model(req.embed_model)
 
     try:
-        rows = conn.execute(sql, (req.snippet_tokens, req.max_chars, q, *params, req.topk)).fetchall()
+        rows = run_search(
+            conn, q, topk=req.topk, mode=req.mode, doc_id=doc_id, path_prefix=req.path_prefix,
+            snippet_tokens=req.snippet_tokens, max_chars=req.max_chars,
+            fts_limit=req.fts_limit, vector_limit=req.vector_limit, fusion=req.fusion, rrf_k=req.rrf_k,
+            fts_weight=req.fts_weight, vector_weight=req.vector_weight,
+            embed_model=req.embed_model, nprobe=req.nprobe, cache=cache, folder=req.folder, rescore=req.rescore,
+            collapse=req.collapse,
+        )
     except sqlite3.Error as e:
         raise HTTPException(status_code=400, detail=str(e))
 
-    hits: list[SearchHit] = []
-    for r in rows:
-        bm25_score = float(r["bm25_score"]) if r["bm25_score"] is not None else 0.0
-        score = 1.0 / (1.0 + bm25_score)
-        hits.append(
-            SearchHit(
-                source_path=r["source_path"],
-                page_start=r["page_start"],
-                page_end=r["page_end"],
-                chunk_id=r["chunk_id"],
-                score=score,
-                snippet=r["snip"],
-                text=r["text_preview"],
-            )
-        )
-
+    hits = [SearchHit(**r) for r in rows]
+    if req.use_cache:
+        results.put(key, gen, hits, version)
     return SearchResponse(query=q, hits=hits)
 
 
+class FolderInfo(BaseModel):
+    folder_id: int
+    path: str
+    docs: int
+
+
+@router.get("/folders", response_model=List[FolderInfo])
+def list_folders(conn: sqlite3.Connection = Depends(get_conn)) -> List[FolderInfo]:
+    rows = conn.execute("""
+      SELECT f.folder_id, f.path, COUNT(d.doc_id) AS docs
+      FROM folder f LEFT JOIN doc d ON d.folder_id = f.folder_id
+      GROUP BY f.folder_id
+      ORDER BY f.path
+    """).fetchall()
+    return [FolderInfo(**dict(r)) for r in rows]
+
+
+class CacheStats(BaseModel):
+    size: int
+    maxsize: int
+    ttl: float
+    hits: int
+    misses: int
+    hit_rate: float
+    evictions: int
+    expired: int
+    invalidations: int
+    stale: int
+
+
+@router.get("/search/cache", response_model=CacheStats)
+def search_cache_stats(results: SearchCache = Depends(get_search_cache)) -> CacheStats:
+    return CacheStats(**results.stats())
+
+
+class RelatedRequest(BaseModel):
+    query: Optional[str] = Field(None, description="Find chunks related to this text")
+    chunk_id: Optional[str] = Field(None, description="...or to this chunk")
+    doc: Optional[str] = Field(None, description="...or to this doc path/doc_id (with page)")
+    page: Optional[int] = Field(None, ge=1, description="Page number in doc (1-based)")
+    topk: int = Field(10, ge=1, le=100)
+    max_chars: int = Field(200, ge=1, description="Max chars of chunk text to return")
+    embed_model: str = Field("hashed-bow", description="Embedding model name")
+    dim: int = Field(768, ge=8, le=4096, description="Dim used to embed the seed doc's missing chunks")
+    nprobe: int = Field(0, ge=0, description="Search N IVF lists instead of all rows; 0 = exact")
+    rescore: int = Field(0, ge=0, le=1000, description="Re-rank N quantized-matrix candidates at full precision")
+    collapse: bool = Field(False, description="Keep only the best ranked of near-duplicate chunks")
+
+
+class RelatedHit(BaseModel):
+    score: float
+    source_path: str
+    paths: List[str] = Field(default_factory=list, description="source_path and every duplicate of that doc")
+    page_start: Optional[int]
+    page_end: Optional[int]
+    chunk_id: str
+    preview: str
+    near_duplicates: int = Field(0, description="With collapse: near-duplicate hits folded into this one")
+
+
+class RelatedResponse(BaseModel):
+    hits: List[RelatedHit]
+
+
+@router.post("/related", response_model=RelatedResponse)
+def related(
+    req: RelatedRequest,
+    conn: sqlite3.Connection = Depends(get_conn),
+    cache: VectorCache = Depends(get_vector_cache),
+) -> RelatedResponse:
+    _check_embed_model(req.embed_model)
+    try:
+        seed, doc_id = related_seed(conn, query=req.query, chunk_id=req.chunk_id, doc=req.doc, page=req.page)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    if doc_id is not None:
+        ensure_doc_embeddings(conn, doc_id, req.embed_model, req.dim)
+
+    out = run_related(
+        conn, seed, topk=req.topk, embed_model=req.embed_model, nprobe=req.nprobe,
+        max_chars=req.max_chars, cache=cache, rescore=req.rescore, collapse=req.collapse,
+    )
+    if out is None:
+        raise HTTPException(status_code=404, detail=f"No embeddings for model {req.embed_model}; ingest with embed_model set")
+    return RelatedResponse(hits=[RelatedHit(**r) for r in out])
+
+
 class ReindexRequest(BaseModel):
     path: Optional[str] = Field(None, description="If set, reindex this file/dir. Otherwise reindex existing docs")
     glob: str = Field("*.pdf", description="Glob pattern when path is a directory")
     force: bool = Field(True, description="Force rebuild existing entries")
+    verify: bool = Field(False, description="Re-hash files instead of trusting size/mtime/inode")
+    reextract: bool = Field(False, description="Extract PDFs again instead of reusing cached page text")
     min_chars: int = Field(200, ge=1)
-
-
-class ReindexResponse(BaseModel):
-    total: int
-    indexed: int
-    unchanged: int
-    results: List[IngestResult]
-    errors: List[OperationError] = Field(default_factory=list)
-
-
-@router.post("/reindex", response_model=ReindexResponse)
-def reindex(req: ReindexRequest, conn: sqlite3.Connection = Depends(get_conn)) -> ReindexResponse:
+    workers: int = Field(1, ge=1, le=64, description="Extract/chunk PDFs in N worker processes")
+    split_pages: int = Field(0, ge=0, description="Extract docs longer than this many pages as page ranges in parallel; 0 = off")
+    embed_model: Optional[str] = Field(None, description="Also embed new chunks with this model (e.g. hashed-bow)")
+    dim: int = Field(768, ge=8, le=4096, description="Embedding dim for embed_model")
+    skip_near_dups: bool = Field(False, description="Don't embed new chunks that nearly duplicate an embedded one")
+    text_cache: bool = Field(False, description="Keep extracted page text so later re-chunking skips the PDFs")
+
+
+@router.post("/reindex", response_model=JobInfo, status_code=202)
+def reindex(
+    req: ReindexRequest,
+    conn: sqlite3.Connection = Depends(get_conn),
+    db_path: str = Depends(get_db_path),
+) -> JobInfo:
+    _check_embed_model(req.embed_model)
     if req.path:
         try:
             targets = list_pdfs(req.path, glob_pat=req.glob)
@@ -185,25 +317,34 @@ def reindex(req: ReindexRequest, conn: sqlite3.Connection = Depends(get_conn)) -
         if not targets:
             raise HTTPException(status_code=404, detail="No docs found to reindex")
 
-    indexed = unchanged = 0
-    results: list[IngestResult] = []
-    errors: list[OperationError] = []
+    return JobInfo(**jobs.submit("reindex", db_path, targets, _job_options(req)))
 
-    for p in targets:
-        try:
-            info = index_pdf(conn, p, force=req.force, min_chars=req.min_chars)
-            if info["status"] == "indexed":
-                indexed += 1
-            else:
-                unchanged += 1
-            results.append(IngestResult(**info))
-        except Exception as e:  # noqa: BLE001
-            errors.append(OperationError(path=p, error=str(e)))
-
-    return ReindexResponse(
-        total=len(targets),
-        indexed=indexed,
-        unchanged=unchanged,
-        results=results,
-        errors=errors,
-    )
+
+@router.get("/jobs", response_model=List[JobInfo])
+def list_jobs() -> List[JobInfo]:
+    return [JobInfo(**j) for j in jobs.list()]
+
+
+@router.get("/jobs/{job_id}", response_model=JobInfo)
+def get_job(job_id: str) -> JobInfo:
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"No such job: {job_id}")
+    return JobInfo(**job)
+
+
+@router.post("/jobs/{job_id}/cancel", response_model=JobInfo)
+def cancel_job(job_id: str) -> JobInfo:
+    job = jobs.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"No such job: {job_id}")
+    return JobInfo(**job)
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics() -> PlainTextResponse:
+    """Ingest stage timers and counters (this process plus its extraction workers), Prometheus text format."""
+    states = [j["status"] for j in jobs.list()]
+    lines = ["# HELP membox_jobs Background ingest/reindex jobs kept in memory, by status.", "# TYPE membox_jobs gauge"]
+    lines += [f'membox_jobs{{status="{s}"}} {states.count(s)}' for s in sorted(set(states))]
+    return PlainTextResponse(metrics.prometheus() + "\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")